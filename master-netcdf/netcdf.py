@@ -1,9 +1,13 @@
 from netCDF4 import Dataset
 import geopandas
 import xarray
+import rioxarray
 from shapely.geometry import mapping
 import numpy as np
+import datetime
+import glob
 import os
+import importlib.util
 
 cali_shape = geopandas.read_file('data/california_shp/CA_State_TIGER2016.shp')
 
@@ -11,6 +15,17 @@ def close(*closeables):
     for closeable in closeables:
         closeable.close()   
 
+def write_lat_lon(dataset, lat_values, lon_values):
+    lat = dataset.createVariable('lat', np.float64, ('lat',))
+    lat.units = 'degrees_north'
+    lat.long_name = 'latitude'
+    lat[:] = lat_values
+
+    lon = dataset.createVariable('lon', np.float64, ('lon',))
+    lon.units = 'degrees_east'
+    lon.long_name = 'longitude'
+    lon[:] = lon_values
+
 def clip_to_cali(path_to_nc):
     nc = xarray.open_dataarray(path_to_nc)
     nc.rio.set_spatial_dims(x_dim="lon", y_dim="lat", inplace=True)
@@ -22,310 +37,378 @@ def clip_to_cali(path_to_nc):
     return nc
 
 
-def create_burn_netcdf4_file(data_path):
-    burn_windows = Dataset(f"temp-window.nc", "w", format="NETCDF4")
-
-    # Create 3 dimensions for the netcdf4 file: lat, lon, and time
-    burn_windows.createDimension("lat", 227)  # latitude axis 227
-    burn_windows.createDimension("lon", 249)  # longitude axis 249
-    burn_windows.createDimension("day", None)  # unlimited axis (can be appended to)
-
-    lat = burn_windows.createVariable('lat', np.float64, ('lat',))
-    lat.units = 'degrees_north'
-    lat.long_name = 'latitude'
-
-    lon = burn_windows.createVariable('lon', np.float64, ('lon',))
-    lon.units = 'degrees_east'
-    lon.long_name = 'longitude'
-
-    day = burn_windows.createVariable('day', np.float64, ('day',))
-    day.units = 'day'
-    day.long_name = 'day'
-
-    windows_var = burn_windows.createVariable("window", "i1", ("day", "lat", "lon",))
-    windows_var.units = "Boolean"
-
-    # Get lat and lon values
-    temp = Dataset(f"{data_path}rmin_1979.nc", "r")
-    print(temp.variables["lat"])
-
-    clipped = clip_to_cali(f"{data_path}rmin_1979.nc")
-    burn_windows.variables["lon"] = clipped.coords["lon"]
-    burn_windows.variables["lat"] = clipped.coords["lat"]
-    clipped.close()
-
-    return burn_windows
-
-def create_temperature_netcdf4_file(data_path, data_name):
-    yearly_temperatures = Dataset(f"{data_name}-temp-temperature.nc", "w", format="NETCDF4")
-
-    # Create 3 dimensions for the netcdf4 file: lat, lon, and time
-    yearly_temperatures.createDimension("lat", 227)  # latitude axis 227
-    yearly_temperatures.createDimension("lon", 249)  # longitude axis 249
-    yearly_temperatures.createDimension("day", None)  # unlimited axis (can be appended to)
-
-    lat = yearly_temperatures.createVariable('lat', np.float64, ('lat',))
-    lat.units = 'degrees_north'
-    lat.long_name = 'latitude'
-
-    lon = yearly_temperatures.createVariable('lon', np.float64, ('lon',))
-    lon.units = 'degrees_east'
-    lon.long_name = 'longitude'
-
-    day = yearly_temperatures.createVariable('day', np.float64, ('day',))
-    day.units = 'day'
-    day.long_name = 'day'
-
-    windows_var = yearly_temperatures.createVariable("temperature", "f", ("day", "lat", "lon",))
-    windows_var.units = "Celsius"
+# Inputs read from data_path as {name}_{year}.nc. Each is read and clipped once per year.
+input_variables = ["rmin", "rmax", "tmmn", "tmmx", "vs"]
 
-    # Get lat and lon values
-    temp = Dataset(f"{data_path}rmin_1979.nc", "r")
-    print(temp.variables["lat"])
-
-    clipped = clip_to_cali(f"{data_path}rmin_1979.nc")
-    yearly_temperatures.variables["lon"] = clipped.coords["lon"]
-    yearly_temperatures.variables["lat"] = clipped.coords["lat"]
-    clipped.close()
-
-    return yearly_temperatures
-
-def create_humidity_netcdf4_file(data_path, data_name):
-    yearly_humidity = Dataset(f"{data_name}-temp-humidity.nc", "w", format="NETCDF4")
-
-    # Create 3 dimensions for the netcdf4 file: lat, lon, and time
-    yearly_humidity.createDimension("lat", 227)  # latitude axis 227
-    yearly_humidity.createDimension("lon", 249)  # longitude axis 249
-    yearly_humidity.createDimension("day", None)  # unlimited axis (can be appended to)
-
-    lat = yearly_humidity.createVariable('lat', np.float64, ('lat',))
-    lat.units = 'degrees_north'
-    lat.long_name = 'latitude'
-
-    lon = yearly_humidity.createVariable('lon', np.float64, ('lon',))
-    lon.units = 'degrees_east'
-    lon.long_name = 'longitude'
-
-    day = yearly_humidity.createVariable('day', np.float64, ('day',))
-    day.units = 'day'
-    day.long_name = 'day'
-
-    windows_var = yearly_humidity.createVariable("humidity", "f", ("day", "lat", "lon",))
-    windows_var.units = "Percent"
-
-    # Get lat and lon values
-    temp = Dataset(f"{data_path}rmin_1979.nc", "r")
-    print(temp.variables["lat"])
-
-    clipped = clip_to_cali(f"{data_path}rmin_1979.nc")
-    yearly_humidity.variables["lon"] = clipped.coords["lon"]
-    yearly_humidity.variables["lat"] = clipped.coords["lat"]
-    clipped.close()
-
-    return yearly_humidity
-
-
-def create_temp_file():
-    temp = Dataset(f"temp.nc", "w", format="NETCDF4")
-    temp.createDimension("day", None)
-    temp.createDimension("lat", 227)
-    temp.createDimension("lon", 249)
-    temp.createDimension("lower_relative_humidity", None)
-    temp.createDimension("upper_relative_humidity", None)
-    temp.createDimension("lower_air_temperature", None)
-    temp.createDimension("upper_air_temperature", None)
-    temp.createDimension("wind_speed", None)
-
-    temp.createVariable("lower_relative_humidity", "f", ("day", "lat", "lon",))
-    temp.createVariable("upper_relative_humidity", "f", ("day", "lat", "lon",))
-    temp.createVariable("lower_air_temperature", "f", ("day", "lat", "lon",))
-    temp.createVariable("upper_air_temperature", "f", ("day", "lat", "lon",))
-    temp.createVariable("wind_speed", "f", ("day", "lat", "lon",))
-
-    return temp
 
 # Ideal Burn-Window Conditions
 #   Relative humidity: 30-55%: rmin >= 30, rmax <= 55
 #   Wind speed: 2-10 m/s: vs >= 2, vs <= 10
 #   Air Temperature 0-32C: tmmn >= 0C, tmmx <= 32C
-def filter_burn_window(temp):
-    temp.variables["lower_relative_humidity"][:] = np.where(temp.variables["lower_relative_humidity"][:] >= 30, 0, 1)
-    temp.variables["upper_relative_humidity"][:] = np.where(temp.variables["upper_relative_humidity"][:] <= 55, 0, 1)
-    temp.variables["lower_air_temperature"][:] = np.where(temp.variables["lower_air_temperature"][:] >= 237.15, 0, 1)
-    temp.variables["upper_air_temperature"][:] = np.where(temp.variables["upper_air_temperature"][:] <= 305.15, 0, 1)
-    temp.variables["wind_speed"][:] = np.where(
-        ((temp.variables["wind_speed"][:] <= 10) & (temp.variables["wind_speed"][:] >= 2)), 0, 1)
-
-    return temp
-
-
-def create_all_netcdf(data_path, burn_windowss, yearly_avg_tempss, yearly_max_tempss, yearly_min_humiditys):
-    days = 0
-    years_s = [i for i in range(1979, 2029, 5)]
-    years = [i for i in range(1979, 2025)]
+# Each condition is flagged 0 where it holds and 1 where it doesn't, compared at float32.
+def burn_window(rmin, rmax, tmmn, tmmx, vs):
+    lower_relative_humidity = np.where(rmin.astype(np.float32) >= 30, 0, 1)
+    upper_relative_humidity = np.where(rmax.astype(np.float32) <= 55, 0, 1)
+    lower_air_temperature = np.where(tmmn.astype(np.float32) >= 237.15, 0, 1)
+    upper_air_temperature = np.where(tmmx.astype(np.float32) <= 305.15, 0, 1)
+    wind_speed = vs.astype(np.float32)
+    wind_speed = np.where(((wind_speed <= 10) & (wind_speed >= 2)), 0, 1)
+
+    window = lower_relative_humidity == upper_relative_humidity
+    window = window == lower_air_temperature
+    window = window == upper_air_temperature
+    window = window == wind_speed
+    return window
+
+
+# Products derived from the inputs: {name: (inputs, derive, dtype, reduction, packing)}. derive
+# turns a year of the named inputs into a year of the product, stored as dtype. reduction is how
+# the product collapses a range of days, as the service does it; the monthly rollups use it too.
+# packing is (scale_factor, add_offset, _FillValue) for products stored as packed integers,
+# which the service reduces without unpacking. Summed products keep add_offset at 0 so a sum
+# of packed values unpacks with the scale alone. gridMET temperatures are in steps of 0.1 K, so
+# daily averages in °C fall on a 0.05 grid and maxima on a 0.1 grid offset by 0.05; packing on
+# those grids loses nothing.
+# A new product only needs an entry here; the build reads no more inputs for it than it names.
+products = {
+    "window": (input_variables, burn_window, np.uint32, np.sum, None),
+    "temperature_avg": (["tmmn", "tmmx"], lambda tmmn, tmmx: (tmmn + tmmx) / 2 - 273.15, np.int16, np.sum,
+                        (0.05, 0.0, -32768)),
+    "temperature_max": (["tmmx"], lambda tmmx: tmmx - 273.15, np.int16, np.max, (0.1, 0.05, -32768)),
+    "humidity_min": (["rmin"], lambda rmin: rmin, np.uint8, np.min, (1.0, 0.0, 255)),
+}
+
+
+# Packs values into dtype as round((value - add_offset) / scale_factor). NaN becomes the fill
+# value, and valid values are clipped to the rest of dtype's range so none collide with it.
+def pack(values, packing, dtype):
+    scale_factor, add_offset, fill = packing
+    limits = np.iinfo(dtype)
+    low, high = (limits.min + 1, limits.max) if fill == limits.min else (limits.min, limits.max - 1)
+
+    packed = np.clip(np.round((values - add_offset) / scale_factor), low, high)
+    return np.where(np.isnan(packed), fill, packed).astype(dtype)
+
+# Clipped gridMET inputs kept for the service to evaluate burn windows with custom thresholds,
+# packed as gridMET packs them: value = stored * scale_factor + add_offset, (scale_factor, add_offset)
+variable_cubes = {
+    "rmin": (0.1, 0.0),
+    "rmax": (0.1, 0.0),
+    "tmmn": (0.1, 220.0),
+    "tmmx": (0.1, 220.0),
+    "vs": (0.1, 0.0),
+}
+
+
+def create_variable_cube_file(name, begin, end, lat_values, lon_values):
+    days_in_shard = (datetime.date(end, 1, 1) - datetime.date(begin, 1, 1)).days
+    cube = Dataset(f"{name}_{begin}_{end}.nc", "w", format="NETCDF4")
+
+    cube.createDimension("time", days_in_shard)
+    cube.createDimension("lat", len(lat_values))
+    cube.createDimension("lon", len(lon_values))
+
+    write_lat_lon(cube, lat_values, lon_values)
+
+    cube.createVariable('time', np.float64, ('time',))
+
+    # Cells outside the state are stored as the fill value
+    scale_factor, add_offset = variable_cubes[name]
+    values = cube.createVariable(name, "u2", ("time", "lat", "lon",), fill_value=np.uint16(65535))
+    values.scale_factor = scale_factor
+    values.add_offset = add_offset
+
+    return cube
+
+
+# netCDF4 packs the values into the cube's integers as it writes them
+def write_variable_cube(cube, name, days, clipped):
+    cube.variables["time"][days:days + clipped.shape[0]] = clipped.coords["day"].astype(np.float64)
+    cube.variables[name][days:days + clipped.shape[0], :, :] = np.ma.masked_invalid(clipped.data)
+
+
+def write_product_shard(name, begin, end, values, days, lat, lon):
+    product_array = xarray.DataArray(values, coords=[days, lat, lon], dims=['time', 'lat', 'lon'])
+    packing = products[name][4]
+    if packing is not None:
+        product_array.attrs.update(scale_factor=packing[0], add_offset=packing[1], _FillValue=packing[2])
+    product_array.rio.write_crs("epsg:4326", inplace=True)
+    product_array.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
+    product_array.to_netcdf(f'{name}_{begin}_{end}.nc')
+
+
+# A product's shard as a (time, lat, lon) DataArray. The file also holds the spatial_ref variable.
+# Packed products are unpacked to floats unless mask_and_scale is False.
+def open_product_shard(path, mask_and_scale=True):
+    return xarray.open_dataset(path, mask_and_scale=mask_and_scale)["__xarray_dataarray_variable__"]
+
+
+# Writes one set of 5-year shards for every 5 years from first_year up to end_year. Each year's
+# inputs are read and clipped once, and every product and variable cube is filled from that read.
+def create_all_netcdf(data_path, first_year=1979, end_year=2024):
+    years_s = [i for i in range(first_year, end_year + 1, 5)]
+    needed_inputs = [name for name in input_variables
+                     if name in variable_cubes or any(name in inputs for inputs, _, _, _, _ in products.values())]
 
     for start in range(len(years_s)-1):
         days = 0
         begin = years_s[start]
         end = years_s[start + 1]
-        years = [i for i in range(begin, end)]
-        burn_windows = create_burn_netcdf4_file(data_path)
-        yearly_avg_temps = create_temperature_netcdf4_file(data_path, "avg")
-        yearly_max_temps = create_temperature_netcdf4_file(data_path, "max")
-        yearly_min_humidity = create_humidity_netcdf4_file(data_path, "min")
-
-        firstyear = False
-        for year in years:
+        days_in_shard = (datetime.date(end, 1, 1) - datetime.date(begin, 1, 1)).days
+        shards, cubes, day_coords = None, None, []
+
+        for year in range(begin, end):
             print(f"Filtering {year} ---")
 
-            temp = create_temp_file()
-
-            rmin = clip_to_cali(f"{data_path}rmin_{year}.nc")
-            temp.variables["lower_relative_humidity"][:] = rmin.data
-            if firstyear:
-                 burn_windows.variables["day"][:] = rmin.coords["day"].astype(np.float64)
-            else:
-                burn_windows.variables["day"][:] = np.append(burn_windows.variables["day"][:], rmin.coords["day"].astype(np.float64))
-            close(rmin)
-            print("Added rmin to temp")
-
-            # Min humidity and add 365 days of data for each year
-            if firstyear:
-                 yearly_min_humidity.variables["day"][:] = rmin.coords["day"].astype(np.float64)
-            else:
-                yearly_min_humidity.variables["day"][:] = np.append(yearly_min_humidity.variables["day"][:], rmin.coords["day"].astype(np.float64))
-            yearly_min_humidity.variables["humidity"][days:days + len(temp.dimensions["day"]), :, :] = rmin.data
-            print("Added humidity data to yearly_max_temps")
-
-            rmax = clip_to_cali(f"{data_path}rmax_{year}.nc")
-            temp.variables["upper_relative_humidity"][:] = rmax.data
-            close(rmax)
-            print("Added rmax to temp")
-
-            tmmn = clip_to_cali(f"{data_path}tmmn_{year}.nc")
-            temp.variables["lower_air_temperature"][:] = tmmn.data
-            close(tmmn)
-            print("Added tmmn to temp")
-
-            tmmx = clip_to_cali(f"{data_path}tmmx_{year}.nc")
-            temp.variables["upper_air_temperature"][:] = tmmx.data
-            close(tmmx)
-            print("Added tmmx to temp")
-
-            # Average temperature min and max, convert to celsius, and add 365 days of data for each year
-            tmav = (tmmn + tmmx) / 2
-            tmav_C = (tmav - 273.15)
-            if firstyear:
-                yearly_avg_temps.variables["day"][:] = tmav_C.coords["day"].astype(np.float64)
-            else:
-                yearly_avg_temps.variables["day"][:] = np.append(yearly_avg_temps.variables["day"][:], tmav_C.coords["day"].astype(np.float64))
-            yearly_avg_temps.variables["temperature"][days:days + len(temp.dimensions["day"]), :, :] = tmav_C.data
-            print("Added temperature data to yearly_avg_temps")
-
-            # Highest temperature, convert to celsius, and add 365 days of data for each year
-            tmmx_C = tmmx - 273.15
-            if firstyear:
-                yearly_max_temps.variables["day"][:] = tmmx_C.coords["day"].astype(np.float64)
-            else:
-                yearly_max_temps.variables["day"][:] = np.append(yearly_max_temps.variables["day"][:], tmmx_C.coords["day"].astype(np.float64))
-            yearly_max_temps.variables["temperature"][days:days + len(temp.dimensions["day"]), :, :] = tmmx_C.data
-            print("Added temperature data to yearly_max_temps")
-
-            vs = clip_to_cali(f"{data_path}vs_{year}.nc")
-            temp.variables["wind_speed"][:] = vs.data
-            close(vs)
-            print("Added vs to temp")
-
-            temp = filter_burn_window(temp)
-
-            temp_arr = temp.variables["lower_relative_humidity"][:] == temp.variables["upper_relative_humidity"][:]
-            temp_arr = temp_arr == temp.variables["lower_air_temperature"][:]
-            temp_arr = temp_arr == temp.variables["upper_air_temperature"][:]
-            temp_arr = temp_arr == temp.variables["wind_speed"][:]
-            temp_arr.astype(int)
+            clipped = {}
+            for name in needed_inputs:
+                clipped[name] = clip_to_cali(f"{data_path}{name}_{year}.nc")
+                print(f"Clipped {name}")
+            first = clipped[needed_inputs[0]]
+            lat, lon = first.coords["lat"], first.coords["lon"]
+
+            if shards is None:
+                shards = {name: np.empty((days_in_shard, len(lat), len(lon)), dtype=dtype)
+                          for name, (_, _, dtype, _, _) in products.items()}
+                cubes = {name: create_variable_cube_file(name, begin, end, lat, lon) for name in variable_cubes}
+
+            year_days = first.shape[0]
+            for name, (inputs, derive, dtype, _, packing) in products.items():
+                values = derive(*[clipped[input_name].data for input_name in inputs])
+                shards[name][days:days + year_days] = values if packing is None else pack(values, packing, dtype)
+                print(f"Added {name} data")
+
+            for name in variable_cubes:
+                write_variable_cube(cubes[name], name, days, clipped[name])
+            print("Added variable cubes")
+
+            day_coords.append(first.coords["day"].astype(np.float64).values)
+            close(*clipped.values())
 
             # About 365 days will be added for each year
-            burn_windows.variables["window"][days:days + len(temp.dimensions["day"]), :, :] = temp_arr
-            days += len(temp.dimensions["day"])
+            days += year_days
             print(days)
 
-            close(temp)
-
         print("Finished year iteration")
 
-        # Create a netcdf4 file named window.nc
-        window_array = xarray.DataArray(
-            coords=[burn_windows.variables['day'][:], burn_windows.variables['lat'][:], burn_windows.variables['lon'][:]],
-            dims=['time', 'lat', 'lon'])
-        window_array.data = burn_windows.variables['window'][:]
-        window_array = window_array.astype('uint32')
-        window_array.rio.write_crs("epsg:4326", inplace=True)
-        window_array.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
-        window_array.to_netcdf(f'window_{begin}_{end}.nc')
-
-        #create a netcdf4 file named temperature_avg.nc
-        temperature_avg_array = xarray.DataArray(
-            coords=[yearly_avg_temps.variables['day'][:], yearly_avg_temps.variables['lat'][:], yearly_avg_temps.variables['lon'][:]],
-            dims=['time', 'lat', 'lon'])
-        temperature_avg_array.data = yearly_avg_temps.variables['temperature'][:]
-        temperature_avg_array = temperature_avg_array.astype('float32')
-        temperature_avg_array.rio.write_crs("epsg:4326", inplace=True)
-        temperature_avg_array.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
-        temperature_avg_array.to_netcdf(f'temperature_avg_{begin}_{end}.nc')
-
-        #create a netcdf4 file named temperature_max.nc
-        temperature_max_array = xarray.DataArray(
-            coords=[yearly_max_temps.variables['day'][:], yearly_max_temps.variables['lat'][:], yearly_max_temps.variables['lon'][:]],
-            dims=['time', 'lat', 'lon'])
-        temperature_max_array.data = yearly_max_temps.variables['temperature'][:]
-        temperature_max_array = temperature_max_array.astype('float32')
-        temperature_max_array.rio.write_crs("epsg:4326", inplace=True)
-        temperature_max_array.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
-        temperature_max_array.to_netcdf(f'temperature_max_{begin}_{end}.nc')
-
-        #create a netcdf4 file named humidity_min.nc
-        humidity_min_array = xarray.DataArray(
-            coords=[yearly_min_humidity.variables['day'][:], yearly_min_humidity.variables['lat'][:], yearly_min_humidity.variables['lon'][:]],
-            dims=['time', 'lat', 'lon'])
-        humidity_min_array.data = yearly_min_humidity.variables['humidity'][:]
-        humidity_min_array = humidity_min_array.astype('uint32')
-        humidity_min_array.rio.write_crs("epsg:4326", inplace=True)
-        humidity_min_array.rio.set_spatial_dims(x_dim="lon", y_dim="lat")
-        humidity_min_array.to_netcdf(f'humidity_min_{begin}_{end}.nc')
-
-        close(burn_windows)
-        close(yearly_avg_temps)
-        close(yearly_max_temps)
-        close(yearly_min_humidity)
+        for name in products:
+            write_product_shard(name, begin, end, shards[name][:days], np.concatenate(day_coords), lat, lon)
+        close(*cubes.values())
+
+
+# Rewrites a product's 5-year shards as a single pixel-major file (lat, lon, time) where each
+# pixel's whole record is one chunk, so the service can read a point's time series in one go.
+# shard_begin/shard_offset map each shard's first year to where its days start along time.
+def create_pixel_major_netcdf(name, band_rows=8):
+    shard_paths = sorted(glob.glob(f"{name}_[0-9]*_[0-9]*.nc"))
+    shards = [open_product_shard(path, mask_and_scale=False) for path in shard_paths]
+    shard_days = [shard.shape[0] for shard in shards]
+    total_days = sum(shard_days)
+
+    pixels = Dataset(f"{name}_pixels.nc", "w", format="NETCDF4")
+    pixels.createDimension("lat", shards[0].shape[1])
+    pixels.createDimension("lon", shards[0].shape[2])
+    pixels.createDimension("time", total_days)
+    pixels.createDimension("shard", len(shards))
+
+    write_lat_lon(pixels, shards[0].coords['lat'].values, shards[0].coords['lon'].values)
+
+    time = pixels.createVariable('time', np.float64, ('time',))
+    time[:] = np.concatenate([shard.coords['time'].values for shard in shards])
+
+    shard_begin = pixels.createVariable('shard_begin', np.int32, ('shard',))
+    shard_begin[:] = [int(os.path.basename(path).split("_")[-2]) for path in shard_paths]
+    shard_offset = pixels.createVariable('shard_offset', np.int64, ('shard',))
+    shard_offset[:] = np.cumsum([0] + shard_days[:-1])
+
+    # Packed products stay packed, with the shards' packing, so readers unpack them the same way
+    packing = products[name][4]
+    series = pixels.createVariable(name, shards[0].dtype, ("lat", "lon", "time",), chunksizes=(1, 1, total_days),
+                                   zlib=True, fill_value=None if packing is None else packing[2])
+    if packing is not None:
+        series.scale_factor, series.add_offset = packing[0], packing[1]
+        series.set_auto_maskandscale(False)
+
+    # Transpose a band of rows at a time so memory stays at band_rows full-record rows
+    for row in range(0, shards[0].shape[1], band_rows):
+        print(f"Writing {name} pixel rows {row}-{row + band_rows}")
+        band = np.concatenate([shard[:, row:row + band_rows, :].values for shard in shards], axis=0)
+        series[row:row + band_rows, :, :] = np.moveaxis(band, 0, -1)
+
+    close(*shards)
+    close(pixels)
+
+
+# Reduces a product's shards to one grid per calendar month, plus the number of days in it.
+# Month k is (year - first_year) * 12 + (month - 1), so the same month across years is a stride of 12.
+def create_monthly_rollup_netcdf(name):
+    shard_paths = sorted(glob.glob(f"{name}_[0-9]*_[0-9]*.nc"))
+    first_year = int(os.path.basename(shard_paths[0]).split("_")[-2])
+
+    rollup = None
+    for path in shard_paths:
+        begin = int(os.path.basename(path).split("_")[-2])
+        shard = open_product_shard(path)
+
+        if rollup is None:
+            rollup = Dataset(f"{name}_monthly.nc", "w", format="NETCDF4")
+            rollup.first_year = first_year
+            rollup.createDimension("lat", shard.shape[1])
+            rollup.createDimension("lon", shard.shape[2])
+            rollup.createDimension("month", None)
+
+            write_lat_lon(rollup, shard.coords['lat'].values, shard.coords['lon'].values)
+
+            days = rollup.createVariable('days', np.int32, ('month',))
+            value = rollup.createVariable('value', np.float64 if products[name][3] is np.sum else shard.dtype,
+                                          ("month", "lat", "lon",), chunksizes=(1, shard.shape[1], shard.shape[2]), zlib=True)
+
+        # Day k of a shard is k days after January 1st of its first year
+        dates = [datetime.date(begin, 1, 1) + datetime.timedelta(days=k) for k in range(shard.shape[0])]
+        keys = np.array([(date.year - first_year) * 12 + date.month - 1 for date in dates])
+
+        for key in np.unique(keys):
+            in_month = np.flatnonzero(keys == key)
+            print(f"Rolling up {name} month {key}")
+            value[key, :, :] = products[name][3](shard[in_month[0]:in_month[-1] + 1].values, axis=0)
+            days[key] = len(in_month)
+
+        close(shard)
+    close(rollup)
+
+
+# Per-pixel histogram bins of the products percentiles are served for: (lowest edge, bin width, bins),
+# in the products' units. Values outside the bins are counted in the first or last one.
+histograms = {
+    "temperature_avg": (-30.0, 1.0, 80),
+    "temperature_max": (-25.0, 1.0, 80),
+    "humidity_min": (0.0, 2.0, 50),
+}
+
+
+# histogram_counts(values, low, width, bins) from the service, loaded by path rather than through the
+# flaskr package, so the builder and the service always bin days the same way, without importing Flask
+histogram_spec = importlib.util.spec_from_file_location(
+    "histogram", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "service", "flaskr", "histogram.py"))
+histogram_module = importlib.util.module_from_spec(histogram_spec)
+histogram_spec.loader.exec_module(histogram_module)
+histogram_counts = histogram_module.histogram_counts
+
+
+# Cumulative per-pixel histograms of a product at the end of every calendar month, numbered like the
+# monthly rollups. The histogram of whole months k..j is counts[j] - counts[k - 1] for any k and j.
+def create_histogram_netcdf(name, band_rows=32):
+    low, width, bins = histograms[name]
+    shard_paths = sorted(glob.glob(f"{name}_[0-9]*_[0-9]*.nc"))
+    first_year = int(os.path.basename(shard_paths[0]).split("_")[-2])
+
+    histogram, cumulative = None, None
+    for path in shard_paths:
+        begin = int(os.path.basename(path).split("_")[-2])
+        shard = open_product_shard(path, mask_and_scale=False)
+
+        if histogram is None:
+            histogram = Dataset(f"{name}_histogram.nc", "w", format="NETCDF4")
+            histogram.first_year = first_year
+            histogram.bin_low = low
+            histogram.bin_width = width
+            histogram.createDimension("lat", shard.shape[1])
+            histogram.createDimension("lon", shard.shape[2])
+            histogram.createDimension("bin", bins)
+            histogram.createDimension("month", None)
+
+            write_lat_lon(histogram, shard.coords['lat'].values, shard.coords['lon'].values)
+
+            # Cumulative counts stay below 65536 for well over a century of daily data
+            counts = histogram.createVariable('counts', np.uint16, ("month", "lat", "lon", "bin"),
+                                              chunksizes=(1, shard.shape[1], shard.shape[2], bins),
+                                              zlib=True, shuffle=True)
+            cumulative = np.zeros((shard.shape[1], shard.shape[2], bins), dtype=np.uint32)
+
+        # Unpacked the same way the service unpacks what it reads, so both put a value in the same bin
+        packing = products[name][4]
+        dates = [datetime.date(begin, 1, 1) + datetime.timedelta(days=k) for k in range(shard.shape[0])]
+        keys = np.array([(date.year - first_year) * 12 + date.month - 1 for date in dates])
+
+        for key in np.unique(keys):
+            in_month = np.flatnonzero(keys == key)
+            print(f"Binning {name} month {key}")
+            for row in range(0, shard.shape[1], band_rows):
+                values = shard[in_month[0]:in_month[-1] + 1, row:row + band_rows].values.astype(np.float64)
+                if packing is not None:
+                    values = np.where(values == packing[2], np.nan, values * packing[0] + packing[1])
+                cumulative[row:row + band_rows] += histogram_counts(values, low, width, bins).astype(np.uint32)
+            counts[key, :, :, :] = cumulative
+
+        close(shard)
+    close(histogram)
+
+
+# Run-length encodes the burn window: every run of consecutive window days at a pixel as its first
+# day (days since the first shard's January 1st), its length and its cell (lat index * lon + lon
+# index). Runs of up to lookback days are ordered by first day, and day_offset[d] is the first of
+# them starting on day d or later, so the ones that can overlap a range of days are one contiguous
+# slice. The few longer runs, such as cells outside the state that never close, are kept apart.
+def create_window_runs_netcdf(band_rows=8, lookback=366):
+    shard_paths = sorted(glob.glob("window_[0-9]*_[0-9]*.nc"))
+    shards = [open_product_shard(path) for path in shard_paths]
+    total_days = sum(shard.shape[0] for shard in shards)
+    lat_count, lon_count = shards[0].shape[1], shards[0].shape[2]
+
+    # Runs along time for a band of rows at a time, over the whole record
+    starts, lengths, cells = [], [], []
+    for row in range(0, lat_count, band_rows):
+        print(f"Encoding window runs of rows {row}-{row + band_rows}")
+        band = np.concatenate([shard[:, row:row + band_rows, :].values > 0 for shard in shards], axis=0)
+        band = np.moveaxis(band, 0, -1).reshape(-1, total_days)
+        edges = np.diff(np.pad(band, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        start_cells, start_days = np.nonzero(edges == 1)
+        _, end_days = np.nonzero(edges == -1)
+        starts.append(start_days.astype(np.int32))
+        lengths.append((end_days - start_days).astype(np.int32))
+        cells.append((start_cells + row * lon_count).astype(np.int32))
+
+    starts, lengths, cells = np.concatenate(starts), np.concatenate(lengths), np.concatenate(cells)
+    long_runs = lengths > lookback
+    order = np.lexsort((cells[~long_runs], starts[~long_runs]))
+
+    runs = Dataset("window_runs.nc", "w", format="NETCDF4")
+    runs.first_day = (datetime.date(int(os.path.basename(shard_paths[0]).split("_")[-2]), 1, 1) - datetime.date(1979, 1, 1)).days
+    runs.lookback = lookback
+    runs.createDimension("lat", lat_count)
+    runs.createDimension("lon", lon_count)
+    runs.createDimension("day", total_days + 1)
+    runs.createDimension("run", len(order))
+    runs.createDimension("long_run", int(long_runs.sum()))
+
+    write_lat_lon(runs, shards[0].coords['lat'].values, shards[0].coords['lon'].values)
+
+    day_offset = runs.createVariable('day_offset', np.int64, ('day',))
+    day_offset[:] = np.searchsorted(starts[~long_runs][order], np.arange(total_days + 1))
+    for prefix, dimension, selected in [("run", "run", np.flatnonzero(~long_runs)[order]),
+                                        ("long_run", "long_run", np.flatnonzero(long_runs))]:
+        for name, values in [("start", starts), ("length", lengths), ("cell", cells)]:
+            variable = runs.createVariable(f"{prefix}_{name}", np.int32, (dimension,),
+                                           chunksizes=(min(max(len(selected), 1), 1 << 18),), zlib=True, shuffle=True)
+            variable[:] = values[selected]
+
+    close(*shards)
+    close(runs)
 
 
 def run(data_path):
-    #burn_windows = create_burn_netcdf4_file(data_path)
-    #yearly_avg_temps = create_temperature_netcdf4_file(data_path, "avg")
-    #yearly_max_temps = create_temperature_netcdf4_file(data_path, "max")
-    #yearly_min_humidity = create_humidity_netcdf4_file(data_path, "min")
-    create_all_netcdf(data_path, 0,0,0,0)# burn_windows, yearly_avg_temps, yearly_max_temps, yearly_min_humidity)
-    #close(burn_windows)
-    #close(yearly_avg_temps)
-    #close(yearly_max_temps)
-    #close(yearly_min_humidity)
+    create_all_netcdf(data_path)
+    for name in products:
+        create_pixel_major_netcdf(name)
+        create_monthly_rollup_netcdf(name)
+        if name in histograms:
+            create_histogram_netcdf(name)
+    create_window_runs_netcdf()
 
 
 if __name__ == "__main__":
     # create unmasked folder in /data directory and run download.sh script in /unmasked to create required .nc files
     # a windows.nc file should be created as the end result
     run("data/unmasked/")
-    if os.path.exists("temp.nc"):
-        os.remove("temp.nc")
-    if os.path.exists("temp-window.nc"):
-        os.remove("temp-window.nc")
-    if os.path.exists("temp-temperature.nc"):
-        os.remove("temp-temperature.nc")
-    if os.path.exists("avg-temp-temperature.nc"):
-        os.remove("avg-temp-temperature.nc")
-    if os.path.exists("max-temp-temperature.nc"):
-        os.remove("max-temp-temperature.nc")
-    if os.path.exists("min-temp-humidity.nc"):
-        os.remove("min-temp-humidity.nc")
 
     
@@ -0,0 +1,159 @@
+# Synthetic stand-ins for the gridMET downloads the builder reads and for the 5-year shards it
+# writes, on the real grid, so the builder and the service can be benchmarked offline.
+import os
+import datetime
+import numpy as np
+import xarray
+from netCDF4 import Dataset
+
+# The gridMET grid: 1/24 degree cells over the contiguous US, latitude descending
+gridmet_lat = 49.4 - np.arange(585) / 24.0
+gridmet_lon = -124.7666666333333 + np.arange(1386) / 24.0
+
+# Rows and columns of gridMET that clipping to California keeps: the 227x249 grid of the shards
+california_rows = slice(178, 178 + 227)
+california_cols = slice(7, 7 + 249)
+
+# (scale_factor, add_offset, _FillValue, dtype) of the products the builder writes packed
+packed_products = {
+    "temperature_avg": (0.05, 0.0, -32768, np.int16),
+    "temperature_max": (0.1, 0.05, -32768, np.int16),
+    "humidity_min": (1.0, 0.0, 255, np.uint8),
+}
+
+# Inputs cover California and a few cells around it, unless the whole of gridMET is asked for
+margin = 8
+california_extent = (slice(max(0, california_rows.start - margin), california_rows.stop + margin),
+                     slice(max(0, california_cols.start - margin), california_cols.stop + margin))
+conus_extent = (slice(None), slice(None))
+
+# gridMET variable per input file, with its packing (scale_factor, add_offset), units and
+# the typical (low, high) of its seasonal cycle
+gridmet_variables = {
+    "rmin": ("relative_humidity", 0.1, 0.0, "%", (15.0, 45.0)),
+    "rmax": ("relative_humidity", 0.1, 0.0, "%", (40.0, 90.0)),
+    "tmmn": ("air_temperature", 0.1, 220.0, "K", (270.0, 288.0)),
+    "tmmx": ("air_temperature", 0.1, 220.0, "K", (285.0, 308.0)),
+    "vs": ("wind_speed", 0.1, 0.0, "m/s", (1.0, 7.0)),
+}
+
+# Days written at a time, so the whole-US inputs never need a full year in memory
+write_days = 31
+
+
+def days_in_year(year):
+    return (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+
+
+# A smooth seasonal cycle between low and high that also varies across the grid, plus daily noise
+def seasonal_field(rng, first_day, days, lat, lon, low, high):
+    season = 0.5 - 0.5 * np.cos(2 * np.pi * (first_day + np.arange(days)) / 365.25)
+    gradient = (lat[:, None] - lat.min()) / np.ptp(lat) * 0.3 + (lon[None, :] - lon.min()) / np.ptp(lon) * 0.2
+    field = season[:, None, None] * 0.7 + gradient[None, :, :]
+    noise = rng.standard_normal((days, len(lat), len(lon)), dtype=np.float32) * 0.08
+    return (low + (high - low) * (field + noise)).astype(np.float32)
+
+
+# {name}_{year}.nc laid out like a gridMET download: packed uint16 values along (day, lat, lon)
+def write_gridmet_year(path, name, year, extent=california_extent, seed=0):
+    variable, scale, offset, units, (low, high) = gridmet_variables[name]
+    lat, lon = gridmet_lat[extent[0]], gridmet_lon[extent[1]]
+    rng = np.random.default_rng([seed, year, list(gridmet_variables).index(name)])
+    days = days_in_year(year)
+    first_day = (datetime.date(year, 1, 1) - datetime.date(1900, 1, 1)).days
+
+    partial = f"{path}.partial"
+    with Dataset(partial, "w", format="NETCDF4") as nc:
+        nc.createDimension("day", days)
+        nc.createDimension("lat", len(lat))
+        nc.createDimension("lon", len(lon))
+
+        day_var = nc.createVariable("day", np.float64, ("day",))
+        day_var.units = "days since 1900-01-01 00:00:00"
+        day_var.calendar = "gregorian"
+        day_var[:] = first_day + np.arange(days)
+
+        lat_var = nc.createVariable("lat", np.float64, ("lat",))
+        lat_var.units = "degrees_north"
+        lat_var.standard_name = "latitude"
+        lat_var[:] = lat
+
+        lon_var = nc.createVariable("lon", np.float64, ("lon",))
+        lon_var.units = "degrees_east"
+        lon_var.standard_name = "longitude"
+        lon_var[:] = lon
+
+        values = nc.createVariable(variable, np.uint16, ("day", "lat", "lon"), zlib=True, complevel=1,
+                                   fill_value=np.uint16(32767), chunksizes=(61, min(98, len(lat)), min(277, len(lon))))
+        values.scale_factor = scale
+        values.add_offset = offset
+        values.units = units
+
+        for day in range(0, days, write_days):
+            chunk = min(write_days, days - day)
+            values[day:day + chunk] = seasonal_field(rng, day, chunk, lat, lon, low, high)
+
+    os.replace(partial, path)
+
+
+def write_gridmet_inputs(directory, years, extent=california_extent):
+    os.makedirs(directory, exist_ok=True)
+    for year in years:
+        for name in gridmet_variables:
+            path = os.path.join(directory, f"{name}_{year}.nc")
+            if not os.path.exists(path):
+                print(f"Writing synthetic {name}_{year}.nc")
+                write_gridmet_year(path, name, year, extent)
+
+
+# Synthetic (days, lat, lon) values of a product for a shard, packed as the builder writes it
+def product_values(name, rng, first_day, days, lat, lon):
+    if name == "window":
+        chance = seasonal_field(rng, first_day, days, lat, lon, 0.0, 0.6)
+        return (rng.random(chance.shape, dtype=np.float32) < chance).astype(np.uint32)
+    if name == "temperature_avg":
+        values = seasonal_field(rng, first_day, days, lat, lon, 2.0, 24.0)
+    elif name == "temperature_max":
+        values = seasonal_field(rng, first_day, days, lat, lon, 12.0, 35.0)
+    else:
+        values = np.clip(seasonal_field(rng, first_day, days, lat, lon, 15.0, 45.0), 1, 100)
+    scale, offset, _, dtype = packed_products[name]
+    return np.round((values - offset) / scale).astype(dtype)
+
+
+# {name}_{begin}_{begin + 5}.nc shards, as create_all_netcdf writes them, for every 5 years from
+# first_year up to end_year. Like the builder's, they hold a spatial_ref variable next to the data.
+def write_shards(directory, first_year, end_year, product_names, seed=0):
+    import rioxarray
+    os.makedirs(directory, exist_ok=True)
+    lat, lon = gridmet_lat[california_rows], gridmet_lon[california_cols]
+
+    for begin in range(first_year, end_year, 5):
+        years = range(begin, begin + 5)
+        days = sum(days_in_year(year) for year in years)
+        first_day = (datetime.date(begin, 1, 1) - datetime.date(1900, 1, 1)).days
+
+        for index, name in enumerate(product_names):
+            path = os.path.join(directory, f"{name}_{begin}_{begin + 5}.nc")
+            if os.path.exists(path):
+                continue
+            print(f"Writing synthetic {name}_{begin}_{begin + 5}.nc")
+            rng = np.random.default_rng([seed, begin, index])
+
+            values = None
+            day = 0
+            for year in years:
+                year_values = product_values(name, rng, day, days_in_year(year), lat, lon)
+                if values is None:
+                    values = np.empty((days,) + year_values.shape[1:], dtype=year_values.dtype)
+                values[day:day + len(year_values)] = year_values
+                day += len(year_values)
+
+            shard = xarray.DataArray(values, coords=[first_day + np.arange(days, dtype=np.float64), lat, lon],
+                                     dims=['time', 'lat', 'lon'])
+            if name in packed_products:
+                scale, offset, fill, _ = packed_products[name]
+                shard.attrs.update(scale_factor=scale, add_offset=offset, _FillValue=fill)
+            shard.rio.write_crs("epsg:4326", inplace=True)
+            shard.to_netcdf(f"{path}.partial", format="NETCDF4")
+            os.replace(f"{path}.partial", path)
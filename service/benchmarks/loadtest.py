@@ -0,0 +1,268 @@
+# Drives /query and /county with many concurrent clients against synthetic shards, to find how
+# much concurrency one box sustains before latency collapses.
+#
+#   python benchmarks/loadtest.py [--concurrency 1,2,4,8] [--duration 30]
+#                                 [--mix query:short:1,county:medium:2] [--server] [--s3]
+#
+# Run from the service directory. Requests run in-process through Flask's test client, or over
+# HTTP against a local werkzeug server with --server. --s3 serves the shards from a local moto
+# S3 mock (pip install moto) with the service in production mode, so every request pays for
+# fetching its shards. Shards are written by the same fixtures as benchmarks/suite.py.
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import datetime
+import threading
+import contextlib
+import http.client
+import numpy as np
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, service_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+from suite import day_number
+
+# Days in each kind of range. A full range covers the whole record.
+range_days = {"short": 30, "medium": 365, "long": 5 * 365, "full": None}
+
+
+# "query:short:1,county:medium:2" -> [("query", "short", 1.0), ("county", "medium", 2.0)]
+def parse_mix(value):
+    mix = []
+    for entry in value.split(","):
+        endpoint, range_name, weight = entry.split(":")
+        if endpoint not in ("query", "county") or range_name not in range_days:
+            raise ValueError(f"Unknown endpoint or range in {entry}")
+        mix.append((endpoint, range_name, float(weight)))
+    return mix
+
+
+# Start and end days of a range. Ranges start mid-record, so repeats hit the result caches,
+# unless random_starts spreads them over the record.
+def pick_range(range_name, first_year, end_year, random_starts, rng):
+    first_day, last_day = day_number(first_year, 1, 1), day_number(end_year - 1, 12, 31)
+    days = range_days[range_name]
+    if days is None or days > last_day - first_day:
+        return first_day, last_day
+    if random_starts:
+        start = rng.randint(first_day, last_day - days + 1)
+    else:
+        start = day_number(first_year + (end_year - first_year) // 2, 7, 1)
+        start = min(start, last_day - days + 1)
+    return start, start + days - 1
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+# Samples the process's resident memory while a load level runs
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = current_rss_mb()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak_mb
+
+
+# A function sending one GET to the app and returning its status, through the test client or HTTP
+def make_client(app, server_address):
+    if server_address is None:
+        test_client = app.test_client()
+        return lambda path: test_client.get(path).status_code
+
+    def get(path):
+        connection = http.client.HTTPConnection(*server_address, timeout=600)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+    return get
+
+
+def run_level(app, server_address, concurrency, args, mix):
+    deadline = time.perf_counter() + args.duration
+    issued = iter(range(args.max_requests)) if args.max_requests else None
+    issued_lock = threading.Lock()
+    samples = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        get = make_client(app, server_address)
+        while time.perf_counter() < deadline:
+            if issued is not None:
+                with issued_lock:
+                    if next(issued, None) is None:
+                        return
+            endpoint, range_name, _ = rng.choices(mix, weights=[weight for _, _, weight in mix])[0]
+            start, end = pick_range(range_name, args.first_year, args.end_year, args.random_starts, rng)
+            begin = time.perf_counter()
+            try:
+                status = get(f"/{endpoint}?start_date={start}&end_date={end}")
+            except Exception as e:
+                print(f"Error: {e}")
+                status = None
+            samples.append((endpoint, range_name, time.perf_counter() - begin, status))
+
+    sampler = RssSampler()
+    sampler.start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(args.seed * 1000 + i,)) for i in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize(concurrency, samples, elapsed, sampler.stop())
+
+
+def latency_summary(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float("nan"),) * 3
+    return {"requests": len(latencies), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def summarize(concurrency, samples, elapsed, peak_rss_mb):
+    ok = [latency for _, _, latency, status in samples if status == 200]
+    level = {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": len(ok) / elapsed,
+        "errors": len(samples) - len(ok),
+        "peak_rss_mb": peak_rss_mb,
+        "latency": latency_summary(ok),
+        "by_request": {},
+    }
+    for endpoint, range_name in sorted({(endpoint, range_name) for endpoint, range_name, _, _ in samples}):
+        level["by_request"][f"{endpoint}/{range_name}"] = latency_summary(
+            [latency for e, r, latency, status in samples if (e, r) == (endpoint, range_name) and status == 200])
+
+    latency = level["latency"]
+    print(f"concurrency {concurrency:>3}  {level['throughput']:7.2f} req/s  p50 {latency['p50']:7.3f}s  "
+          f"p95 {latency['p95']:7.3f}s  p99 {latency['p99']:7.3f}s  errors {level['errors']}  "
+          f"peak RSS {peak_rss_mb:.0f} MB")
+    return level
+
+
+# Serves the shards from a moto S3 mock and switches the service to production mode, so each
+# request fetches its shards from "S3" as it would when deployed
+@contextlib.contextmanager
+def mocked_s3(shard_dir):
+    import moto
+    import boto3
+    from flaskr import aggregate
+
+    for variable, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                            ("AWS_DEFAULT_REGION", "us-east-1")]:
+        os.environ.setdefault(variable, value)
+
+    mock = moto.mock_aws() if hasattr(moto, "mock_aws") else moto.mock_s3()
+    with mock:
+        bucket = boto3.client("s3")
+        bucket.create_bucket(Bucket=aggregate.bucket_name)
+        for name in sorted(os.listdir(shard_dir)):
+            bucket.upload_file(os.path.join(shard_dir, name), aggregate.bucket_name, name)
+
+        aggregate.s3 = None
+        aggregate.deploying_production = True
+        try:
+            yield
+        finally:
+            aggregate.deploying_production = False
+            aggregate.s3 = None
+
+
+@contextlib.contextmanager
+def local_server(app):
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default=os.path.join(service_dir, "benchmarks", "data"))
+    parser.add_argument("--first-year", type=int, default=1979)
+    parser.add_argument("--end-year", type=int, default=2024, help="Shards cover [first-year, end-year)")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds each concurrency level runs")
+    parser.add_argument("--max-requests", type=int, default=0, help="Stop a level after this many requests")
+    parser.add_argument("--mix", default="query:short:1,query:medium:1,county:short:1,county:medium:1",
+                        help="endpoint:range:weight, comma separated. Ranges: " + ", ".join(range_days))
+    parser.add_argument("--random-starts", action="store_true", help="Spread ranges over the record to miss caches")
+    parser.add_argument("--server", action="store_true", help="Send requests over HTTP to a local werkzeug server")
+    parser.add_argument("--s3", action="store_true", help="Fetch shards from a local moto S3 mock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest-results.json")
+    args = parser.parse_args()
+
+    import flaskr
+    from flaskr import aggregate, geometry
+
+    data_dir, output_path = os.path.abspath(args.data_dir), os.path.abspath(args.output)
+    shard_dir = os.path.join(data_dir, "shards")
+    fixtures.write_shards(shard_dir, args.first_year, args.end_year, list(aggregate.products))
+    aggregate.data_dir = shard_dir + "/"
+
+    geometry.artifact_dir = os.path.join(data_dir, "geometry") + "/"
+    if geometry.load_artifacts() is None:
+        geometry.build_artifacts(fixtures.gridmet_lat[fixtures.california_rows],
+                                 fixtures.gridmet_lon[fixtures.california_cols], geometry.artifact_dir)
+        geometry.load_artifacts.cache_clear()
+
+    mix = parse_mix(args.mix)
+    levels = []
+    with contextlib.ExitStack() as stack:
+        # /query renders its images into ./flaskr/ like the real service. Run from a scratch copy
+        # of the service directory holding only the shapefiles, so the checked-in images and the
+        # working tree are left alone.
+        run_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="burn-window-loadtest-"))
+        os.makedirs(os.path.join(run_dir, "flaskr"))
+        for name in ("california_shp", "CA_Counties"):
+            os.symlink(os.path.join(service_dir, "flaskr", name), os.path.join(run_dir, "flaskr", name))
+        stack.callback(os.chdir, os.getcwd())
+        os.chdir(run_dir)
+
+        app = flaskr.create_app()
+        if args.s3:
+            stack.enter_context(mocked_s3(shard_dir))
+        server_address = stack.enter_context(local_server(app)) if args.server else None
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            levels.append(run_level(app, server_address, concurrency, args, mix))
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "levels": levels,
+    }
+    with open(output_path, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {output_path}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,67 @@
+# Measures how long a fresh worker takes to import flaskr and create the app, and checks that none
+# of the heavy libraries that are only needed once a request arrives got imported on the way.
+#
+#   python benchmarks/startup.py [--runs 5] [--max-seconds 1.5]
+#
+# Run from the service directory. Exits with status 1 when startup is slower than --max-seconds
+# or imports one of the deferred modules, so it can guard against regressions in CI.
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported once something is clipped from a shapefile, rendered, or fetched from S3
+deferred_modules = ["geopandas", "shapely", "rioxarray", "rasterio", "pyproj", "boto3", "matplotlib", "h5netcdf"]
+
+startup = """
+import sys, time, json
+start = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+flaskr.create_app()
+created = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": created - imported, "total": created - start,
+                  "modules": [name for name in %r if name in sys.modules]}))
+""" % (deferred_modules,)
+
+
+def measure_startup():
+    env = dict(os.environ, PYTHONPATH=service_dir)
+    # Materializing cubes is a one-off cost of its own, not part of the import
+    env.pop("BURN_WINDOW_CUBE_DIR", None)
+    output = subprocess.run([sys.executable, "-c", startup], cwd=service_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [measure_startup() for _ in range(args.runs)]
+    for stage in ["import", "create_app", "total"]:
+        times = [result[stage] for result in runs]
+        print(f"{stage:<11} median {statistics.median(times):.3f}s  min {min(times):.3f}s  max {max(times):.3f}s")
+
+    failed = False
+    heavy = sorted({name for result in runs for name in result["modules"]})
+    if heavy:
+        print(f"Imported at startup: {', '.join(heavy)}")
+        failed = True
+
+    median_total = statistics.median(result["total"] for result in runs)
+    if args.max_seconds is not None and median_total > args.max_seconds:
+        print(f"Startup took {median_total:.3f}s, over the {args.max_seconds:.3f}s limit")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,170 @@
+# Times the builder and the service on synthetic gridMET-like data, offline, and records the
+# results as JSON so runs before and after a change can be compared.
+#
+#   python benchmarks/suite.py [--first-year 1979] [--end-year 2024] [--repeats 3]
+#                              [--output results.json] [--compare baseline.json]
+#
+# Run from the service directory. The first run writes the fixtures under --data-dir, which takes
+# a while and about 1.7 GB of disk per 5 years of record; later runs reuse them.
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import datetime
+import platform
+import statistics
+import numpy as np
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+builder_dir = os.path.join(os.path.dirname(service_dir), "master-netcdf")
+sys.path.insert(0, service_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+def day_number(year, month, day):
+    return (datetime.date(year, month, day) - datetime.date(1979, 1, 1)).days
+
+
+# (name, start_date, end_date) in days since 1979-01-01, as /query takes them
+def benchmark_ranges(first_year, end_year):
+    middle = first_year + (end_year - first_year) // 2
+    return [
+        ("short", day_number(middle, 7, 1), day_number(middle, 7, 31)),
+        ("medium", day_number(middle, 7, 1), day_number(middle + 1, 6, 30)),
+        ("full", day_number(first_year, 1, 1), day_number(end_year - 1, 12, 31)),
+    ]
+
+
+def timed(name, work, repeats, reset=None):
+    seconds = []
+    for _ in range(repeats):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        work()
+        seconds.append(time.perf_counter() - start)
+
+    result = {"name": name, "seconds": seconds, "median": statistics.median(seconds), "min": min(seconds)}
+    print(f"{name:<50} median {result['median']:8.3f}s  min {result['min']:8.3f}s")
+    return result
+
+
+# create_all_netcdf over build_shards 5-year shards of synthetic yearly inputs, then the steps of
+# run() that read those shards back, so they are exercised on the builder's own output
+def benchmark_builder(data_dir, build_shards, extent, repeats):
+    input_dir = os.path.join(data_dir, "inputs", "conus" if extent is fixtures.conus_extent else "california")
+    output_dir = os.path.join(data_dir, "build")
+    end_year = 1979 + 5 * build_shards
+    fixtures.write_gridmet_inputs(input_dir, range(1979, end_year), extent)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The builder reads its shapefile relative to its own directory when imported, and writes
+    # its shards to the working directory
+    working_dir = os.getcwd()
+    os.chdir(builder_dir)
+    sys.path.insert(0, builder_dir)
+    import netcdf
+    os.chdir(output_dir)
+    try:
+        results = [timed(f"create_all_netcdf/{build_shards}x5y", lambda: netcdf.create_all_netcdf(
+            input_dir + "/", first_year=1979, end_year=end_year), repeats)]
+        for name in netcdf.products:
+            results.append(timed(f"create_pixel_major_netcdf/{name}", lambda: netcdf.create_pixel_major_netcdf(name), repeats))
+            results.append(timed(f"create_monthly_rollup_netcdf/{name}", lambda: netcdf.create_monthly_rollup_netcdf(name), repeats))
+        return results
+    finally:
+        os.chdir(working_dir)
+
+
+def benchmark_service(data_dir, first_year, end_year, repeats):
+    import flaskr
+    from flaskr import aggregate, geometry
+    from flaskr.county import query_county
+
+    shard_dir = os.path.join(data_dir, "shards")
+    fixtures.write_shards(shard_dir, first_year, end_year, list(aggregate.products))
+    aggregate.data_dir = shard_dir + "/"
+
+    # Clip with precomputed geometry, as a deployed service would
+    geometry.artifact_dir = os.path.join(data_dir, "geometry") + "/"
+    if geometry.load_artifacts() is None:
+        geometry.build_artifacts(fixtures.gridmet_lat[fixtures.california_rows],
+                                 fixtures.gridmet_lon[fixtures.california_cols], geometry.artifact_dir)
+        geometry.load_artifacts.cache_clear()
+
+    render_dir = os.path.join(data_dir, "renders") + "/"
+    os.makedirs(render_dir, exist_ok=True)
+
+    results = []
+    for range_name, start, end in benchmark_ranges(first_year, end_year):
+        for file_name, plot_file_name, legend_file_name, colormap in flaskr.renders:
+            results.append(timed(f"process_window_data/{file_name[:-3]}/{range_name}", lambda: flaskr.process_window_data(
+                file_name, plot_file_name, legend_file_name, colormap, start, end, output_dir=render_dir),
+                repeats, aggregate.aggregate_window_data.cache_clear))
+        results.append(timed(f"query_county/{range_name}", lambda: query_county(start, end),
+                             repeats, query_county.cache_clear))
+    return results
+
+
+# Prints how each benchmark changed against a previous run. Returns the ones slower than max_ratio.
+def compare(results, baseline_path, max_ratio):
+    with open(baseline_path) as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    regressions = []
+    for result in results:
+        if result["name"] not in baseline:
+            continue
+        ratio = result["median"] / baseline[result["name"]]["median"]
+        print(f"{result['name']:<50} {ratio:6.2f}x baseline")
+        if max_ratio is not None and ratio > max_ratio:
+            regressions.append(result["name"])
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default=os.path.join(service_dir, "benchmarks", "data"))
+    parser.add_argument("--first-year", type=int, default=1979)
+    parser.add_argument("--end-year", type=int, default=2024, help="Shards cover [first-year, end-year)")
+    parser.add_argument("--build-shards", type=int, default=1, help="5-year shards create_all_netcdf builds")
+    parser.add_argument("--conus-inputs", action="store_true", help="Builder inputs cover all of gridMET, as downloaded")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-builder", action="store_true")
+    parser.add_argument("--skip-service", action="store_true")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit with status 1 when a benchmark's median is this many times the baseline's")
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir)
+    results = []
+    if not args.skip_builder:
+        extent = fixtures.conus_extent if args.conus_inputs else fixtures.california_extent
+        results += benchmark_builder(data_dir, args.build_shards, extent, args.repeats)
+    if not args.skip_service:
+        results += benchmark_service(data_dir, args.first_year, args.end_year, args.repeats)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": vars(args),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
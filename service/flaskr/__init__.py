@@ -1,39 +1,61 @@
 import os
 import glob
-import matplotlib
 import numpy as np
 import xarray
-from flask import Flask, request, send_from_directory
+from flask import Flask, request, send_from_directory, send_file, jsonify, g
 from flask_cors import cross_origin
-import matplotlib.image
-import matplotlib.pyplot as plt
 from .county import query_county
-import geopandas
-from shapely.geometry import mapping
-import boto3
+from .aggregate import aggregate_window_data, clip_to_state, products
+from .encode import encode_grid, encoders, grid_headers
+from .batch import batch_grids, batch_counties, grids_to_json, grids_to_npz
+from .point import query_point
+from .climatology import query_climatology
+from .percentiles import histogram_products, percentile_grid, query_distribution
+from .streaks import streak_stats, streak_grids
+from .animation import animation_formats, animation_headers, export_animation
+from .thresholds import parse_thresholds, threshold_window
+from .tiles import get_tile, tile_grid, max_zoom
+from .jobs import submit_job, get_job, job_status, job_output_dir
+from .singleflight import single_flight
+from .cube import load_cubes
+from .metrics import stage, request_seconds, register_lru_caches, latest_metrics
+from .profiling import profiled, is_admin, profile_exists, profile_report, profile_path
 import io
+import logging
+import threading
+import time
 from flask_cors import CORS
 
-import datetime
-import time
+logger = logging.getLogger(__name__)
+
+register_lru_caches({"tile": get_tile, "tile_grid": tile_grid})
 
-deploying_production = False
+# bbox=west,south,east,north in degrees. Returns None when absent, raises ValueError when malformed.
+def parse_bbox(value):
+    if value is None:
+        return None
+    west, south, east, north = (float(edge) for edge in value.split(','))
+    if west >= east or south >= north:
+        raise ValueError("Bounding box edges are out of order")
+    return west, south, east, north
 
-# main threading issues with matplotlib
-matplotlib.use('Agg')
-cali_shape = geopandas.read_file("./flaskr/california_shp/CA_State_TIGER2016.shp")
 
-s3 = boto3.client('s3')
+def attachment(body, mimetype, download_name, headers):
+    response = send_file(io.BytesIO(body), mimetype=mimetype, as_attachment=True, download_name=download_name)
+    response.headers.update(headers)
+    return response
+
+
+# A grid encoded as format for download, with its shape and bounds in the headers
+def grid_response(grid, name, grid_format):
+    return attachment(*encode_grid(grid, name, grid_format))
 
-def get_file_from_s3(bucket_name, file_name):
-    try:
-        response = s3.get_object(Bucket=bucket_name, Key=file_name)
-        return io.BytesIO(response['Body'].read())
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
 
 def create_app(test_config=None):
+    # The service's modules log under flaskr; BURN_WINDOW_LOG_LEVEL=DEBUG shows each range scan and
+    # shard opened. The handler is only added when the server hasn't configured logging already.
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logger.setLevel(os.environ.get('BURN_WINDOW_LOG_LEVEL', 'INFO'))
     app = Flask(__name__, instance_relative_config=True)
     CORS(app)
     app.config.from_mapping(
@@ -52,28 +74,316 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    # Materialize the hot products once into memory-mapped cubes shared by every worker process
+    cube_dir = app.config.get('CUBE_DIR', os.environ.get('BURN_WINDOW_CUBE_DIR'))
+    if cube_dir:
+        cube_products = app.config.get('CUBE_PRODUCTS', os.environ.get('BURN_WINDOW_CUBE_PRODUCTS'))
+        load_cubes(cube_dir, cube_products.split(',') if isinstance(cube_products, str) else cube_products)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        if "request_start" in g:
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            request_seconds.labels(endpoint).observe(time.perf_counter() - g.request_start)
+        return response
+
     # Disable caching for image and legend. Currently works on the Google Chrome and Microsoft Edge browsers
     # without the need to checkmark disable cache option.
     @app.after_request
     def add_header(response):
-        response.headers["Cache-Control"] = "no-store max-age=0"
+        # Tiles are keyed by their query and never change, so those can be cached
+        if not request.path.startswith('/tiles/'):
+            response.headers["Cache-Control"] = "no-store max-age=0"
         return response
 
     @app.route('/query', methods=['GET'])
     @cross_origin()
+    @profiled
     def make_query():
         cleanup()
         start_date, end_date = request.args.get('start_date'), request.args.get('end_date')
         if start_date is not None and end_date is not None:
-            return query(int(start_date), int(end_date))
+            try:
+                start_date, end_date, bbox = int(start_date), int(end_date), parse_bbox(request.args.get('bbox'))
+            except ValueError:
+                return 'failed', 400
+
+            # Run in the background and hand back a job to poll instead of holding this worker
+            if request.args.get('async') in ('1', 'true'):
+                job_id = submit_job(query, start_date, end_date, bbox)
+                if job_id is None:
+                    return 'busy', 503
+                return jsonify({"job_id": job_id}), 202
+            # Identical concurrent queries share one render of the images
+            return single_flight(('query', start_date, end_date, bbox), lambda: query(start_date, end_date, bbox))
         return 'failed'
     
     @app.route('/county', methods=['GET'])
     @cross_origin()
+    @profiled
     def county():
         start_date, end_date = request.args.get('start_date'), request.args.get('end_date')
         return query_county(int(start_date), int(end_date))
 
+    # Aggregated grid for a single product, returned as data instead of a rendered image
+    @app.route('/grid', methods=['GET'])
+    @cross_origin(expose_headers=grid_headers)
+    def get_grid():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        product = request.args.get('product', 'window')
+        grid_format = request.args.get('format', 'netcdf')
+        if None in (start_date, end_date) or start_date > end_date or product not in products \
+                or grid_format not in encoders:
+            return 'failed', 400
+
+        # Ranges past the record have no shards to open
+        try:
+            grid = aggregate_window_data(product + ".nc", start_date, end_date, parse_bbox(request.args.get('bbox')))
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        return grid_response(grid, product, grid_format)
+
+    # Burn window days under custom thresholds, e.g. &rmax_max=60&vs_max=none. Any of
+    # <rmin|rmax|tmmn|tmmx|vs>_<min|max> overrides the builder's default; "none" drops the bound.
+    @app.route('/window', methods=['GET'])
+    @cross_origin(expose_headers=grid_headers)
+    def custom_window():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        grid_format = request.args.get('format', 'netcdf')
+        if None in (start_date, end_date) or start_date > end_date or grid_format not in encoders:
+            return 'failed', 400
+
+        # Ranges past the record have no variable cubes to open
+        try:
+            thresholds = parse_thresholds(request.args)
+            grid = threshold_window(thresholds, start_date, end_date, parse_bbox(request.args.get('bbox')))
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        return grid_response(grid, "window", grid_format)
+
+    # Many date ranges at once, e.g. every season of the record, computed in one scan per product.
+    # Body: {"ranges": [[start_date, end_date], ...], "products": [...], "format": "json" | "npz" | "county", "bbox": "w,s,e,n"}
+    @app.route('/batch', methods=['POST'])
+    @cross_origin()
+    def batch():
+        body = request.get_json(silent=True) or {}
+        try:
+            ranges = [(int(start), int(end)) for start, end in body.get('ranges', [])]
+            bbox = parse_bbox(body.get('bbox'))
+        except (TypeError, ValueError):
+            return 'failed', 400
+        product_names = body.get('products', ['window'])
+        batch_format = body.get('format', 'json')
+        if not ranges or any(start > end for start, end in ranges) \
+                or any(product not in products for product in product_names):
+            return 'failed', 400
+        if batch_format not in ('json', 'npz', 'county'):
+            return 'failed', 400
+
+        # Ranges past the record have no shards to open
+        try:
+            if batch_format == 'county':
+                return jsonify({"ranges": ranges, "counties": batch_counties(ranges)})
+            grids = batch_grids(ranges, product_names, bbox)
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        if batch_format == 'npz':
+            return send_file(io.BytesIO(grids_to_npz(ranges, grids)),
+                             mimetype="application/octet-stream", as_attachment=True, download_name="batch.npz")
+        return jsonify(grids_to_json(ranges, grids))
+
+    # Daily values of one or more products at the grid cell nearest to lat/lon
+    @app.route('/point', methods=['GET'])
+    @cross_origin()
+    def point():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        lat, lon = request.args.get('lat', type=float), request.args.get('lon', type=float)
+        product_names = request.args.get('products', 'window').split(',')
+        if None in (start_date, end_date, lat, lon) or start_date > end_date \
+                or any(product not in products for product in product_names):
+            return 'failed', 400
+
+        result = query_point(product_names, lat, lon, start_date, end_date)
+        if result is None:
+            return 'failed', 400
+        return jsonify(result)
+
+    # Same calendar window (months or days of the year) averaged across years, or one year's anomaly from it
+    @app.route('/climatology', methods=['GET'])
+    @cross_origin(expose_headers=grid_headers)
+    def climatology():
+        product = request.args.get('product', 'window')
+        grid_format = request.args.get('format', 'netcdf')
+        start_year, end_year = request.args.get('start_year', type=int), request.args.get('end_year', type=int)
+        year = request.args.get('year', type=int)
+        month_start = request.args.get('month_start', type=int) or request.args.get('month', type=int)
+        month_end = request.args.get('month_end', type=int) or month_start
+        doy_start, doy_end = request.args.get('doy_start', type=int), request.args.get('doy_end', type=int)
+        if product not in products or grid_format not in encoders or start_year is None or end_year is None \
+                or start_year > end_year:
+            return 'failed', 400
+
+        if month_start is not None and 1 <= month_start <= month_end <= 12:
+            window = {"month_start": month_start, "month_end": month_end}
+        elif doy_start is not None and doy_end is not None and 1 <= doy_start <= doy_end <= 366:
+            window = {"doy_start": doy_start, "doy_end": doy_end}
+        else:
+            return 'failed', 400
+
+        # Years outside the record have no shards, or no days in the last one
+        try:
+            grid = query_climatology(product, start_year, end_year, year, **window)
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        name = f"{product}_{'anomaly' if year is not None else 'climatology'}"
+        return grid_response(grid, name, grid_format)
+
+    # The q-th percentile (0-100) of a product's daily values over a date range, e.g. &q=90 or &q=50 for the median
+    @app.route('/percentile', methods=['GET'])
+    @cross_origin(expose_headers=grid_headers)
+    def percentile():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        product = request.args.get('product', 'temperature_max')
+        q = request.args.get('q', type=float)
+        grid_format = request.args.get('format', 'netcdf')
+        if None in (start_date, end_date, q) or not 0 <= q <= 100 or start_date > end_date \
+                or product not in histogram_products or grid_format not in encoders:
+            return 'failed', 400
+
+        grid = percentile_grid(product, q, start_date, end_date)
+        if grid is None:
+            return 'failed', 400
+        return grid_response(grid, f"{product}_p{q:g}", grid_format)
+
+    # Histogram of a product's daily values over a date range at the grid cell nearest to lat/lon
+    @app.route('/distribution', methods=['GET'])
+    @cross_origin()
+    def distribution():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        lat, lon = request.args.get('lat', type=float), request.args.get('lon', type=float)
+        product = request.args.get('product', 'temperature_max')
+        if None in (start_date, end_date, lat, lon) or start_date > end_date or product not in histogram_products:
+            return 'failed', 400
+
+        result = query_distribution(product, lat, lon, start_date, end_date)
+        if result is None:
+            return 'failed', 400
+        return jsonify(result)
+
+    # Consecutive burn window days over a date range: &stat=longest for each cell's longest run, or
+    # &stat=runs&min_length=7 for its number of runs of at least that many days
+    @app.route('/streaks', methods=['GET'])
+    @cross_origin(expose_headers=grid_headers)
+    def streaks():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        stat = request.args.get('stat', 'longest')
+        min_length = request.args.get('min_length', 1, type=int)
+        grid_format = request.args.get('format', 'netcdf')
+        if None in (start_date, end_date) or start_date > end_date or min_length < 1 \
+                or stat not in streak_stats or grid_format not in encoders:
+            return 'failed', 400
+
+        grids = streak_grids(start_date, end_date, min_length)
+        if grids is None:
+            return 'failed', 400
+        name = "window_longest_streak" if stat == "longest" else f"window_streaks_{min_length}d"
+        return grid_response(grids[stat], name, grid_format)
+
+    # Animation of a product over a date range, one frame per &step days (1 for daily, 7 for weekly),
+    # as &format=gif, apng or zip (a PNG per frame). &frame_ms sets the frame duration and &scale
+    # the pixels per grid cell.
+    @app.route('/animation', methods=['GET'])
+    @cross_origin(expose_headers=animation_headers)
+    def animation():
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        product = request.args.get('product', 'window')
+        step = request.args.get('step', 1, type=int)
+        animation_format = request.args.get('format', 'gif')
+        frame_ms = request.args.get('frame_ms', 200, type=int)
+        scale = request.args.get('scale', 2, type=int)
+        if None in (start_date, end_date, step, frame_ms, scale) or start_date > end_date or step < 1 \
+                or not 20 <= frame_ms <= 10000 or not 1 <= scale <= 4 \
+                or product not in products or animation_format not in animation_formats:
+            return 'failed', 400
+
+        # Identical exports requested at the same time are rendered once. Ranges past the record
+        # have no shards to open.
+        try:
+            args = (product, start_date, end_date, step, animation_format, frame_ms, scale)
+            body, mimetype, download_name, headers = single_flight(("animation",) + args, lambda: export_animation(*args))
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        return attachment(body, mimetype, download_name, headers)
+
+    # Web Mercator map tiles of a product over a date range, rendered on demand
+    @app.route('/tiles/<product>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+    @cross_origin()
+    def tile(product, z, x, y):
+        start_date, end_date = request.args.get('start_date', type=int), request.args.get('end_date', type=int)
+        if start_date is None or end_date is None or start_date > end_date or product not in products \
+                or z > max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return 'failed', 400
+
+        # Ranges outside the record have no shards
+        try:
+            tile = get_tile(product, start_date, end_date, z, x, y)
+        except (ValueError, FileNotFoundError):
+            return 'failed', 400
+        response = send_file(io.BytesIO(tile), mimetype="image/png")
+        response.headers["Cache-Control"] = "public, max-age=86400"
+        return response
+
+    # Status of an asynchronous /query. ?wait=seconds long-polls until the job finishes.
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    @cross_origin()
+    def get_job_status(job_id):
+        job = get_job(job_id, min(request.args.get('wait', 0, type=float), 60))
+        if job is None:
+            return 'failed', 404
+
+        status = job_status(job)
+        if job["status"] == "done":
+            status["resources"] = {name: f"/jobs/{job_id}/{name}" for name in render_files}
+        return jsonify(status)
+
+    # Images rendered by a finished asynchronous /query
+    @app.route('/jobs/<job_id>/<resource>', methods=['GET'])
+    @cross_origin()
+    def get_job_resource(job_id, resource):
+        job = get_job(job_id)
+        if job is None or job["status"] != "done" or resource not in render_files:
+            return 'failed', 404
+        return send_from_directory(os.path.abspath(job_output_dir(job_id)), resource)
+
+    # Prometheus metrics: per-stage latency histograms, bytes read and cache hit rates
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        body, content_type = latest_metrics()
+        return body, 200, {"Content-Type": content_type}
+
+    # Profiles recorded by /query or /county with ?profile=1, for admins only
+    @app.route('/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        if not is_admin(app):
+            return 'forbidden', 403
+        if not profile_exists(profile_id):
+            return 'failed', 404
+        return jsonify(profile_report(profile_id, request.args.get('limit', 50, type=int)))
+
+    # The raw cProfile output, for snakeviz or pstats
+    @app.route('/profiles/<profile_id>/raw', methods=['GET'])
+    def get_profile_raw(profile_id):
+        if not is_admin(app):
+            return 'forbidden', 403
+        if not profile_exists(profile_id):
+            return 'failed', 404
+        return send_file(os.path.abspath(profile_path(profile_id, ".prof")), as_attachment=True,
+                         download_name=f"{profile_id}.prof")
+
     # Burn resources
     @app.route('/burn_window_image', methods=['GET'])
     @cross_origin()
@@ -126,154 +436,32 @@ def cleanup():
         try:
             os.remove(f)
         except:
-            print("Error while deleting file : ", f)
-
+            logger.warning(f"Error while deleting file : {f}")
 
-def query(start_date: int, end_date: int):
-    print("Querying against netcdf.")
-    process_window_data("window.nc", "burn_window", "burn_legend", 'hot', start_date, end_date)
-    process_window_data("temperature_avg.nc", "temperature_avg", "temperature_avg_legend", 'copper', start_date, end_date)
-    process_window_data("temperature_max.nc", "temperature_max", "temperature_max_legend", 'copper', start_date, end_date)
-    process_window_data("humidity_min.nc", "humidity_min", "humidity_min_legend", 'Purples', start_date, end_date)
-    return 'success'
-    
-def process_window_data(file_name, window_plot_file_name, legend_file_name, colormap, start_date, end_date):
 
+# Layer and legend images /query renders: (file name, plot file name, legend file name, colormap)
+renders = [
+    ("window.nc", "burn_window", "burn_legend", 'hot'),
+    ("temperature_avg.nc", "temperature_avg", "temperature_avg_legend", 'copper'),
+    ("temperature_max.nc", "temperature_max", "temperature_max_legend", 'copper'),
+    ("humidity_min.nc", "humidity_min", "humidity_min_legend", 'Purples'),
+]
+render_files = [name for _, plot, legend, _ in renders for name in (plot + '.svg', legend + '.png')]
 
-    unx_offset = time.mktime(datetime.datetime(1979,1,1).timetuple()) #- (8*60*60)
-#    print(start_date)
-    start_time_unx = start_date*24*60*60 + unx_offset
-    end_time_unx = end_date*24*60*60 + unx_offset
+# pyplot keeps global state, so only one thread renders at a time
+render_lock = threading.Lock()
 
-#    print(start_time_unx)
-    start_dt = datetime.datetime.utcfromtimestamp(start_time_unx)
-    end_dt = datetime.datetime.utcfromtimestamp(end_time_unx)
 
-    #Which files do we start/stop at
-    start_year, end_year = start_dt.year, end_dt.year
-    start_file = start_year - ((start_year+1)%5)
-    end_file = end_year - ((end_year +1)%5)+5
+def query(start_date: int, end_date: int, bbox=None, output_dir="./flaskr/", progress=None):
+    logger.debug("Querying against netcdf.")
+    for i, (file_name, plot_file_name, legend_file_name, colormap) in enumerate(renders):
+        process_window_data(file_name, plot_file_name, legend_file_name, colormap, start_date, end_date, bbox, output_dir)
+        if progress is not None:
+            progress((i + 1) / len(renders))
+    return 'success'
     
-    #How many days are the first and last days from the beginning of their file
-    first_data_offset = time.mktime(datetime.datetime(start_file,1,1).timetuple())
-    last_data_offset = time.mktime(datetime.datetime(end_file-5, 1, 1).timetuple())
-
-    first_idx = int((start_time_unx - first_data_offset)/(24*60*60))
-    last_idx = int((end_time_unx - last_data_offset)/(24*60*60))
-
-    #print(start_dt)
-    #print(end_dt)
-    #print(start_year)
-    #print(end_year)
-    #print(first_idx)
-    #print(last_idx)
-
-
-    flattened_data = None
-    total_days = 0
-
-    print(f"Scanning files from {start_file} to {end_file}")
-    for file in range(start_file, end_file, 5):
-       print(f"Opening file {file}-{file+5}")
-       # current_data = xarray.open_dataset(data_bytes[:-3]+f"_{file}_{file+5}.nc", engine="h5netcdf").astype(float)
-
-       file_name_sub = file_name[:-3]+f"_{file}_{file+5}.nc"
-       
-       # Check if in deployment
-       if deploying_production:
-            # Fetch a file from S3
-            bucket_name = 'fire-map-dashboard-geospatial-data'
-            data_bytes = get_file_from_s3(bucket_name, file_name_sub)
-       else:
-            data_bytes = "./flaskr/" + file_name_sub
-
-
-       with  xarray.open_dataset(data_bytes, engine="h5netcdf") as current_dataset:
-           current_data = current_dataset.__xarray_dataarray_variable__
-
-           #Assume we're scanning the entire file, unless we've got the first or last file to be scanned
-           start_idx, end_idx = 0,  current_data.shape[0]
-           if file == start_file:
-                start_idx = first_idx
-           if file == end_file - 5:
-                end_idx = last_idx
-           total_days += end_idx - start_idx
-
-           first_file = False
-           if flattened_data is None:
-                first_file = True
-                #don't bother calculating this more than once; format is relic of old code
-                flattened_data =  xarray.DataArray(coords=[current_data.coords['lat'][:], current_data.coords['lon'][:]],
-                                                dims=['lat', 'lon'])
-
-           #print(flattened_data)
-
-           #flattened_data is a shell with no time; build it as we go
-
-
-           #old team's code for reference: assumes whole dataset
-
-           #with xarray.open_dataset(data_bytes, engine="h5netcdf") as environmental_dataset:
-           # environmental_dataset = result_data
-            #environmental_data = environmental_dataset.__xarray_dataarray_variable__
-            #flattened_data = xarray.DataArray(coords=[environmental_data.coords['lat'][:], environmental_data.coords['lon'][:]],
-            #                                   dims=['lat', 'lon'])
-           environmental_data = current_data
-
-            # Check if you want burn window or temperature
-           if file_name == "window.nc":
-                # Sum data between a period of time (in days)
-                file_data = np.sum(environmental_data.data[start_idx:end_idx + 1, :, :], axis=0)
-                if first_file:
-                    flattened_data.data = file_data
-                else:
-                    flattened_data.data += file_data
-
-           elif file_name == "temperature_avg.nc":
-                # Average data between a period of time (in days)
-                # We sum for now and then divide by # of days on the last one
-
-                file_data = np.sum(environmental_data.data[start_idx:end_idx + 1, :, :], axis=0)
-                if first_file:
-                    flattened_data.data = file_data
-                else:
-                    flattened_data.data += file_data
-
-
-                #flattened_data = flattened_data.where(flattened_data != 0, np.nan)
-           elif file_name == "temperature_max.nc":
-                file_data = np.max(environmental_data.data[start_idx:end_idx + 1, :, :], axis=0)
-                if first_file:
-                    flattened_data.data = file_data
-                else:
-                    flattened_data.data = np.maximum(flattened_data.data, file_data)
-
-
-                #flattened_data = flattened_data.where(flattened_data != 0, np.nan)
-           elif file_name == "humidity_min.nc":
-                file_data = np.min(environmental_data.data[start_idx:end_idx + 1, :, :], axis=0)
-
-            
-                if first_file:
-                    print("humidity size", environmental_data.data[start_idx:end_idx + 1, :, :].size)
-                    flattened_data.data = file_data
-                else:
-                    flattened_data.data = np.minimum(flattened_data.data, file_data)
-
-                #flattened_data = flattened_data.where(flattened_data != 0, np.nan)
-       
-
-    if file_name == "temperature_avg.nc":
-        flattened_data /= total_days
-
-    if file_name != "window.nc":
-        flattened_data = flattened_data.where(flattened_data != 0, np.nan)
-
-
-    # Clip data to the outline of California using shapefile
-    flattened_data = flattened_data.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-    flattened_data.rio.write_crs("EPSG:4326", inplace=True)
-    area_in_window = flattened_data.rio.clip(cali_shape.geometry.apply(mapping), cali_shape.crs, drop=True)
+def process_window_data(file_name, window_plot_file_name, legend_file_name, colormap, start_date, end_date, bbox=None, output_dir="./flaskr/"):
+    area_in_window = aggregate_window_data(file_name, start_date, end_date, bbox)
 
     # Create duplicate and clip again
     duplicate = xarray.DataArray(
@@ -282,32 +470,41 @@ def process_window_data(file_name, window_plot_file_name, legend_file_name, colo
         dims=["lat", "lon"]
     )
 
-    duplicate = duplicate.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
-    duplicate.rio.write_crs("EPSG:4326", inplace=True)
-    duplicate_clipped = duplicate.rio.clip(cali_shape.geometry.apply(mapping), cali_shape.crs, drop=True)
-
-    # Create Legend and Layer Map
-    fig, ax = plt.subplots()
-    fig.patch.set_visible(False)
-    ax.axis('off')
-    plt.ioff()
-        
-    plt.imshow(duplicate_clipped, cmap=colormap)
-    fig.savefig("./flaskr/" + window_plot_file_name + '.svg', format='svg', dpi=1500)
-    allow_svg_to_stretch("./flaskr/" + window_plot_file_name + '.svg')
-
-    if file_name == "window.nc":
-        number_of_total_days_in_burn_window = end_date + 1 - start_date
-        plt.colorbar(ax=ax, label="Days that burn windows are met", boundaries=np.linspace(0, number_of_total_days_in_burn_window))
-    elif file_name == "temperature_avg.nc":
-        plt.colorbar(ax=ax, label="Average Temperature (°C)")
-    elif file_name == "temperature_max.nc":
-        plt.colorbar(ax=ax, label="Max Temperature (°C)")
-    elif file_name == "humidity_min.nc":
-        plt.colorbar(ax=ax, label="Min Humidity (%)")
-    ax.remove()
-    plt.close(fig)
-    fig.savefig("./flaskr/" + legend_file_name + '.png', bbox_inches='tight', pad_inches=0, dpi=1200)
+    duplicate_clipped = clip_to_state(duplicate)
+
+    with render_lock, stage("render"):
+        plt = pyplot()
+        # Create Legend and Layer Map
+        fig, ax = plt.subplots()
+        fig.patch.set_visible(False)
+        ax.axis('off')
+        plt.ioff()
+            
+        plt.imshow(duplicate_clipped, cmap=colormap)
+        fig.savefig(output_dir + window_plot_file_name + '.svg', format='svg', dpi=1500)
+        allow_svg_to_stretch(output_dir + window_plot_file_name + '.svg')
+
+        if file_name == "window.nc":
+            number_of_total_days_in_burn_window = end_date + 1 - start_date
+            plt.colorbar(ax=ax, label="Days that burn windows are met", boundaries=np.linspace(0, number_of_total_days_in_burn_window))
+        elif file_name == "temperature_avg.nc":
+            plt.colorbar(ax=ax, label="Average Temperature (°C)")
+        elif file_name == "temperature_max.nc":
+            plt.colorbar(ax=ax, label="Max Temperature (°C)")
+        elif file_name == "humidity_min.nc":
+            plt.colorbar(ax=ax, label="Min Humidity (%)")
+        ax.remove()
+        plt.close(fig)
+        fig.savefig(output_dir + legend_file_name + '.png', bbox_inches='tight', pad_inches=0, dpi=1200)
+
+
+# pyplot takes a while to import, so it is only loaded once something is rendered
+def pyplot():
+    import matplotlib
+    # main threading issues with matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
 
 
 def allow_svg_to_stretch(file_name):
@@ -0,0 +1,304 @@
+import xarray
+import numpy as np
+import io
+import contextlib
+import logging
+import threading
+from .singleflight import coalesce
+from . import lazy
+from .metrics import stage, bytes_read
+from .geometry import state_mask
+
+import datetime
+import time
+
+logger = logging.getLogger(__name__)
+
+deploying_production = False
+bucket_name = 'fire-map-dashboard-geospatial-data'
+
+# Where the 5-year shards live when not deploying to production
+data_dir = "./flaskr/"
+
+# Created on first use, so workers that never touch S3 don't pay for importing boto3
+s3 = None
+s3_lock = threading.Lock()
+
+# Products materialized into memory-mapped cubes at startup (see cube.py), by product name.
+# Each is (cube, metadata) with the whole record concatenated shard after shard along time.
+cubes = {}
+
+# Products served from the master netcdf shards, and how each collapses a range of days
+# into a single grid: a per-shard reduction and a way to combine it with the running result
+products = {
+    "window": (np.sum, np.add),
+    "temperature_avg": (np.sum, np.add),
+    "temperature_max": (np.max, np.maximum),
+    "humidity_min": (np.min, np.minimum),
+}
+
+
+def s3_client():
+    global s3
+    with s3_lock:
+        if s3 is None:
+            import boto3
+            s3 = boto3.client('s3')
+        return s3
+
+
+def get_file_from_s3(bucket_name, file_name):
+    try:
+        with stage("s3_fetch"):
+            response = s3_client().get_object(Bucket=bucket_name, Key=file_name)
+            body = response['Body'].read()
+        bytes_read.labels("s3").inc(len(body))
+        return io.BytesIO(body)
+    except Exception as e:
+        logger.error(f"Fetching {file_name} from S3 failed: {e}")
+        return None
+
+
+def shard_range(start_date, end_date):
+    unx_offset = time.mktime(datetime.datetime(1979,1,1).timetuple()) #- (8*60*60)
+    start_time_unx = start_date*24*60*60 + unx_offset
+    end_time_unx = end_date*24*60*60 + unx_offset
+
+    start_dt = datetime.datetime.utcfromtimestamp(start_time_unx)
+    end_dt = datetime.datetime.utcfromtimestamp(end_time_unx)
+
+    #Which files do we start/stop at
+    start_year, end_year = start_dt.year, end_dt.year
+    start_file = start_year - ((start_year+1)%5)
+    end_file = end_year - ((end_year +1)%5)+5
+
+    #How many days are the first and last days from the beginning of their file
+    first_data_offset = time.mktime(datetime.datetime(start_file,1,1).timetuple())
+    last_data_offset = time.mktime(datetime.datetime(end_file-5, 1, 1).timetuple())
+
+    first_idx = int((start_time_unx - first_data_offset)/(24*60*60))
+    last_idx = int((end_time_unx - last_data_offset)/(24*60*60))
+
+    return start_file, end_file, first_idx, last_idx
+
+
+# Opens one of the prepared netcdf files, from S3 when deploying to production.
+# mask_and_scale=False keeps packed variables as their stored integers.
+# Raises FileNotFoundError for a file that doesn't exist in either place.
+def open_data_file(file_name_sub, mask_and_scale=True):
+    # Check if in deployment
+    if deploying_production:
+        # Fetch a file from S3
+        data_bytes = get_file_from_s3(bucket_name, file_name_sub)
+        if data_bytes is None:
+            raise FileNotFoundError(f"{file_name_sub} could not be fetched from S3")
+    else:
+        data_bytes = data_dir + file_name_sub
+
+    with stage("open"):
+        return xarray.open_dataset(data_bytes, engine="h5netcdf", mask_and_scale=mask_and_scale)
+
+
+# Derived files the builder may not have written, such as rollups and histograms: None when the
+# file can't be opened, so callers can fall back to the shards or report it missing
+def open_optional(file_name_sub, mask_and_scale=True):
+    try:
+        return open_data_file(file_name_sub, mask_and_scale)
+    except Exception as e:
+        logger.info(f"{file_name_sub} is not available: {e}")
+        return None
+
+
+# Shards are read as stored: packed products stay integers until finish_grid unpacks them
+def open_shard(file_name, file):
+    return open_data_file(file_name[:-3]+f"_{file}_{file+5}.nc", mask_and_scale=False)
+
+
+# The scale_factor, add_offset and _FillValue a shard's values are packed with. Empty for shards
+# of plain values, such as the window or shards written before products were packed.
+def packing_attrs(data):
+    if 'scale_factor' not in data.attrs and 'add_offset' not in data.attrs:
+        return {}
+    return {name: data.attrs[name] for name in ('scale_factor', 'add_offset', '_FillValue') if name in data.attrs}
+
+
+# Unpacks values into float64, with fill values as NaN. A sum over summed_days packed values
+# counts add_offset once per day, and its fill values can't be told apart, so it has no NaN.
+def unpack(values, packing, summed_days=None):
+    if not packing:
+        return values
+    scale, offset = float(packing.get('scale_factor', 1.0)), float(packing.get('add_offset', 0.0))
+    if summed_days is not None:
+        return values * scale + offset * summed_days
+
+    unpacked = values * scale + offset
+    if '_FillValue' in packing:
+        unpacked = np.where(values == packing['_FillValue'], np.nan, unpacked)
+    return unpacked
+
+
+# A shard's data variable as a (time, lat, lon) DataArray. Reads a zero-copy view of the product's
+# memory-mapped cube when one has been materialized, and the shard file otherwise.
+@contextlib.contextmanager
+def open_shard_data(file_name, file):
+    product = file_name[:-3]
+    if product in cubes and file in cubes[product][1]["shard_begin"]:
+        cube, metadata = cubes[product]
+        shard = metadata["shard_begin"].index(file)
+        offset, days = metadata["shard_offset"][shard], metadata["shard_days"][shard]
+        yield xarray.DataArray(cube[offset:offset + days], dims=['time', 'lat', 'lon'], coords={
+            'lat': ('lat', metadata["lat"], {'standard_name': 'latitude', 'units': 'degrees_north'}),
+            'lon': ('lon', metadata["lon"], {'standard_name': 'longitude', 'units': 'degrees_east'}),
+        }, attrs=metadata.get("packing", {}))
+        return
+
+    with open_shard(file_name, file) as current_dataset:
+        yield current_dataset.__xarray_dataarray_variable__
+
+
+# Groups the day slices each range needs by shard, so every shard is opened once no matter
+# how many ranges touch it. Returns {file: [(range number, start_idx, end_idx or None), ...]}
+# where None stands for "through the end of the shard".
+def plan_ranges(ranges):
+    plan = {}
+    for i, (start_date, end_date) in enumerate(ranges):
+        start_file, end_file, first_idx, last_idx = shard_range(start_date, end_date)
+        for file in range(start_file, end_file, 5):
+            start_idx = first_idx if file == start_file else 0
+            end_idx = last_idx if file == end_file - 5 else None
+            plan.setdefault(file, []).append((i, start_idx, end_idx))
+    return dict(sorted(plan.items()))
+
+
+# Merges overlapping or touching day slices into the fewest contiguous segments to read
+def merge_slices(slices):
+    segments = []
+    for i, start_idx, end_idx in sorted(slices, key=lambda s: s[1]):
+        if segments and start_idx <= segments[-1][1] + 1:
+            segments[-1][1] = max(segments[-1][1], end_idx)
+            segments[-1][2].append((i, start_idx, end_idx))
+        else:
+            segments.append([start_idx, end_idx, [(i, start_idx, end_idx)]])
+    return segments
+
+
+# Index range of the cells of coords inside [low, high], widened outward to chunk boundaries
+def chunk_aligned_slice(coords, low, high, chunk):
+    inside = np.flatnonzero((coords >= low) & (coords <= high))
+    if len(inside) == 0:
+        raise ValueError("Bounding box does not intersect the grid")
+
+    first, last = inside[0], inside[-1] + 1
+    aligned = slice(first // chunk * chunk, min(-(-last // chunk) * chunk, len(coords)))
+    return aligned, slice(first - aligned.start, last - aligned.start)
+
+
+# The lat/lon hyperslab to read for a bounding box of (west, south, east, north), aligned to the
+# variable's HDF5 chunks so no chunk is decompressed for only part of a read, plus how to crop the
+# read slab back down to the box. Contiguous variables have no chunks to align to.
+def bbox_slices(current_data, bbox):
+    if bbox is None:
+        return (slice(None), slice(None)), (slice(None), slice(None))
+
+    west, south, east, north = bbox
+    chunks = current_data.encoding.get('chunksizes') or (1, 1, 1)
+    lat_read, lat_crop = chunk_aligned_slice(current_data.coords['lat'].values, south, north, chunks[1])
+    lon_read, lon_crop = chunk_aligned_slice(current_data.coords['lon'].values, west, east, chunks[2])
+    return (lat_read, lon_read), (lat_crop, lon_crop)
+
+
+# Reduces several date ranges of one product in a single ordered scan. Each shard is opened once
+# and each overlapping group of ranges within it is read as one slab that all of them share.
+def reduce_ranges(file_name, ranges, bbox=None):
+    reduce_shard, combine = products[file_name[:-3]]
+
+    results = [None] * len(ranges)
+    total_days = [0] * len(ranges)
+
+    plan = plan_ranges(ranges)
+    logger.debug(f"Scanning {len(plan)} files for {len(ranges)} ranges")
+    for file, slices in plan.items():
+        logger.debug(f"Opening file {file}-{file+5}")
+        with open_shard_data(file_name, file) as current_data:
+            shard_days = current_data.shape[0]
+            (lat_read, lon_read), (lat_crop, lon_crop) = bbox_slices(current_data, bbox)
+            lat, lon = current_data.coords['lat'][lat_read][lat_crop], current_data.coords['lon'][lon_read][lon_crop]
+
+            # Day indices are inclusive, and ranges running on past this shard read through its last day
+            slices = [(i, start_idx, shard_days - 1 if end_idx is None else min(end_idx, shard_days - 1))
+                      for i, start_idx, end_idx in slices]
+            for segment_start, segment_end, members in merge_slices(slices):
+                segment = current_data[segment_start:segment_end + 1, lat_read, lon_read]
+
+                # Long segments stream through bounded chunks rather than being read into memory whole
+                bytes_read.labels("cube" if file_name[:-3] in cubes else "shard").inc(lazy.slab_bytes(segment))
+                relative = [(start_idx - segment_start, end_idx - segment_start) for i, start_idx, end_idx in members]
+                crop = (slice(None), lat_crop, lon_crop)
+                if lazy.slab_bytes(segment) > lazy.chunk_limit:
+                    member_data = lazy.reduce_segment(segment, relative, reduce_shard, combine, crop)
+                else:
+                    member_data = lazy.reduce_days(segment, 0, segment.shape[0] - 1, relative, reduce_shard, crop)
+
+                for (i, start_idx, end_idx), file_data in zip(members, member_data):
+                    total_days[i] += end_idx - start_idx + 1
+
+                    if results[i] is None:
+                        #flattened_data is a shell with no time; build it as we go
+                        results[i] = xarray.DataArray(coords=[lat, lon], dims=['lat', 'lon'],
+                                                      attrs=packing_attrs(current_data))
+                        results[i].data = file_data
+                    else:
+                        results[i].data = combine(results[i].data, file_data)
+
+    return list(zip(results, total_days))
+
+
+def reduce_range(file_name, start_date, end_date, bbox=None):
+    return reduce_ranges(file_name, [(start_date, end_date)], bbox)[0]
+
+
+# Clip data to the outline of California: cells outside become NaN and the grid is cropped to the
+# state's extent, the same cells rio.clip(..., drop=True) keeps with the state shapefile
+def clip_to_state(flattened_data):
+    with stage("clip"):
+        mask = state_mask(flattened_data.coords['lat'].values, flattened_data.coords['lon'].values)
+        rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            # A bounding box that only covers cells outside the state
+            return flattened_data.where(False)
+
+        clipped = flattened_data.where(xarray.DataArray(mask, dims=['lat', 'lon']))
+        clipped = clipped.isel(lat=slice(rows[0], rows[-1] + 1), lon=slice(cols[0], cols[-1] + 1))
+        return clipped.astype(flattened_data.dtype)
+
+
+# Turns a reduced range into the final 2-D grid that gets rendered or downloaded
+def finish_grid(file_name, flattened_data, total_days):
+    packing = packing_attrs(flattened_data)
+    if packing:
+        summed_days = total_days if products[file_name[:-3]][0] is np.sum else None
+        flattened_data = flattened_data.copy(data=unpack(flattened_data.values, packing, summed_days))
+        flattened_data.attrs = {}
+
+    if file_name == "temperature_avg.nc":
+        flattened_data /= total_days
+
+    if file_name != "window.nc":
+        flattened_data = flattened_data.where(flattened_data != 0, np.nan)
+    else:
+        # Integer sums have no NaN, so clipping would fill outside the state with a huge sentinel
+        flattened_data = flattened_data.astype(np.float64)
+
+    return clip_to_state(flattened_data)
+
+
+# Reduces a product over [start_date, end_date], optionally within a bounding box, to its final 2-D grid.
+# Identical concurrent requests share one computation, and recent grids are kept for repeat requests.
+@coalesce(maxsize=64)
+def aggregate_window_data(file_name, start_date, end_date, bbox=None):
+    return finish_grid(file_name, *reduce_range(file_name, start_date, end_date, bbox))
+
+
+def aggregate_ranges(file_name, ranges, bbox=None):
+    return [finish_grid(file_name, flattened_data, total_days)
+            for flattened_data, total_days in reduce_ranges(file_name, ranges, bbox)]
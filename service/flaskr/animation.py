@@ -0,0 +1,116 @@
+import io
+import json
+import zipfile
+import numpy as np
+from PIL import Image
+from .aggregate import aggregate_ranges
+from .encode import grid_bounds
+from .tiles import colormaps
+from .metrics import stage
+
+# Frames one export may hold, e.g. a year of daily frames
+max_frames = 400
+
+# Response headers describing an exported animation, exposed to the frontend through CORS
+animation_headers = ["X-Frame-Count", "X-Frame-Days", "X-Value-Min", "X-Value-Max", "X-Grid-Bounds"]
+
+
+# [start, end] of each frame of step days, the last one cut short at end_date
+def frame_ranges(start_date, end_date, step):
+    return [(start, min(start + step - 1, end_date)) for start in range(start_date, end_date + 1, step)]
+
+
+# Each frame's grid, all of them reduced in one ordered scan of the shards
+def frame_grids(product, ranges):
+    return aggregate_ranges(product + ".nc", ranges)
+
+
+# 256-color palette: index 0 is transparent, for cells with no data, and 1-255 the product's colormap
+def palette(product):
+    from matplotlib import colormaps as matplotlib_colormaps
+    colors = matplotlib_colormaps[colormaps[product]](np.linspace(0, 1, 255), bytes=True)[:, :3]
+    return np.concatenate([np.zeros((1, 3), dtype=np.uint8), colors])
+
+
+# Every frame's values as palette indices at once, on one color scale shared by all frames, each
+# cell enlarged to scale x scale pixels
+def color_indices(frames, low, high, scale):
+    finite = np.isfinite(frames)
+    scaled = (frames - low) / (high - low) if high > low else np.zeros_like(frames)
+    indices = np.where(finite, 1 + np.round(np.clip(scaled, 0, 1) * 254), 0).astype(np.uint8)
+    return indices.repeat(scale, axis=1).repeat(scale, axis=2)
+
+
+def frame_images(indices, colors):
+    images = []
+    for frame in indices:
+        image = Image.fromarray(frame, "P")
+        image.putpalette(colors.tobytes())
+        image.info["transparency"] = 0
+        images.append(image)
+    return images
+
+
+def encode_gif(images, ranges, frame_ms, metadata):
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=frame_ms, loop=0,
+                   transparency=0, disposal=2, optimize=False)
+    return buffer.getvalue()
+
+
+# Frames replace every pixel of the one before, transparent ones included, so none need disposing
+def encode_apng(images, ranges, frame_ms, metadata):
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PNG", save_all=True, append_images=images[1:], duration=frame_ms, loop=0,
+                   transparency=0, disposal=0, blend=0, default_image=False)
+    return buffer.getvalue()
+
+
+# A PNG per frame named after its days, and frames.json with the ranges and color scale
+def encode_zip(images, ranges, frame_ms, metadata):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for i, (image, (start, end)) in enumerate(zip(images, ranges)):
+            frame = io.BytesIO()
+            image.save(frame, format="PNG", transparency=0)
+            archive.writestr(f"frame_{i:04d}_{start}_{end}.png", frame.getvalue())
+        archive.writestr("frames.json", json.dumps(dict(metadata, frames=ranges, frame_ms=frame_ms)))
+    return buffer.getvalue()
+
+
+# format -> (encoder, mimetype, file extension)
+animation_formats = {
+    "gif": (encode_gif, "image/gif", "gif"),
+    "apng": (encode_apng, "image/apng", "png"),
+    "zip": (encode_zip, "application/zip", "zip"),
+}
+
+
+# An animation of a product over [start_date, end_date], one frame per step days.
+# Returns (body, mimetype, download name, headers).
+def export_animation(product, start_date, end_date, step, animation_format, frame_ms=200, scale=2):
+    ranges = frame_ranges(start_date, end_date, step)
+    if len(ranges) > max_frames:
+        raise ValueError(f"{len(ranges)} frames is over the limit of {max_frames}")
+
+    grids = frame_grids(product, ranges)
+    with stage("render"):
+        frames = np.stack([grid.values.astype(np.float64) for grid in grids])
+        finite = frames[np.isfinite(frames)]
+        low, high = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+        images = frame_images(color_indices(frames, low, high, scale), palette(product))
+
+    metadata = {"product": product, "colormap": colormaps[product], "value_min": low, "value_max": high,
+                "bounds": grid_bounds(grids[0])}
+    encoder, mimetype, extension = animation_formats[animation_format]
+    with stage("encode"):
+        body = encoder(images, ranges, frame_ms, metadata)
+
+    headers = {
+        "X-Frame-Count": str(len(ranges)),
+        "X-Frame-Days": str(step),
+        "X-Value-Min": repr(low),
+        "X-Value-Max": repr(high),
+        "X-Grid-Bounds": metadata["bounds"],
+    }
+    return body, mimetype, f"{product}_{start_date}_{end_date}_{step}d.{extension}", headers
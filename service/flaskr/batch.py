@@ -0,0 +1,47 @@
+import io
+import numpy as np
+from .aggregate import aggregate_ranges, reduce_ranges
+from .county import county_table
+
+
+# Every product's grid for every range. The ranges of each product share one scan of its shards.
+def batch_grids(ranges, product_names, bbox=None):
+    return {product: aggregate_ranges(product + ".nc", ranges, bbox) for product in product_names}
+
+
+def batch_counties(ranges):
+    reduced = reduce_ranges("window.nc", ranges)
+    return [county_table(flattened_data, start, end)
+            for (flattened_data, total_days), (start, end) in zip(reduced, ranges)]
+
+
+def grid_values(grid):
+    values = grid.values
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def grids_to_json(ranges, grids):
+    return {
+        "ranges": ranges,
+        "products": {
+            product: {
+                "lat": product_grids[0].coords['lat'].values.tolist(),
+                "lon": product_grids[0].coords['lon'].values.tolist(),
+                "grids": [grid_values(grid) for grid in product_grids],
+            }
+            for product, product_grids in grids.items()
+        },
+    }
+
+
+# One (range, lat, lon) array per product, plus its lat/lon and the ranges themselves
+def grids_to_npz(ranges, grids):
+    arrays = {"ranges": np.array(ranges, dtype=np.int64)}
+    for product, product_grids in grids.items():
+        arrays[product] = np.stack([grid.values.astype(np.float32) for grid in product_grids])
+        arrays[f"{product}_lat"] = product_grids[0].coords['lat'].values
+        arrays[f"{product}_lon"] = product_grids[0].coords['lon'].values
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
@@ -0,0 +1,120 @@
+import datetime
+import numpy as np
+import xarray
+from .aggregate import products, open_optional, open_shard_data, plan_ranges, clip_to_state, packing_attrs, unpack
+
+
+def day_number(date):
+    return (date - datetime.date(1979, 1, 1)).days
+
+
+# [start_date, end_date] of the same calendar window in each year
+def doy_ranges(years, doy_start, doy_end):
+    return [(day_number(datetime.date(year, 1, 1)) + doy_start - 1,
+             day_number(datetime.date(year, 1, 1)) + doy_end - 1) for year in years]
+
+
+def month_ranges(years, month_start, month_end):
+    ranges = []
+    for year in years:
+        end = datetime.date(year + month_end // 12, month_end % 12 + 1, 1) - datetime.timedelta(days=1)
+        ranges.append((day_number(datetime.date(year, month_start, 1)), day_number(end)))
+    return ranges
+
+
+# Reduces each year's window straight from the shards. All of the windows falling in a shard are
+# fetched with one strided read instead of a separate range query per year. Packed products are
+# reduced as stored and unpacked once at the end. Raises ValueError when a year has no days in the
+# record, and FileNotFoundError when its shard doesn't exist.
+def reduce_years_from_shards(product, ranges):
+    reduce_shard, combine = products[product]
+    packing = {}
+
+    values = [None] * len(ranges)
+    days = np.zeros(len(ranges))
+    for file, slices in plan_ranges(ranges).items():
+        with open_shard_data(product + ".nc", file) as current_data:
+            coords = current_data.coords['lat'].values, current_data.coords['lon'].values
+            packing = packing_attrs(current_data)
+
+            last_day = current_data.shape[0] - 1
+            slices = [(i, start_idx, last_day if end_idx is None else min(end_idx, last_day))
+                      for i, start_idx, end_idx in slices]
+            slices = [(i, start_idx, end_idx) for i, start_idx, end_idx in slices if start_idx <= end_idx]
+            if not slices:
+                continue
+            index = np.concatenate([np.arange(start_idx, end_idx + 1) for i, start_idx, end_idx in slices])
+            slab = current_data.isel(time=index).values
+
+            offset = 0
+            for i, start_idx, end_idx in slices:
+                length = end_idx - start_idx + 1
+                file_data = reduce_shard(slab[offset:offset + length], axis=0)
+                offset += length
+
+                days[i] += length
+                values[i] = file_data if values[i] is None else combine(values[i], file_data)
+
+    if not days.all():
+        raise ValueError("Some of the years are outside the record")
+    summed_days = days[:, None, None] if reduce_shard is np.sum else None
+    return unpack(np.stack(values), packing, summed_days), days, coords
+
+
+# Reduces each year's months from the per-month rollups the master-netcdf tool writes. A calendar
+# month across consecutive years is every 12th rollup, so each month is a single strided read.
+def reduce_years_from_rollup(rollup, product, years, month_start, month_end):
+    reduce_shard, combine = products[product]
+
+    first = years[0] - int(rollup.attrs['first_year'])
+    last = years[-1] - int(rollup.attrs['first_year'])
+    if first < 0 or (last + 1) * 12 > rollup.sizes['month']:
+        return None
+
+    values, days = None, 0
+    for month in range(month_start, month_end + 1):
+        months = slice(first * 12 + month - 1, last * 12 + month, 12)
+        month_values = rollup['value'][months].values
+        days = days + rollup['days'][months].values
+        values = month_values if values is None else combine(values, month_values)
+
+    return values, days, (rollup.coords['lat'].values, rollup.coords['lon'].values)
+
+
+def reduce_years(product, years, month_start=None, month_end=None, doy_start=None, doy_end=None):
+    if month_start is not None:
+        rollup = open_optional(f"{product}_monthly.nc")
+        if rollup is not None:
+            with rollup:
+                reduced = reduce_years_from_rollup(rollup, product, years, month_start, month_end)
+            if reduced is not None:
+                return reduced
+        return reduce_years_from_shards(product, month_ranges(years, month_start, month_end))
+
+    return reduce_years_from_shards(product, doy_ranges(years, doy_start, doy_end))
+
+
+# Same finishing as a single range query, applied to a (year, lat, lon) stack
+def finish_years(product, values, days):
+    values = values.astype(np.float64)
+    if product == "temperature_avg":
+        values /= days[:, None, None]
+    if product != "window":
+        values = np.where(values != 0, values, np.nan)
+    return values
+
+
+def to_grid(values, coords):
+    grid = xarray.DataArray(values, coords=[coords[0], coords[1]], dims=['lat', 'lon'])
+    return clip_to_state(grid)
+
+
+# Average of the window over [start_year, end_year]. With a year, that year's departure from it instead.
+def query_climatology(product, start_year, end_year, year=None, **window):
+    values, days, coords = reduce_years(product, list(range(start_year, end_year + 1)), **window)
+    climatology = np.nanmean(finish_years(product, values, days), axis=0)
+    if year is None:
+        return to_grid(climatology, coords)
+
+    values, days, coords = reduce_years(product, [year], **window)
+    return to_grid(finish_years(product, values, days)[0] - climatology, coords)
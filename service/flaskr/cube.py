@@ -0,0 +1,88 @@
+import os
+import json
+import fcntl
+import logging
+import numpy as np
+from . import aggregate
+
+logger = logging.getLogger(__name__)
+
+# Products materialized by default: the burn window and the temperature cubes
+default_cube_products = ["window", "temperature_avg", "temperature_max"]
+
+# Days copied per read while materializing, so building a cube never holds a whole shard twice
+copy_days = 366
+
+
+# Concatenates every shard of a product into one raw (time, lat, lon) file with a json sidecar
+# recording its dtype and shape and where each shard starts. Shards are opened once each, oldest
+# first, and appended until the next one is missing. The burn window is 0/1, so it's stored as
+# uint8. Packed products keep their stored integers, and the sidecar records their packing.
+def materialize_cube(product, cube_path, metadata_path):
+    metadata = {"shard_begin": [], "shard_days": [], "shard_offset": []}
+    offset = 0
+    file = 1979
+    with open(cube_path + ".tmp", "wb") as cube:
+        while True:
+            try:
+                current_dataset = aggregate.open_shard(product + ".nc", file)
+            except Exception:
+                break
+
+            logger.info(f"Materializing {product} {file}-{file+5}")
+            with current_dataset:
+                current_data = current_dataset.__xarray_dataarray_variable__
+                if not metadata["shard_begin"]:
+                    metadata["lat"] = current_data.coords['lat'].values.tolist()
+                    metadata["lon"] = current_data.coords['lon'].values.tolist()
+                    dtype = np.dtype(np.uint8 if product == "window" else current_data.dtype)
+                    metadata["packing"] = {name: value.item() if hasattr(value, "item") else value
+                                           for name, value in aggregate.packing_attrs(current_data).items()}
+
+                days = current_data.shape[0]
+                for day in range(0, days, copy_days):
+                    cube.write(np.ascontiguousarray(current_data[day:day + copy_days].values, dtype=dtype).tobytes())
+
+            metadata["shard_begin"].append(file)
+            metadata["shard_days"].append(days)
+            metadata["shard_offset"].append(offset)
+            offset += days
+            file += 5
+
+    if not metadata["shard_begin"]:
+        os.remove(cube_path + ".tmp")
+        raise FileNotFoundError(f"No shards found for {product}")
+
+    metadata["dtype"] = dtype.str
+    metadata["shape"] = [offset, len(metadata["lat"]), len(metadata["lon"])]
+    with open(metadata_path + ".tmp", "w") as metadata_file:
+        json.dump(metadata, metadata_file)
+
+    # The cube is only visible under its real name once it's complete
+    os.replace(metadata_path + ".tmp", metadata_path)
+    os.replace(cube_path + ".tmp", cube_path)
+
+
+# Memory-maps each product's cube from cube_dir, materializing it first if it doesn't exist yet.
+# Run by every worker at startup: the first one to take a product's lock builds it while the
+# others wait, then all of them read the same pages through read-only views. Put cube_dir on
+# /dev/shm to keep the cubes in shared memory rather than the page cache of a disk.
+def load_cubes(cube_dir, product_names=None):
+    os.makedirs(cube_dir, exist_ok=True)
+    for product in product_names or default_cube_products:
+        cube_path = os.path.join(cube_dir, f"{product}.cube")
+        metadata_path = os.path.join(cube_dir, f"{product}.json")
+
+        with open(os.path.join(cube_dir, f"{product}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(cube_path):
+                    materialize_cube(product, cube_path, metadata_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        cube = np.memmap(cube_path, dtype=metadata["dtype"], mode="r", shape=tuple(metadata["shape"]))
+        aggregate.cubes[product] = (cube, metadata)
+        logger.info(f"Loaded {product} cube {aggregate.cubes[product][0].shape}")
@@ -0,0 +1,97 @@
+import io
+import numpy as np
+from .metrics import stage
+
+# Response headers describing an encoded grid, exposed to the frontend through CORS
+grid_headers = ["X-Grid-Shape", "X-Grid-Dtype", "X-Grid-Bounds", "X-Scale-Factor", "X-Add-Offset", "X-Fill-Value"]
+
+
+# WGS 84 latitude/longitude, the grid's coordinate reference system
+wgs84_wkt = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+             'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]]')
+
+
+def grid_bounds(grid):
+    lat, lon = grid.coords['lat'].values, grid.coords['lon'].values
+    return f"{lon.min()},{lat.min()},{lon.max()},{lat.max()}"
+
+
+def encode_netcdf(grid, name):
+    import h5netcdf
+    buffer = io.BytesIO()
+    with h5netcdf.File(buffer, "w") as nc:
+        nc.dimensions = {"lat": grid.shape[0], "lon": grid.shape[1]}
+
+        lat = nc.create_variable("lat", ("lat",), data=grid.coords['lat'].values)
+        lat.attrs["units"] = "degrees_north"
+        lat.attrs["long_name"] = "latitude"
+
+        lon = nc.create_variable("lon", ("lon",), data=grid.coords['lon'].values)
+        lon.attrs["units"] = "degrees_east"
+        lon.attrs["long_name"] = "longitude"
+
+        # CF grid mapping: a scalar variable describing the CRS, named by the data's grid_mapping
+        crs = nc.create_variable("crs", (), dtype=np.int32)
+        crs.attrs["grid_mapping_name"] = "latitude_longitude"
+        crs.attrs["longitude_of_prime_meridian"] = 0.0
+        crs.attrs["semi_major_axis"] = 6378137.0
+        crs.attrs["inverse_flattening"] = 298.257223563
+        crs.attrs["epsg_code"] = "EPSG:4326"
+        crs.attrs["crs_wkt"] = wgs84_wkt
+        crs.attrs["spatial_ref"] = wgs84_wkt
+
+        values = nc.create_variable(name, ("lat", "lon"), data=grid.values.astype(np.float32),
+                                    fillvalue=np.float32(np.nan), compression="gzip", compression_opts=4, shuffle=True)
+        values.attrs["grid_mapping"] = "crs"
+
+    return buffer.getvalue(), {}
+
+
+def encode_npy(grid, name):
+    buffer = io.BytesIO()
+    np.save(buffer, grid.values.astype(np.float32), allow_pickle=False)
+    return buffer.getvalue(), {}
+
+
+# Packs the grid into 8 or 16 bit unsigned integers spread linearly between its min and max.
+# The largest value is reserved for cells with no data. Unpack with value * scale + offset.
+def quantize(values, bits):
+    dtype = np.dtype(np.uint8 if bits == 8 else np.uint16).newbyteorder('<')
+    fill = np.iinfo(dtype).max
+
+    finite = np.isfinite(values)
+    low, high = (values[finite].min(), values[finite].max()) if finite.any() else (0.0, 0.0)
+    scale = (high - low) / (fill - 1) if high > low else 1.0
+
+    packed = np.full(values.shape, fill, dtype=dtype)
+    packed[finite] = np.round((values[finite] - low) / scale)
+    return packed, float(scale), float(low), int(fill)
+
+
+def encode_quantized(grid, name, bits=8):
+    packed, scale, offset, fill = quantize(grid.values.astype(np.float64), bits)
+    return packed.tobytes(), {
+        "X-Scale-Factor": repr(scale),
+        "X-Add-Offset": repr(offset),
+        "X-Fill-Value": str(fill),
+        "X-Grid-Dtype": packed.dtype.str,
+    }
+
+
+# format -> (encoder, mimetype, file extension)
+encoders = {
+    "netcdf": (encode_netcdf, "application/x-netcdf", "nc"),
+    "npy": (encode_npy, "application/octet-stream", "npy"),
+    "uint8": (lambda grid, name: encode_quantized(grid, name, 8), "application/octet-stream", "u8"),
+    "uint16": (lambda grid, name: encode_quantized(grid, name, 16), "application/octet-stream", "u16"),
+}
+
+
+def encode_grid(grid, name, grid_format):
+    encoder, mimetype, extension = encoders[grid_format]
+    with stage("encode"):
+        body, headers = encoder(grid, name)
+    headers["X-Grid-Shape"] = f"{grid.shape[0]},{grid.shape[1]}"
+    headers["X-Grid-Bounds"] = grid_bounds(grid)
+    headers.setdefault("X-Grid-Dtype", "<f4")
+    return body, mimetype, f"{name}.{extension}", headers
@@ -0,0 +1,144 @@
+import os
+import sys
+import functools
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+state_shapefile = "./flaskr/california_shp/CA_State_TIGER2016.shp"
+county_shapefile = "./flaskr/CA_Counties/CA_Counties_TIGER2016.shp"
+
+# Precomputed rasterizations of the shapefiles onto the data grid, committed alongside the code and
+# rebuilt by `python -m flaskr.geometry <any shard>`. Loading these avoids importing geopandas and
+# rioxarray and parsing the shapefiles in every worker.
+artifact_dir = "./flaskr/geometry/"
+artifact_names = ["grid_lat", "grid_lon", "state_mask", "county_labels", "county_geoids"]
+
+artifacts_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def state_shape():
+    import geopandas
+    return geopandas.read_file(state_shapefile)
+
+
+@functools.lru_cache(maxsize=1)
+def county_shape():
+    import geopandas
+    return geopandas.read_file(county_shapefile)
+
+
+# Cells of the lat/lon grid whose centers fall inside geometry, exactly as rio.clip selects them
+def rasterize(geometry, crs, lat, lon):
+    import xarray
+    import rioxarray
+    from rioxarray.exceptions import NoDataInBounds
+
+    ones = xarray.DataArray(np.ones((len(lat), len(lon))), coords=[lat, lon], dims=['lat', 'lon'])
+    ones = ones.rio.set_spatial_dims(x_dim='lon', y_dim='lat')
+    ones.rio.write_crs("EPSG:4326", inplace=True)
+    try:
+        return ones.rio.clip(geometry, crs, drop=False).notnull().values
+    except NoDataInBounds:
+        return np.zeros(ones.shape, dtype=bool)
+
+
+def rasterize_state(lat, lon):
+    from shapely.geometry import mapping
+    shape = state_shape()
+    return rasterize(shape.geometry.apply(mapping), shape.crs, lat, lon)
+
+
+# County number (1-based, in shapefile order) of every cell, 0 outside every county
+def rasterize_counties(lat, lon):
+    shape = county_shape()
+    labels = np.zeros((len(lat), len(lon)), dtype=np.int16)
+    for i in range(len(shape)):
+        county = rasterize([shape.geometry[i]], shape.crs, lat, lon)
+        if (labels[county] != 0).any():
+            raise ValueError(f"County {shape['GEOID'][i]} overlaps another on the grid")
+        labels[county] = i + 1
+    return labels, np.array(shape['GEOID'], dtype='U5')
+
+
+def build_artifacts(lat, lon, directory=None):
+    directory = directory or artifact_dir
+    os.makedirs(directory, exist_ok=True)
+    labels, geoids = rasterize_counties(lat, lon)
+    arrays = {"grid_lat": np.asarray(lat), "grid_lon": np.asarray(lon), "state_mask": rasterize_state(lat, lon),
+              "county_labels": labels, "county_geoids": geoids}
+    for name, array in arrays.items():
+        partial = os.path.join(directory, f"{name}.{os.getpid()}.npy")
+        np.save(partial, array, allow_pickle=False)
+        os.replace(partial, os.path.join(directory, f"{name}.npy"))
+
+
+@functools.lru_cache(maxsize=1)
+def load_artifacts():
+    with artifacts_lock:
+        paths = [os.path.join(artifact_dir, f"{name}.npy") for name in artifact_names]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return {name: np.load(path, allow_pickle=False) for name, path in zip(artifact_names, paths)}
+
+
+# Where each of part's coordinates sits in the full artifact grid, or None if part isn't a piece of
+# it. Coordinates are snapped to the nearest artifact cell, so grids written with slightly different
+# float rounding still match, as long as every coordinate is within a thousandth of a cell of one.
+def grid_positions(full, part):
+    if len(full) < 2 or len(part) == 0:
+        return None
+    positions = np.abs(full[None, :] - part[:, None]).argmin(axis=1)
+    tolerance = abs(full[1] - full[0]) * 1e-3
+    if len(np.unique(positions)) != len(part) or not np.allclose(full[positions], part, rtol=0, atol=tolerance):
+        return None
+    return positions
+
+
+# The artifact array cut down to the lat/lon grid, or None when the artifacts don't cover the grid
+def artifact_for_grid(name, lat, lon):
+    artifacts = load_artifacts()
+    if artifacts is None:
+        return None
+    rows, cols = grid_positions(artifacts["grid_lat"], lat), grid_positions(artifacts["grid_lon"], lon)
+    if rows is None or cols is None:
+        return None
+    return artifacts[name][np.ix_(rows, cols)]
+
+
+# Grids that aren't covered by the artifacts are rasterized from the shapefiles, once per grid
+@functools.lru_cache(maxsize=8)
+def rasterized_for_grid(name, lat_bytes, lon_bytes):
+    lat, lon = np.frombuffer(lat_bytes), np.frombuffer(lon_bytes)
+    logger.warning(f"Rasterizing the {name} shapefile onto a {len(lat)}x{len(lon)} grid")
+    if name == "state_mask":
+        return rasterize_state(lat, lon)
+    return rasterize_counties(lat, lon)
+
+
+def state_mask(lat, lon):
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    mask = artifact_for_grid("state_mask", lat, lon)
+    if mask is None:
+        mask = rasterized_for_grid("state_mask", lat.tobytes(), lon.tobytes())
+    return mask
+
+
+# (labels, geoids): each cell's county number and the GEOID of county number n at geoids[n - 1]
+def county_labels(lat, lon):
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    labels = artifact_for_grid("county_labels", lat, lon)
+    if labels is None:
+        return rasterized_for_grid("county_labels", lat.tobytes(), lon.tobytes())
+    return labels, load_artifacts()["county_geoids"]
+
+
+if __name__ == "__main__":
+    # python -m flaskr.geometry ./flaskr/window_1979_1984.nc, run from the service directory
+    import xarray
+    with xarray.open_dataset(sys.argv[1], engine="h5netcdf") as shard:
+        build_artifacts(shard.coords['lat'].values, shard.coords['lon'].values)
+    print(f"Wrote {', '.join(artifact_names)} to {artifact_dir}")
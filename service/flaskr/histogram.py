@@ -0,0 +1,13 @@
+import numpy as np
+
+# Kept free of the service's other modules: the master-netcdf tool loads this file by path to bin the
+# cumulative histograms it writes, so the days the service bins from the shards always match them.
+
+
+# (days, lat, lon) values, NaN where missing, counted into (lat, lon, bin) histograms of bins bins of
+# width starting at low. Values outside the bins are counted in the first or last one.
+def histogram_counts(values, low, width, bins):
+    valid = ~np.isnan(values)
+    index = np.clip(np.floor((np.where(valid, values, low) - low) / width), 0, bins - 1).astype(np.int64)
+    cells = np.arange(values[0].size).reshape(values.shape[1:])
+    return np.bincount((cells * bins + index)[valid], minlength=cells.size * bins).reshape(values.shape[1:] + (bins,))
@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Long queries run here instead of on the Flask worker that received them. The pool is bounded,
+# and so is the number of jobs waiting for it, so a burst of long ranges can't queue forever.
+max_workers = int(os.environ.get("BURN_WINDOW_JOB_WORKERS", 2))
+max_pending = int(os.environ.get("BURN_WINDOW_MAX_PENDING_JOBS", 32))
+
+# Finished jobs and their outputs are dropped after this many seconds
+job_ttl = 60 * 60
+
+# Each job's outputs and status.json live in a directory here, shared by every worker process, so a
+# poll can land on any of them and not only on the one running the job
+jobs_dir = "./flaskr/jobs/"
+
+# Seconds between reads of the status file while long-polling a job another worker runs
+job_poll_interval = 0.25
+
+executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="burn-window-job")
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+def job_output_dir(job_id):
+    return os.path.join(jobs_dir, job_id) + "/"
+
+
+def job_status(job):
+    return {key: job[key] for key in ("id", "status", "progress", "error")}
+
+
+def write_status(job):
+    path = job_output_dir(job["id"]) + "status.json"
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(partial, "w") as status_file:
+        json.dump(dict(job_status(job), finished=job["finished"]), status_file)
+    os.replace(partial, path)
+
+
+# A job's status as its worker last wrote it, or None for IDs that aren't jobs
+def read_status(job_id):
+    if not re.fullmatch("[0-9a-f]{32}", job_id):
+        return None
+    try:
+        with open(job_output_dir(job_id) + "status.json") as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError):
+        return None
+
+
+# Drops finished jobs older than job_ttl, whichever worker ran them
+def expire_jobs():
+    now = time.time()
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items() if job["finished"] and now - job["finished"] > job_ttl]:
+            del jobs[job_id]
+
+    for job_id in os.listdir(jobs_dir) if os.path.isdir(jobs_dir) else []:
+        job = read_status(job_id)
+        if job is not None and job["finished"] and now - job["finished"] > job_ttl:
+            shutil.rmtree(job_output_dir(job_id), ignore_errors=True)
+
+
+def run_job(job, work, args):
+    job["status"] = "running"
+    write_status(job)
+
+    def progress(fraction):
+        job["progress"] = round(fraction, 3)
+        write_status(job)
+
+    try:
+        work(*args, output_dir=job_output_dir(job["id"]), progress=progress)
+        job["progress"] = 1.0
+        job["status"] = "done"
+    except Exception as e:
+        traceback.print_exc()
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished"] = time.time()
+        write_status(job)
+        job["done"].set()
+
+
+# Queues work(*args, output_dir=..., progress=...) and returns its job ID,
+# or None when the queue is already full
+def submit_job(work, *args):
+    expire_jobs()
+    with jobs_lock:
+        pending = sum(1 for job in jobs.values() if job["status"] in ("queued", "running"))
+        if pending >= max_pending:
+            return None
+
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = job = {
+            "id": job_id,
+            "status": "queued",
+            "progress": 0.0,
+            "error": None,
+            "finished": None,
+            "done": threading.Event(),
+        }
+
+    os.makedirs(job_output_dir(job_id), exist_ok=True)
+    write_status(job)
+    executor.submit(run_job, job, work, args)
+    return job_id
+
+
+# Status of a job, waiting up to `wait` seconds for it to finish first (long polling). Jobs of
+# this process are read from memory, and those of other workers from their status file.
+def get_job(job_id, wait=0):
+    job = jobs.get(job_id)
+    if job is not None:
+        if wait > 0:
+            job["done"].wait(wait)
+        return job
+
+    deadline = time.time() + wait
+    while True:
+        job = read_status(job_id)
+        if job is None or job["status"] in ("done", "failed") or time.time() >= deadline:
+            return job
+        time.sleep(job_poll_interval)
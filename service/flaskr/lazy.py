@@ -0,0 +1,73 @@
+import os
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import stage
+
+# Bytes of shard values every request in the process may hold at once, shared by all of them
+memory_limit = int(os.environ.get("BURN_WINDOW_MEMORY_LIMIT_MB", 256)) * 1024 * 1024
+
+# Every lazy reduction in the process runs on this one pool
+lazy_threads = int(os.environ.get("BURN_WINDOW_DASK_THREADS", 4))
+lazy_pool = ThreadPoolExecutor(max_workers=lazy_threads, thread_name_prefix="burn-window-dask")
+
+# Slabs bigger than this are streamed in chunks no bigger than it, so lazy_threads chunks fit in
+# memory_limit. 64 MB by default, less than a 5-year shard of any product, even the uint8 humidity.
+chunk_limit = memory_limit // lazy_threads
+
+budget_free = memory_limit
+budget_changed = threading.Condition()
+
+
+# Holds nbytes of memory_limit for the block, waiting until that much is free. Every slab read
+# for a reduction is reserved first, so concurrent requests stay under memory_limit together.
+@contextmanager
+def reserve(nbytes):
+    global budget_free
+    nbytes = min(nbytes, memory_limit)
+    with budget_changed:
+        budget_changed.wait_for(lambda: budget_free >= nbytes)
+        budget_free -= nbytes
+    try:
+        yield
+    finally:
+        with budget_changed:
+            budget_free += nbytes
+            budget_changed.notify_all()
+
+
+def slab_bytes(segment):
+    return segment.size * segment.dtype.itemsize
+
+
+# Days per chunk so that one chunk of this segment fits in chunk_limit
+def chunk_days(segment):
+    day_bytes = slab_bytes(segment) // segment.shape[0]
+    return max(1, chunk_limit // day_bytes)
+
+
+# Reads days [first, last] of a (time, lat, lon) segment, cropped to crop, and reduces the part of
+# each member (start, end) range inside it. None for members that don't overlap the days read.
+def reduce_days(segment, first, last, members, reduce_shard, crop):
+    with reserve(slab_bytes(segment[first:last + 1])):
+        with stage("read"):
+            slab = segment[first:last + 1].values[crop]
+        with stage("reduce"):
+            return [reduce_shard(slab[max(start, first) - first:min(end, last) - first + 1], axis=0)
+                    if start <= last and end >= first else None
+                    for start, end in members]
+
+
+# Reduces each member (start, end) range of a segment in chunk_days chunks, read and reduced in
+# parallel on the local threaded scheduler, and combines each member's chunks. Only the chunks
+# being reduced are in memory, and those count against the process-wide memory_limit.
+def reduce_segment(segment, members, reduce_shard, combine, crop):
+    import dask
+    days = chunk_days(segment)
+    chunks = [dask.delayed(reduce_days, pure=False)(segment, first, min(first + days, segment.shape[0]) - 1,
+                                                     members, reduce_shard, crop)
+              for first in range(0, segment.shape[0], days)]
+    chunks = dask.compute(*chunks, scheduler="threads", pool=lazy_pool)
+    return [functools.reduce(combine, [chunk[i] for chunk in chunks if chunk[i] is not None])
+            for i in range(len(members))]
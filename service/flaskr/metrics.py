@@ -0,0 +1,50 @@
+import os
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client import multiprocess
+
+# Stages run from a few milliseconds (cache hits, small clips) up to minutes (full-record scans)
+stage_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+request_seconds = Histogram("burn_window_request_seconds", "Time to answer a request, by endpoint",
+                            ["endpoint"], buckets=stage_buckets)
+stage_seconds = Histogram("burn_window_stage_seconds", "Time spent in each stage of a request",
+                          ["stage"], buckets=stage_buckets)
+bytes_read = Counter("burn_window_bytes_read_total", "Bytes of data read, by source (s3, shard, cube, variable_cube, histogram or runs)", ["source"])
+cache_requests = Counter("burn_window_cache_requests_total",
+                         "Lookups in the result caches: hit, miss, or coalesced onto an in-flight miss",
+                         ["cache", "result"])
+
+
+# with stage("clip"): ... times the block into burn_window_stage_seconds{stage="clip"}
+def stage(name):
+    return stage_seconds.labels(name).time()
+
+
+# Reports the hits and misses of functools.lru_cache functions, read from cache_info() at scrape time
+class LruCacheCollector:
+    def __init__(self, caches):
+        self.caches = caches
+
+    def collect(self):
+        lookups = CounterMetricFamily("burn_window_lru_cache_requests", "Lookups in in-memory LRU caches",
+                                      labels=["cache", "result"])
+        for name, cached in self.caches.items():
+            info = cached.cache_info()
+            lookups.add_metric([name, "hit"], info.hits)
+            lookups.add_metric([name, "miss"], info.misses)
+        yield lookups
+
+
+def register_lru_caches(caches):
+    REGISTRY.register(LruCacheCollector(caches))
+
+
+# Prometheus exposition of this process's metrics, or of every worker's when running under a
+# multi-process server with PROMETHEUS_MULTIPROC_DIR set
+def latest_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
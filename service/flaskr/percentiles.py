@@ -0,0 +1,135 @@
+import datetime
+import numpy as np
+import xarray
+from .aggregate import open_optional, open_shard_data, plan_ranges, packing_attrs, unpack, clip_to_state
+from .climatology import day_number
+from .point import snap
+from .histogram import histogram_counts
+from .singleflight import coalesce
+from .metrics import stage, bytes_read
+
+# Products the master-netcdf tool writes per-pixel histograms for
+histogram_products = ["temperature_avg", "temperature_max", "humidity_min"]
+
+
+def month_first_day(first_year, month):
+    return day_number(datetime.date(first_year + month // 12, month % 12 + 1, 1))
+
+
+# Splits [start_date, end_date] into the whole histogram months (first, last) it covers, or None
+# when it covers none, and the ranges of days left over on either side
+def split_months(first_year, start_date, end_date):
+    start = datetime.date(1979, 1, 1) + datetime.timedelta(days=start_date)
+    first = (start.year - first_year) * 12 + start.month - 1
+    if month_first_day(first_year, first) < start_date:
+        first += 1
+    end = datetime.date(1979, 1, 1) + datetime.timedelta(days=end_date)
+    last = (end.year - first_year) * 12 + end.month - 1
+    if month_first_day(first_year, last + 1) - 1 > end_date:
+        last -= 1
+
+    if first > last:
+        return None, [(start_date, end_date)]
+    edges = []
+    if month_first_day(first_year, first) > start_date:
+        edges.append((start_date, month_first_day(first_year, first) - 1))
+    if month_first_day(first_year, last + 1) <= end_date:
+        edges.append((month_first_day(first_year, last + 1), end_date))
+    return (first, last), edges
+
+
+# Histograms of the days in ranges shorter than a month, binned straight from the shards
+def edge_counts(product, ranges, low, width, bins):
+    counts = 0
+    for file, slices in plan_ranges(ranges).items():
+        with open_shard_data(product + ".nc", file) as current_data:
+            packing = packing_attrs(current_data)
+            last_day = current_data.shape[0] - 1
+            for _, start_idx, end_idx in slices:
+                end_idx = last_day if end_idx is None else min(end_idx, last_day)
+                with stage("read"):
+                    values = current_data[start_idx:end_idx + 1].values
+                bytes_read.labels("shard").inc(values.nbytes)
+                with stage("reduce"):
+                    values = np.asarray(unpack(values, packing), dtype=np.float64)
+                    counts = counts + histogram_counts(values, low, width, bins)
+    return counts
+
+
+# Per-pixel histogram of a product over [start_date, end_date] as (counts, low, width, lat, lon).
+# Whole months are the difference of two cumulative histograms, so only the partial months at
+# either end are read from the shards, whatever the length of the range. None outside the record.
+def range_histogram(product, start_date, end_date):
+    histogram = open_optional(f"{product}_histogram.nc")
+    if histogram is None:
+        return None
+
+    with histogram:
+        low, width, bins = float(histogram.attrs['bin_low']), float(histogram.attrs['bin_width']), histogram.sizes['bin']
+        months, edges = split_months(int(histogram.attrs['first_year']), start_date, end_date)
+        if start_date < month_first_day(int(histogram.attrs['first_year']), 0) or \
+                (months is not None and months[1] >= histogram.sizes['month']):
+            return None
+
+        lat, lon = histogram.coords['lat'].values, histogram.coords['lon'].values
+        counts = np.zeros((len(lat), len(lon), bins), dtype=np.int64)
+        if months is not None:
+            first, last = months
+            for month, sign in [(last, 1), (first - 1, -1)] if first > 0 else [(last, 1)]:
+                with stage("read"):
+                    month_counts = histogram['counts'][month].values
+                bytes_read.labels("histogram").inc(month_counts.nbytes)
+                counts += sign * month_counts.astype(np.int64)
+
+    if edges:
+        counts += edge_counts(product, edges, low, width, bins)
+    return counts, low, width, lat, lon
+
+
+# The q-th percentile of each pixel's histogram, interpolated linearly within its bin. NaN for
+# pixels with no days counted.
+def histogram_percentile(counts, q, low, width):
+    cumulative = counts.cumsum(axis=-1)
+    total = cumulative[..., -1]
+    target = np.maximum(q / 100 * total, 1e-9)[..., None]
+
+    index = np.minimum((cumulative < target).sum(axis=-1, keepdims=True), counts.shape[-1] - 1)
+    below = np.take_along_axis(cumulative - counts, index, axis=-1)
+    in_bin = np.take_along_axis(counts, index, axis=-1)
+    fraction = np.clip((target - below) / np.maximum(in_bin, 1), 0, 1)
+    return np.where(total > 0, low + width * (index + fraction)[..., 0], np.nan)
+
+
+# The q-th percentile of a product's daily values over [start_date, end_date] at each pixel,
+# clipped to the state. Cached per product, percentile and range.
+@coalesce(maxsize=64)
+def percentile_grid(product, q, start_date, end_date):
+    histogram = range_histogram(product, start_date, end_date)
+    if histogram is None:
+        return None
+
+    counts, low, width, lat, lon = histogram
+    with stage("reduce"):
+        values = histogram_percentile(counts, q, low, width)
+    return clip_to_state(xarray.DataArray(values, coords=[lat, lon], dims=['lat', 'lon']))
+
+
+# The histogram of a product's daily values over [start_date, end_date] at the grid cell nearest to lat/lon
+def query_distribution(product, lat, lon, start_date, end_date):
+    histogram = range_histogram(product, start_date, end_date)
+    if histogram is None:
+        return None
+
+    counts, low, width, lats, lons = histogram
+    i, j = snap(lats, lat), snap(lons, lon)
+    if i is None or j is None:
+        return None
+
+    cell = counts[i, j]
+    return {
+        "product": product, "lat": float(lats[i]), "lon": float(lons[j]),
+        "start_date": start_date, "end_date": end_date,
+        "bin_edges": (low + width * np.arange(len(cell) + 1)).tolist(),
+        "counts": cell.tolist(),
+        "percentiles": {str(q): float(histogram_percentile(cell, q, low, width)) for q in (10, 25, 50, 75, 90)},
+    }
@@ -0,0 +1,69 @@
+import numpy as np
+from .aggregate import open_optional, open_shard_data, plan_ranges, shard_range, packing_attrs, unpack
+
+
+# Index of the grid cell whose center is nearest to value, or None if value falls outside the grid
+def snap(coords, value):
+    spacing = abs(coords[1] - coords[0])
+    i = int(np.abs(coords - value).argmin())
+    if abs(coords[i] - value) > spacing / 2:
+        return None
+    return i
+
+
+# Reads a pixel's daily values over [start_date, end_date] as one contiguous read
+# from the pixel-major file the master-netcdf tool writes next to the shards. Packed values are
+# unpacked the way the shards' are, so both give the same float64 values.
+def pixel_series(pixels, product, lat, lon, start_date, end_date):
+    i, j = snap(pixels.coords['lat'].values, lat), snap(pixels.coords['lon'].values, lon)
+    if i is None or j is None:
+        return None
+
+    start_file, end_file, first_idx, last_idx = shard_range(start_date, end_date)
+    offsets = dict(zip(pixels.shard_begin.values.tolist(), pixels.shard_offset.values.tolist()))
+    if start_file not in offsets or end_file - 5 not in offsets:
+        return None
+
+    first, last = offsets[start_file] + first_idx, offsets[end_file - 5] + last_idx
+    values = unpack(pixels[product][i, j, first:last + 1].values, packing_attrs(pixels[product]))
+    return float(pixels.coords['lat'][i]), float(pixels.coords['lon'][j]), values
+
+
+# Same series read straight from the shards: one strided read per shard
+def shard_series(product, lat, lon, start_date, end_date):
+    snapped, values = None, []
+    for file, slices in plan_ranges([(start_date, end_date)]).items():
+        with open_shard_data(product + ".nc", file) as current_data:
+            if snapped is None:
+                i, j = snap(current_data.coords['lat'].values, lat), snap(current_data.coords['lon'].values, lon)
+                if i is None or j is None:
+                    return None
+                snapped = (float(current_data.coords['lat'][i]), float(current_data.coords['lon'][j]))
+
+            (_, start_idx, end_idx), = slices
+            if end_idx is None:
+                end_idx = current_data.shape[0] - 1
+            values.append(unpack(current_data[start_idx:end_idx + 1, i, j].values, packing_attrs(current_data)))
+
+    return snapped[0], snapped[1], np.concatenate(values)
+
+
+def point_series(product, lat, lon, start_date, end_date):
+    pixels = open_optional(f"{product}_pixels.nc", mask_and_scale=False)
+    if pixels is None:
+        return shard_series(product, lat, lon, start_date, end_date)
+    with pixels:
+        return pixel_series(pixels, product, lat, lon, start_date, end_date)
+
+
+def query_point(product_names, lat, lon, start_date, end_date):
+    result = {"start_date": start_date, "end_date": end_date, "series": {}}
+    for product in product_names:
+        series = point_series(product, lat, lon, start_date, end_date)
+        if series is None:
+            return None
+
+        result["lat"], result["lon"], values = series
+        values = values.astype(np.float64)
+        result["series"][product] = np.where(np.isfinite(values), values, None).tolist()
+    return result
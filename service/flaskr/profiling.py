@@ -0,0 +1,96 @@
+import io
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from flask import request, current_app
+
+profiles_dir = "./flaskr/profiles/"
+
+# Allocation sites kept from each tracemalloc snapshot
+top_allocations = 50
+
+# tracemalloc traces the whole process, so profiled requests run one at a time
+profile_lock = threading.Lock()
+
+profile_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+# Profiling is off unless an admin token is configured, and then only for requests carrying it
+def is_admin(app):
+    token = app.config.get('PROFILE_TOKEN', os.environ.get('BURN_WINDOW_PROFILE_TOKEN'))
+    supplied = request.headers.get('X-Admin-Token')
+    return bool(token) and supplied is not None and hmac.compare_digest(token, supplied)
+
+
+def profile_requested():
+    return request.args.get('profile') in ('1', 'true') or request.headers.get('X-Profile') in ('1', 'true')
+
+
+def profile_path(profile_id, suffix):
+    return os.path.join(profiles_dir, profile_id + suffix)
+
+
+def save_profile(profile_id, profiler, snapshot, duration):
+    os.makedirs(profiles_dir, exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id, ".prof"))
+
+    with open(profile_path(profile_id, ".alloc.txt"), "w") as allocations:
+        for stat in snapshot.statistics("lineno")[:top_allocations]:
+            allocations.write(f"{stat}\n")
+
+    with open(profile_path(profile_id, ".json"), "w") as metadata:
+        json.dump({"id": profile_id, "path": request.path, "args": request.args.to_dict(),
+                   "seconds": duration, "created": time.time()}, metadata)
+
+
+# Runs the view under cProfile and tracemalloc when an admin asks for it with ?profile=1 or an
+# X-Profile: 1 header. The profile is stored under a request ID returned in X-Profile-Id.
+def profiled(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profile_requested() or not is_admin(current_app):
+            return view(*args, **kwargs)
+
+        profile_id = uuid.uuid4().hex
+        with profile_lock:
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                response = current_app.make_response(profiler.runcall(view, *args, **kwargs))
+            finally:
+                duration = time.perf_counter() - start
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                save_profile(profile_id, profiler, snapshot, duration)
+
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+    return wrapper
+
+
+def profile_exists(profile_id):
+    return profile_id_pattern.match(profile_id) is not None and os.path.exists(profile_path(profile_id, ".json"))
+
+
+# Human-readable summary: the request, its top functions by cumulative time and its top allocations
+def profile_report(profile_id, limit=50):
+    with open(profile_path(profile_id, ".json")) as metadata:
+        report = json.load(metadata)
+
+    stats_text = io.StringIO()
+    stats = pstats.Stats(profile_path(profile_id, ".prof"), stream=stats_text)
+    stats.sort_stats("cumulative").print_stats(limit)
+    report["stats"] = stats_text.getvalue()
+
+    with open(profile_path(profile_id, ".alloc.txt")) as allocations:
+        report["allocations"] = allocations.read().splitlines()
+    return report
@@ -0,0 +1,80 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+from .metrics import cache_requests
+
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
+# Runs work() once for all concurrent callers passing the same key. The first caller computes,
+# the rest wait for it and get its result (or its exception).
+def single_flight(key, work, cache_name=None):
+    with in_flight_lock:
+        call = in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = in_flight[key] = {"done": threading.Event(), "result": None, "error": None}
+
+    if cache_name is not None:
+        cache_requests.labels(cache_name, "miss" if leader else "coalesced").inc()
+
+    if not leader:
+        call["done"].wait()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    try:
+        call["result"] = work()
+        return call["result"]
+    except Exception as e:
+        call["error"] = e
+        raise
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+        call["done"].set()
+
+
+# Caches the most recent results of a function by its arguments, and coalesces concurrent calls
+# that miss the cache into one computation. Arguments are bound to the function's parameters, so
+# calls passing them positionally, by keyword or left to their defaults share an entry. Results
+# are shared between callers, so treat them as read-only.
+def coalesce(maxsize=32):
+    def decorator(work):
+        results = OrderedDict()
+        results_lock = threading.Lock()
+        signature = inspect.signature(work)
+
+        @functools.wraps(work)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (work.__module__, work.__qualname__) + tuple(
+                (name, tuple(sorted(value.items())) if signature.parameters[name].kind == inspect.Parameter.VAR_KEYWORD
+                 else value) for name, value in bound.arguments.items())
+            with results_lock:
+                if key in results:
+                    results.move_to_end(key)
+                    cache_requests.labels(work.__name__, "hit").inc()
+                    return results[key]
+
+            def compute():
+                result = work(*args, **kwargs)
+                with results_lock:
+                    results[key] = result
+                    while len(results) > maxsize:
+                        results.popitem(last=False)
+                return result
+
+            return single_flight(key, compute, work.__name__)
+
+        def cache_clear():
+            with results_lock:
+                results.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
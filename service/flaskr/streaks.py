@@ -0,0 +1,55 @@
+import numpy as np
+import xarray
+from .aggregate import open_optional, clip_to_state
+from .singleflight import coalesce
+from .metrics import stage, bytes_read
+
+# Statistics /streaks serves: the longest run of window days, and the number of runs of at least min_length days
+streak_stats = ["longest", "runs"]
+
+
+# The (start, length, cell) of every window run that can overlap [first, last], in days of the
+# record. Only runs starting in the lookback before first are read, plus the long runs.
+def read_runs(runs, first, last):
+    days = runs.sizes['day'] - 1
+    begin = min(max(first - int(runs.attrs['lookback']) + 1, 0), days)
+    end = min(max(last + 1, 0), days)
+    lo, hi = (int(offset) for offset in runs['day_offset'][[begin, end]].values)
+
+    with stage("read"):
+        read = [np.concatenate([runs[f"run_{name}"][lo:hi].values, runs[f"long_run_{name}"].values])
+                for name in ["start", "length", "cell"]]
+    bytes_read.labels("runs").inc(sum(values.nbytes for values in read))
+    return read
+
+
+# Per-pixel longest run of consecutive window days in [start_date, end_date] and number of runs of
+# at least min_length days, counting only the days of each run inside the range. Computed from the
+# run-length encoded window, so the cost follows the number of runs rather than of daily grids.
+# None when the range isn't entirely inside the record.
+@coalesce(maxsize=64)
+def streak_grids(start_date, end_date, min_length):
+    runs = open_optional("window_runs.nc")
+    if runs is None:
+        return None
+
+    with runs:
+        first, last = start_date - int(runs.attrs['first_day']), end_date - int(runs.attrs['first_day'])
+        # day_offset has an entry past the last day of the record
+        if first < 0 or last > runs.sizes['day'] - 2:
+            return None
+        starts, lengths, cells = read_runs(runs, first, last)
+        lat, lon = runs.coords['lat'].values, runs.coords['lon'].values
+
+    with stage("reduce"):
+        in_range = np.minimum(starts + lengths - 1, last) - np.maximum(starts, first) + 1
+        overlapping = in_range > 0
+        cells, in_range = cells[overlapping], in_range[overlapping]
+
+        longest = np.zeros(len(lat) * len(lon), dtype=np.int64)
+        np.maximum.at(longest, cells, in_range)
+        long_enough = np.bincount(cells[in_range >= min_length], minlength=len(lat) * len(lon))
+
+    return {stat: clip_to_state(xarray.DataArray(values.reshape(len(lat), len(lon)).astype(np.float64),
+                                                 coords=[lat, lon], dims=['lat', 'lon']))
+            for stat, values in zip(streak_stats, [longest, long_enough])}
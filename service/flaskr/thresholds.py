@@ -0,0 +1,100 @@
+import logging
+import numpy as np
+import xarray
+from .aggregate import open_data_file, plan_ranges, bbox_slices, clip_to_state
+from .singleflight import coalesce
+from .metrics import stage, bytes_read
+
+logger = logging.getLogger(__name__)
+
+# Clipped, packed gridMET inputs written by the builder next to the product shards
+variables = ["rmin", "rmax", "tmmn", "tmmx", "vs"]
+
+# The bounds the builder's burn_window compares against, in the inputs' units (%, K and m/s):
+# {variable: (lowest, highest)}, with None for no bound. A day passes when it meets all of them,
+# whereas burn_window chains its flags with ==, so the defaults don't reproduce the window product.
+default_thresholds = {
+    "rmin": (30, None),
+    "rmax": (None, 55),
+    "tmmn": (237.15, None),
+    "tmmx": (None, 305.15),
+    "vs": (2, 10),
+}
+
+# Days compared at a time, so the five variables' slabs stay small whatever the range
+threshold_chunk_days = 92
+
+
+# Query parameters <variable>_min and <variable>_max override the default bounds, and "none"
+# drops a bound. Returns a hashable ((variable, lowest, highest), ...) threshold set, or raises
+# ValueError for values that aren't finite numbers.
+def parse_thresholds(args):
+    thresholds = []
+    for variable in variables:
+        bounds = list(default_thresholds[variable])
+        for i, suffix in enumerate(["min", "max"]):
+            value = args.get(f"{variable}_{suffix}")
+            if value is not None:
+                bounds[i] = None if value.lower() == "none" else float(value)
+                if bounds[i] is not None and not np.isfinite(bounds[i]):
+                    raise ValueError(f"{variable}_{suffix} must be a finite number or none")
+        thresholds.append((variable, bounds[0], bounds[1]))
+    return tuple(thresholds)
+
+
+# The bounds of a threshold in the variable's stored integers. The highest stored value below
+# the fill value is always an upper bound, so cells with no data never pass.
+def packed_bounds(low, high, attrs):
+    scale, offset, fill = attrs.get('scale_factor', 1.0), attrs.get('add_offset', 0.0), int(attrs['_FillValue'])
+    packed_low = 0 if low is None else int(np.ceil((low - offset) / scale - 1e-6))
+    packed_high = fill - 1 if high is None else min(fill - 1, int(np.floor((high - offset) / scale + 1e-6)))
+    return max(packed_low, 0), packed_high
+
+
+# Days in [start_date, end_date] each cell meets every threshold, compared on the stored integers
+# a chunk of days at a time and summed as it goes
+def count_window_days(thresholds, start_date, end_date, bbox=None):
+    result, lat, lon = None, None, None
+
+    for file, slices in plan_ranges([(start_date, end_date)]).items():
+        logger.debug(f"Opening variable cubes {file}-{file+5}")
+        datasets = [open_data_file(f"{variable}_{file}_{file+5}.nc", mask_and_scale=False) for variable in variables]
+        try:
+            cubes = [dataset[variable] for dataset, variable in zip(datasets, variables)]
+            bounds = [packed_bounds(low, high, cube.attrs) for cube, (_, low, high) in zip(cubes, thresholds)]
+            (lat_read, lon_read), (lat_crop, lon_crop) = bbox_slices(cubes[0], bbox)
+            if result is None:
+                lat, lon = cubes[0].coords['lat'][lat_read][lat_crop], cubes[0].coords['lon'][lon_read][lon_crop]
+                result = np.zeros((len(lat), len(lon)), dtype=np.uint32)
+
+            _, start_idx, end_idx = slices[0]
+            end_idx = cubes[0].shape[0] - 1 if end_idx is None else min(end_idx, cubes[0].shape[0] - 1)
+            for chunk_start in range(start_idx, end_idx + 1, threshold_chunk_days):
+                chunk = slice(chunk_start, min(chunk_start + threshold_chunk_days, end_idx + 1))
+                meets = None
+                for cube, (packed_low, packed_high) in zip(cubes, bounds):
+                    with stage("read"):
+                        values = cube[chunk, lat_read, lon_read].values[:, lat_crop, lon_crop]
+                    bytes_read.labels("variable_cube").inc(values.nbytes)
+                    with stage("reduce"):
+                        if meets is None:
+                            meets = values <= packed_high
+                        else:
+                            meets &= values <= packed_high
+                        if packed_low > 0:
+                            meets &= values >= packed_low
+                with stage("reduce"):
+                    result += meets.sum(axis=0, dtype=np.uint32)
+        finally:
+            for dataset in datasets:
+                dataset.close()
+
+    return xarray.DataArray(result, coords=[lat, lon], dims=['lat', 'lon'])
+
+
+# Burn window days for a custom threshold set, clipped to the state like the window product.
+# Results are cached per threshold set and range.
+@coalesce(maxsize=64)
+def threshold_window(thresholds, start_date, end_date, bbox=None):
+    window = count_window_days(thresholds, start_date, end_date, bbox)
+    return clip_to_state(window.astype(np.float64))
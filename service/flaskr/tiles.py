@@ -0,0 +1,162 @@
+import io
+import os
+import hashlib
+import functools
+import threading
+import numpy as np
+from PIL import Image
+from .aggregate import aggregate_window_data
+
+tile_size = 256
+
+# Deepest zoom served. gridMET cells are about 4 km, already hundreds of pixels across at this zoom.
+max_zoom = 12
+
+# Rendered tiles are kept on disk between restarts, keyed by the query and the grid that produced them
+tile_cache_dir = "./flaskr/tile_cache/"
+
+# Size the tile cache is kept under. The least recently used tiles are evicted first.
+tile_cache_max_bytes = int(os.environ.get("BURN_WINDOW_TILE_CACHE_MB", 512)) * 1024 * 1024
+
+# Bytes in the tile cache as this worker last counted them, None until first counted. Workers
+# count their own writes only, and recount everything whenever they evict.
+tile_cache_bytes = None
+tile_cache_lock = threading.Lock()
+
+# Same colormaps as the full-state renders from /query
+colormaps = {
+    "window": "hot",
+    "temperature_avg": "copper",
+    "temperature_max": "copper",
+    "humidity_min": "Purples",
+}
+
+
+# The aggregated grid behind a query's tiles, along with the color scale every tile shares so
+# that neighbouring tiles match, and a digest of the grid so tiles rendered from shards since
+# rebuilt are never served. Panning and zooming reuse it instead of rescanning the shards.
+@functools.lru_cache(maxsize=16)
+def tile_grid(product, start_date, end_date):
+    grid = aggregate_window_data(product + ".nc", start_date, end_date)
+    values = grid.values.astype(np.float64)
+    finite = values[np.isfinite(values)]
+    low, high = (finite.min(), finite.max()) if finite.size else (0.0, 1.0)
+    lat, lon = grid.coords['lat'].values, grid.coords['lon'].values
+    digest = hashlib.sha1(b"".join(array.tobytes() for array in (values, lat, lon))).hexdigest()[:16]
+    return values, lat, lon, low, high, digest
+
+
+# Lat/lon of the centers of a tile's pixels, for XYZ tile z/x/y in Web Mercator
+def tile_pixel_centers(z, x, y):
+    n = 2 ** z
+    pixels = (np.arange(tile_size) + 0.5) / tile_size
+    lon = (x + pixels) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+    return lat, lon
+
+
+# Nearest grid index for each coordinate, -1 where it falls outside the grid
+def grid_index(coords, values):
+    spacing = coords[1] - coords[0]
+    index = np.round((values - coords[0]) / spacing).astype(np.int64)
+    index[(index < 0) | (index >= len(coords))] = -1
+    return index
+
+
+# Renders the grid cells at rows x cols of a tile's pixels, -1 for pixels off the grid
+def render_tile(product, values, rows, cols, low, high):
+    from matplotlib import colormaps as matplotlib_colormaps
+    sampled = values[rows[:, None], cols[None, :]]
+    sampled[(rows[:, None] < 0) | (cols[None, :] < 0)] = np.nan
+
+    scaled = (sampled - low) / (high - low) if high > low else np.zeros_like(sampled)
+    rgba = matplotlib_colormaps[colormaps[product]](scaled, bytes=True)
+    rgba[~np.isfinite(sampled)] = 0
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+# A fully transparent tile, for tiles that miss the grid
+@functools.lru_cache(maxsize=1)
+def empty_tile():
+    buffer = io.BytesIO()
+    Image.new("RGBA", (tile_size, tile_size)).save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+# Deletes the least recently used tiles until the cache holds at most target bytes, along with
+# directories left empty. Returns the bytes left.
+def evict_tiles(target):
+    tiles = []
+    for directory, _, names in os.walk(tile_cache_dir):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in tiles)
+    for _, size, path in sorted(tiles):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    for directory, _, _ in os.walk(tile_cache_dir, topdown=False):
+        if directory.rstrip("/") != tile_cache_dir.rstrip("/"):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    return total
+
+
+def cache_tile(path, tile):
+    global tile_cache_bytes
+    with tile_cache_lock:
+        if tile_cache_bytes is None:
+            tile_cache_bytes = evict_tiles(tile_cache_max_bytes)
+
+    # Write to a temporary name first so a concurrent reader never sees half a tile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as cached:
+        cached.write(tile)
+    os.replace(temp_path, path)
+
+    with tile_cache_lock:
+        tile_cache_bytes += len(tile)
+        if tile_cache_bytes > tile_cache_max_bytes:
+            tile_cache_bytes = evict_tiles(tile_cache_max_bytes * 0.9)
+
+
+# PNG bytes of a tile: from memory, then from the disk cache, rendering it only on a miss.
+# Tiles off the grid are the shared empty tile and never stored.
+@functools.lru_cache(maxsize=2048)
+def get_tile(product, start_date, end_date, z, x, y):
+    values, grid_lat, grid_lon, low, high, digest = tile_grid(product, start_date, end_date)
+    lat, lon = tile_pixel_centers(z, x, y)
+    rows, cols = grid_index(grid_lat, lat), grid_index(grid_lon, lon)
+    if (rows < 0).all() or (cols < 0).all():
+        return empty_tile()
+
+    path = os.path.join(tile_cache_dir, f"{product}_{start_date}_{end_date}_{digest}", str(z), str(x), f"{y}.png")
+    try:
+        with open(path, "rb") as cached:
+            tile = cached.read()
+        # Mark it used, so eviction keeps it over tiles nobody has asked for in a while
+        os.utime(path)
+        return tile
+    except FileNotFoundError:
+        pass
+
+    tile = render_tile(product, values, rows, cols, low, high)
+    cache_tile(path, tile)
+    return tile
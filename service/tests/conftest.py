@@ -0,0 +1,130 @@
+# Runs the service against the synthetic shards of benchmarks/fixtures.py: one 5-year set for
+# 1979-1983 on the real grid, written once per session, plus whatever the builder derives from
+# them for the tests that ask for it. Run from the service directory with python -m pytest.
+import os
+import sys
+import importlib.util
+import numpy as np
+import xarray
+import pytest
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+builder_dir = os.path.join(os.path.dirname(service_dir), "master-netcdf")
+sys.path.insert(0, service_dir)
+sys.path.insert(0, os.path.join(service_dir, "benchmarks"))
+
+import fixtures
+import flaskr
+from flaskr import aggregate, geometry, jobs, profiling, tiles
+
+product_names = ["window", "temperature_avg", "temperature_max", "humidity_min"]
+
+# The record the shards hold, in days since 1979-01-01
+first_year, end_year = 1979, 1984
+last_day = 1825
+
+
+@pytest.fixture(scope="session")
+def shard_dir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("shards"))
+    fixtures.write_shards(directory, first_year, end_year, product_names)
+    return directory
+
+
+# Points the service at the shards, with its job, profile and tile directories under tmp_path.
+# The shapefiles and geometry artifacts are read relative to the service directory, as when it's served.
+@pytest.fixture(autouse=True)
+def service(shard_dir, tmp_path, monkeypatch):
+    monkeypatch.chdir(service_dir)
+    monkeypatch.setattr(aggregate, "data_dir", shard_dir + "/")
+    monkeypatch.setattr(jobs, "jobs_dir", str(tmp_path / "jobs") + "/")
+    monkeypatch.setattr(profiling, "profiles_dir", str(tmp_path / "profiles") + "/")
+    monkeypatch.setattr(tiles, "tile_cache_dir", str(tmp_path / "tile_cache") + "/")
+    monkeypatch.setattr(tiles, "tile_cache_bytes", None)
+
+
+@pytest.fixture
+def client():
+    return flaskr.create_app({"TESTING": True}).test_client()
+
+
+# master-netcdf/netcdf.py, which reads its shapefile relative to its own directory when imported
+@pytest.fixture(scope="session")
+def builder():
+    working_dir = os.getcwd()
+    os.chdir(builder_dir)
+    try:
+        spec = importlib.util.spec_from_file_location("netcdf", os.path.join(builder_dir, "netcdf.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        os.chdir(working_dir)
+
+
+# Runs a builder step in the shard directory, where it reads the shards and writes what it derives
+def build(shard_dir, step, *args):
+    working_dir = os.getcwd()
+    os.chdir(shard_dir)
+    try:
+        step(*args)
+    finally:
+        os.chdir(working_dir)
+
+
+# Derived files are written next to the shards, so tests that don't ask for them see the shards alone
+@pytest.fixture(scope="session")
+def derived_dir(shard_dir, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("derived"))
+    for name in os.listdir(shard_dir):
+        os.symlink(os.path.join(shard_dir, name), os.path.join(directory, name))
+    return directory
+
+
+@pytest.fixture
+def derived(derived_dir, monkeypatch):
+    monkeypatch.setattr(aggregate, "data_dir", derived_dir + "/")
+    return derived_dir
+
+
+@pytest.fixture(scope="session")
+def built_pixels(builder, derived_dir):
+    for name in product_names:
+        build(derived_dir, builder.create_pixel_major_netcdf, name)
+
+
+@pytest.fixture(scope="session")
+def built_monthly(builder, derived_dir):
+    for name in product_names:
+        build(derived_dir, builder.create_monthly_rollup_netcdf, name)
+
+
+@pytest.fixture(scope="session")
+def built_histograms(builder, derived_dir):
+    for name in builder.histograms:
+        build(derived_dir, builder.create_histogram_netcdf, name)
+
+
+@pytest.fixture(scope="session")
+def built_runs(builder, derived_dir):
+    build(derived_dir, builder.create_window_runs_netcdf)
+
+
+# A product's daily values over days [first, last] of the record straight from its shard, packed
+# products unpacked into float64 with fill values as NaN
+def shard_values(shard_dir, product, first, last):
+    path = os.path.join(shard_dir, f"{product}_{first_year}_{end_year}.nc")
+    with xarray.open_dataset(path, mask_and_scale=False) as dataset:
+        values = dataset["__xarray_dataarray_variable__"][first:last + 1].load()
+    if "scale_factor" not in values.attrs:
+        return values
+    unpacked = values * float(values.attrs["scale_factor"]) + float(values.attrs["add_offset"])
+    return unpacked.where(values != values.attrs["_FillValue"])
+
+
+# values masked to the state and cropped to its extent, as the service clips grids
+def clip(values):
+    mask = geometry.state_mask(values.coords['lat'].values, values.coords['lon'].values)
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    clipped = values.where(xarray.DataArray(mask, dims=['lat', 'lon']))
+    return clipped.isel(lat=slice(rows[0], rows[-1] + 1), lon=slice(cols[0], cols[-1] + 1))
@@ -0,0 +1,61 @@
+import io
+import json
+import zipfile
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import shard_values, clip, last_day
+
+
+def expected_frames(shard_dir, product, ranges):
+    values = [shard_values(shard_dir, product, start, end) for start, end in ranges]
+    if product == "window":
+        return np.stack([clip(frame.sum("time").astype(np.float64)).values for frame in values])
+    return np.stack([clip(frame.mean("time")).values for frame in values])
+
+
+# Frames of 7 days from the 10th day, the last one cut short to 3 days
+@pytest.mark.parametrize("product", ["window", "temperature_avg"])
+def test_zip_frames_share_one_color_scale(client, shard_dir, product):
+    response = client.get(f'/animation?product={product}&start_date=10&end_date=47&step=7&format=zip&scale=1')
+    assert response.status_code == 200
+    ranges = [[10, 16], [17, 23], [24, 30], [31, 37], [38, 44], [45, 47]]
+    assert response.headers["X-Frame-Count"] == "6" and response.headers["X-Frame-Days"] == "7"
+
+    expected = expected_frames(shard_dir, product, ranges)
+    low, high = np.nanmin(expected), np.nanmax(expected)
+    np.testing.assert_allclose([float(response.headers["X-Value-Min"]), float(response.headers["X-Value-Max"])],
+                               [low, high], rtol=1e-9)
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        metadata = json.loads(archive.read("frames.json"))
+        assert metadata["frames"] == ranges
+        for i, ((start, end), frame) in enumerate(zip(ranges, expected)):
+            indices = np.asarray(Image.open(io.BytesIO(archive.read(f"frame_{i:04d}_{start}_{end}.png"))))
+            colors = np.where(np.isfinite(frame), 1 + np.round((frame - low) / (high - low) * 254), 0)
+            np.testing.assert_allclose(indices, colors, atol=1)
+            assert ((indices == 0) == np.isnan(frame)).all()
+
+
+@pytest.mark.parametrize("animation_format, mimetype", [("gif", "image/gif"), ("apng", "image/apng")])
+def test_animated_formats(client, animation_format, mimetype):
+    response = client.get(f'/animation?start_date=0&end_date=29&step=3&format={animation_format}&frame_ms=120&scale=3')
+    assert response.status_code == 200 and response.mimetype == mimetype
+
+    image = Image.open(io.BytesIO(response.data))
+    assert image.n_frames == 10
+    assert image.info["duration"] == 120
+    grid = expected_grid_shape(client)
+    assert image.size == (grid[1] * 3, grid[0] * 3)
+
+
+def expected_grid_shape(client):
+    return tuple(int(size) for size in client.get('/grid?start_date=0&end_date=2&format=npy').headers["X-Grid-Shape"].split(","))
+
+
+@pytest.mark.parametrize("query", ['start_date=0&end_date=400', f'start_date=1800&end_date={last_day + 1}',
+                                   'start_date=-30&end_date=10', 'start_date=10&end_date=0', 'start_date=0&end_date=10&step=0',
+                                   'start_date=0&end_date=10&frame_ms=5', 'start_date=0&end_date=10&scale=5',
+                                   'start_date=0&end_date=10&format=mp4'])
+def test_bad_requests(client, query):
+    assert client.get(f'/animation?{query}').status_code == 400
@@ -0,0 +1,47 @@
+import io
+import numpy as np
+from conftest import shard_values, clip, last_day
+
+ranges = [[0, 30], [20, 90], [365, 729], [1800, last_day]]
+
+
+def test_grids_match_each_range_alone(client, shard_dir):
+    response = client.post('/batch', json={"ranges": ranges, "products": ["window", "temperature_max"], "format": "npz"})
+    assert response.status_code == 200
+
+    arrays = np.load(io.BytesIO(response.data))
+    np.testing.assert_array_equal(arrays["ranges"], ranges)
+    for i, (start, end) in enumerate(ranges):
+        window = clip(shard_values(shard_dir, "window", start, end).sum("time").astype(np.float64))
+        np.testing.assert_array_equal(arrays["window"][i], window.values.astype(np.float32))
+        maximum = clip(shard_values(shard_dir, "temperature_max", start, end).max("time"))
+        np.testing.assert_allclose(arrays["temperature_max"][i], maximum.values, rtol=1e-6)
+
+
+# Days are inclusive at both ends, so the average divides by every day of the range
+def test_averages_count_both_ends(client, shard_dir):
+    response = client.post('/batch', json={"ranges": [[100, 100], [100, 101]], "products": ["temperature_avg"]})
+    assert response.status_code == 200
+
+    grids = response.get_json()["products"]["temperature_avg"]["grids"]
+    for grid, (start, end) in zip(grids, [(100, 100), (100, 101)]):
+        expected = clip(shard_values(shard_dir, "temperature_avg", start, end).mean("time")).values
+        values = np.array(grid, dtype=np.float64)
+        np.testing.assert_array_equal(np.isnan(values), np.isnan(expected))
+        np.testing.assert_allclose(values, expected, rtol=1e-6)
+
+
+def test_county_tables_match_county(client):
+    response = client.post('/batch', json={"ranges": ranges[:2], "format": "county"})
+    assert response.status_code == 200
+
+    counties = response.get_json()["counties"]
+    for (start, end), table in zip(ranges[:2], counties):
+        assert table == client.get(f'/county?start_date={start}&end_date={end}').get_json()
+
+
+def test_bad_requests(client):
+    for body in [{}, {"ranges": []}, {"ranges": [[40, 10]]}, {"ranges": [[0, "a"]]}, {"ranges": [[0, 10]], "products": ["rain"]},
+                 {"ranges": [[0, 10]], "format": "csv"}, {"ranges": [[0, last_day + 1]]},
+                 {"ranges": [[0, 10], [-400, 10]], "format": "county"}]:
+        assert client.post('/batch', json=body).status_code == 400, body
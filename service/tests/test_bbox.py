@@ -0,0 +1,50 @@
+import io
+import numpy as np
+import xarray
+import pytest
+
+bbox = (-122.6, 37.1, -120.9, 38.4)
+
+
+def get_grid(client, query):
+    response = client.get(f'/grid?{query}')
+    assert response.status_code == 200
+    with xarray.open_dataset(io.BytesIO(response.data), engine="h5netcdf") as grid:
+        return grid[list(grid.data_vars)[-1]].load()
+
+
+# The box's cells hold the same values as the whole grid, and nothing outside the box is returned
+@pytest.mark.parametrize("product", ["window", "temperature_avg", "humidity_min"])
+def test_grid_is_the_whole_grid_cropped(client, product):
+    whole = get_grid(client, f'start_date=200&end_date=260&product={product}')
+    boxed = get_grid(client, f'start_date=200&end_date=260&product={product}&bbox={",".join(map(str, bbox))}')
+
+    lat, lon = boxed.coords['lat'].values, boxed.coords['lon'].values
+    assert bbox[1] <= lat.min() and lat.max() <= bbox[3]
+    assert bbox[0] <= lon.min() and lon.max() <= bbox[2]
+    np.testing.assert_array_equal(boxed.values, whole.sel(lat=lat, lon=lon).values)
+    assert np.isfinite(boxed.values).any()
+
+
+def test_batch_applies_the_box_to_every_range(client):
+    body = {"ranges": [[0, 30], [400, 500]], "products": ["window"], "bbox": ",".join(map(str, bbox)), "format": "npz"}
+    response = client.post('/batch', json=body)
+    assert response.status_code == 200
+
+    arrays = np.load(io.BytesIO(response.data))
+    for i, (start, end) in enumerate(body["ranges"]):
+        whole = get_grid(client, f'start_date={start}&end_date={end}')
+        expected = whole.sel(lat=arrays["window_lat"], lon=arrays["window_lon"]).values
+        np.testing.assert_array_equal(arrays["window"][i], expected)
+
+
+# Only sea inside the box: every cell is outside the state
+def test_box_outside_the_state_is_empty(client):
+    grid = get_grid(client, 'start_date=0&end_date=30&bbox=-124.4,33,-123.5,34')
+    assert np.isnan(grid.values).all()
+
+
+@pytest.mark.parametrize("value", ["-120,38,-121,39", "-120,39,-119,38", "-120,38,-119", "west,38,-119,39",
+                                   "-100,30,-90,40"])
+def test_bad_boxes(client, value):
+    assert client.get(f'/grid?start_date=0&end_date=30&bbox={value}').status_code == 400
@@ -0,0 +1,77 @@
+import os
+import datetime
+import numpy as np
+import pandas
+import xarray
+import pytest
+from netCDF4 import Dataset
+
+# A small grid standing in for California, with its corner outside the state
+small_lat, small_lon = np.array([38.0, 37.9, 37.8]), np.array([-121.0, -120.9, -120.8, -120.7])
+typical = {"rmin": (10, 50), "rmax": (30, 90), "tmmn": (265, 290), "tmmx": (285, 310), "vs": (0, 12)}
+
+
+# Clipped gridMET inputs as clip_to_cali returns them: values in the inputs' units on a 0.1 step,
+# NaN outside the state, along a day coordinate
+def clipped_input(name, year):
+    days = pandas.date_range(f"{year}-01-01", f"{year}-12-31")
+    rng = np.random.default_rng([year, list(typical).index(name)])
+    low, high = typical[name]
+    values = np.round(rng.uniform(low, high, (len(days), len(small_lat), len(small_lon))), 1)
+    values[:, 0, 0] = np.nan
+    return xarray.DataArray(values, coords=[days, small_lat, small_lon], dims=['day', 'lat', 'lon'])
+
+
+@pytest.fixture
+def built(builder, tmp_path, monkeypatch):
+    clipped = []
+
+    def clip_to_cali(path):
+        name, year = os.path.basename(path)[:-3].split("_")
+        clipped.append((name, int(year)))
+        return clipped_input(name, int(year))
+    monkeypatch.setattr(builder, "clip_to_cali", clip_to_cali)
+    monkeypatch.chdir(tmp_path)
+    return clipped
+
+
+def record(name):
+    return xarray.concat([clipped_input(name, year) for year in range(1979, 1984)], dim="day").values
+
+
+def shard(tmp_path, name):
+    with xarray.open_dataset(tmp_path / f"{name}_1979_1984.nc", mask_and_scale=False) as dataset:
+        return dataset["__xarray_dataarray_variable__"].load()
+
+
+# Every input is read and clipped once per year, however many products and cubes it feeds
+def test_each_input_is_read_once_per_year(builder, built, tmp_path):
+    builder.create_all_netcdf("inputs/", first_year=1979, end_year=1984)
+    assert sorted(built) == sorted((name, year) for name in builder.input_variables for year in range(1979, 1984))
+
+    days = (datetime.date(1984, 1, 1) - datetime.date(1979, 1, 1)).days
+    window = shard(tmp_path, "window")
+    assert window.shape == (days, 3, 4) and window.dtype == np.uint32
+    expected = builder.burn_window(*[record(name) for name in ["rmin", "rmax", "tmmn", "tmmx", "vs"]])
+    np.testing.assert_array_equal(window.values, expected)
+
+
+def test_variable_cubes_hold_the_inputs(builder, built, tmp_path):
+    builder.create_all_netcdf("inputs/", first_year=1979, end_year=1984)
+    for name in builder.variable_cubes:
+        with Dataset(tmp_path / f"{name}_1979_1984.nc") as cube:
+            values = cube[name][:]
+            expected = record(name)
+            np.testing.assert_array_equal(values.mask, np.isnan(expected))
+            np.testing.assert_allclose(values.filled(np.nan), expected, atol=1e-3)
+
+
+# A product needs nothing but its entry, and the build clips only the inputs something names
+def test_products_come_from_the_registry(builder, built, tmp_path, monkeypatch):
+    monkeypatch.setattr(builder, "products", {"wind_max": (["vs"], lambda vs: vs, np.float32, np.max, None)})
+    monkeypatch.setattr(builder, "variable_cubes", {})
+    builder.create_all_netcdf("inputs/", first_year=1979, end_year=1984)
+
+    assert {name for name, _ in built} == {"vs"}
+    np.testing.assert_array_equal(shard(tmp_path, "wind_max").values, record("vs").astype(np.float32))
+    assert sorted(os.listdir(tmp_path)) == ["wind_max_1979_1984.nc"]
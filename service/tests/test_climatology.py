@@ -0,0 +1,56 @@
+import io
+import datetime
+import numpy as np
+import pytest
+from conftest import shard_values, clip
+
+
+def day_number(year, month, day):
+    return (datetime.date(year, month, day) - datetime.date(1979, 1, 1)).days
+
+
+# Each year's April, reduced and finished the way /grid would, straight from the shards
+def april(shard_dir, product, year):
+    values = shard_values(shard_dir, product, day_number(year, 4, 1), day_number(year, 4, 30))
+    if product == "window":
+        return clip(values.sum("time").astype(np.float64)).values
+    return clip(values.max("time")).values
+
+
+def get_grid(client, query):
+    response = client.get(f'/climatology?{query}&format=npy')
+    assert response.status_code == 200
+    return np.load(io.BytesIO(response.data))
+
+
+@pytest.mark.parametrize("product", ["window", "temperature_max"])
+def test_month_climatology_and_anomaly(client, shard_dir, product):
+    expected = np.mean([april(shard_dir, product, year) for year in [1980, 1981, 1982]], axis=0)
+    climatology = get_grid(client, f'product={product}&start_year=1980&end_year=1982&month=4')
+    np.testing.assert_allclose(climatology, expected, rtol=1e-6)
+
+    anomaly = get_grid(client, f'product={product}&start_year=1980&end_year=1982&month=4&year=1983')
+    np.testing.assert_allclose(anomaly, april(shard_dir, product, 1983) - expected, rtol=1e-6, atol=1e-4)
+
+
+# Month windows read from the monthly rollups agree with the shards
+@pytest.mark.parametrize("product", ["window", "temperature_avg", "humidity_min"])
+def test_rollups_match_the_shards(client, derived, built_monthly, monkeypatch, product):
+    query = f'product={product}&start_year=1979&end_year=1983&month_start=11&month_end=12'
+    from_rollups = get_grid(client, query)
+    monkeypatch.setattr("flaskr.climatology.open_optional", lambda file_name: None)
+    from_shards = get_grid(client, query)
+    np.testing.assert_allclose(from_rollups, from_shards, rtol=1e-6)
+
+
+def test_day_of_year_window(client, shard_dir):
+    expected = np.mean([clip(shard_values(shard_dir, "window", day_number(year, 1, 1) + 59, day_number(year, 1, 1) + 89)
+                             .sum("time").astype(np.float64)).values for year in [1979, 1980]], axis=0)
+    np.testing.assert_allclose(get_grid(client, 'start_year=1979&end_year=1980&doy_start=60&doy_end=90'), expected)
+
+
+@pytest.mark.parametrize("query", ['start_year=1982&end_year=1980&month=4', 'start_year=1980&end_year=1990&month=4',
+                                   'start_year=1970&end_year=1980&month=4', 'start_year=1980&end_year=1982&month=13',
+                                   'start_year=1980&end_year=1982&doy_start=90&doy_end=60', 'start_year=1980&end_year=1982'])
+def test_bad_requests(client, query):
+    assert client.get(f'/climatology?{query}').status_code == 400
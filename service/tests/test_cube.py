@@ -0,0 +1,56 @@
+import os
+import json
+import numpy as np
+import pytest
+import flaskr
+from flaskr import aggregate
+from flaskr.cube import load_cubes
+
+
+@pytest.fixture
+def no_cubes(monkeypatch):
+    monkeypatch.setattr(aggregate, "cubes", {})
+    aggregate.aggregate_window_data.cache_clear()
+    yield
+    aggregate.aggregate_window_data.cache_clear()
+
+
+def grids(product):
+    return [aggregate.aggregate_window_data(product + ".nc", start, end).values for start, end in [(0, 30), (1000, 1825)]]
+
+
+@pytest.mark.parametrize("product", ["window", "temperature_avg", "humidity_min"])
+def test_cubes_give_the_shards_values(no_cubes, tmp_path, product):
+    expected = grids(product)
+    load_cubes(str(tmp_path), [product])
+    aggregate.aggregate_window_data.cache_clear()
+
+    cube, metadata = aggregate.cubes[product]
+    assert metadata["shard_begin"] == [1979] and cube.shape == (1826, 227, 249)
+    for values, expected_values in zip(grids(product), expected):
+        np.testing.assert_array_equal(values, expected_values)
+
+
+# Workers starting after the cube exists map it without reading a shard
+def test_existing_cubes_are_mapped_not_rebuilt(no_cubes, tmp_path, monkeypatch):
+    load_cubes(str(tmp_path), ["window"])
+    with open(tmp_path / "window.json") as metadata_file:
+        assert json.load(metadata_file)["dtype"] == "|u1"
+
+    monkeypatch.setattr(aggregate, "open_shard", lambda *args: pytest.fail("read a shard"))
+    aggregate.cubes.clear()
+    load_cubes(str(tmp_path), ["window"])
+    assert not aggregate.cubes["window"][0].flags.writeable
+
+
+def test_create_app_loads_the_configured_cubes(no_cubes, tmp_path):
+    flaskr.create_app({"TESTING": True, "CUBE_DIR": str(tmp_path), "CUBE_PRODUCTS": "humidity_min"})
+    assert list(aggregate.cubes) == ["humidity_min"]
+    assert sorted(os.listdir(tmp_path)) == ["humidity_min.cube", "humidity_min.json", "humidity_min.lock"]
+
+
+def test_missing_shards_leave_no_cube(no_cubes, tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregate, "data_dir", str(tmp_path / "empty") + "/")
+    with pytest.raises(FileNotFoundError):
+        load_cubes(str(tmp_path), ["window"])
+    assert not os.path.exists(tmp_path / "window.cube")
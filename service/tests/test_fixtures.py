@@ -0,0 +1,41 @@
+import os
+import json
+import numpy as np
+import xarray
+import fixtures
+import suite
+
+
+def test_shards_are_packed_like_the_builders(builder, shard_dir):
+    for name, (_, _, dtype, _, packing) in builder.products.items():
+        with xarray.open_dataset(os.path.join(shard_dir, f"{name}_1979_1984.nc"), mask_and_scale=False) as shard:
+            assert set(shard.variables) == {"__xarray_dataarray_variable__", "spatial_ref", "time", "lat", "lon"}
+            values = shard["__xarray_dataarray_variable__"]
+            assert values.dims == ("time", "lat", "lon") and values.shape == (1826, 227, 249)
+            assert values.dtype == dtype, name
+            if packing is not None:
+                assert (values.attrs["scale_factor"], values.attrs["add_offset"], values.attrs["_FillValue"]) == packing
+
+
+# A synthetic gridMET download clips to exactly the shards' grid
+def test_inputs_clip_to_the_shard_grid(builder, shard_dir, tmp_path):
+    path = str(tmp_path / "rmin_1980.nc")
+    fixtures.write_gridmet_year(path, "rmin", 1980)
+    clipped = builder.clip_to_cali(path)
+    assert clipped.shape[0] == 366
+
+    with xarray.open_dataset(os.path.join(shard_dir, "window_1979_1984.nc")) as shard:
+        np.testing.assert_allclose(clipped.coords['lat'].values, shard.coords['lat'].values)
+        np.testing.assert_allclose(clipped.coords['lon'].values, shard.coords['lon'].values)
+    inside = clipped.values[np.isfinite(clipped.values)]
+    assert inside.size and 0 <= inside.min() and inside.max() <= 100
+
+
+def test_compare_reports_regressions(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"results": [{"name": "fast", "median": 1.0}, {"name": "slow", "median": 1.0}]}))
+    results = [{"name": "fast", "median": 1.1}, {"name": "slow", "median": 1.5}, {"name": "new", "median": 9.0}]
+
+    assert suite.compare(results, str(baseline), 1.2) == ["slow"]
+    assert suite.compare(results, str(baseline), None) == []
+    assert "1.50x baseline" in capsys.readouterr().out
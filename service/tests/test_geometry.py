@@ -0,0 +1,49 @@
+import logging
+import numpy as np
+import fixtures
+import startup
+from flaskr import geometry
+
+lat, lon = fixtures.gridmet_lat[fixtures.california_rows], fixtures.gridmet_lon[fixtures.california_cols]
+
+
+# The committed artifacts are what rasterizing the shapefiles onto the shards' grid gives today
+def test_artifacts_match_the_shapefiles(tmp_path):
+    geometry.build_artifacts(lat, lon, str(tmp_path))
+    committed = geometry.load_artifacts()
+    for name in geometry.artifact_names:
+        np.testing.assert_array_equal(np.load(tmp_path / f"{name}.npy"), committed[name], err_msg=name)
+
+
+def test_grids_within_rounding_of_the_artifacts_match():
+    full = geometry.load_artifacts()["grid_lat"]
+    np.testing.assert_array_equal(geometry.grid_positions(full, full[20:60]), np.arange(20, 60))
+    np.testing.assert_array_equal(geometry.grid_positions(full, full[20:60].astype(np.float32)), np.arange(20, 60))
+    np.testing.assert_array_equal(geometry.grid_positions(full, np.nextafter(full[::3], 0)), np.arange(0, len(full), 3))
+
+    assert geometry.grid_positions(full, full[20:60] + 0.01) is None
+    assert geometry.grid_positions(full, np.array([full[5], full[5]])) is None
+    assert geometry.grid_positions(full, np.array([60.0])) is None
+
+
+def test_masks_of_part_of_the_grid_are_cut_from_the_artifacts():
+    mask = geometry.state_mask(lat, lon)
+    assert mask.shape == (227, 249) and mask.any() and not mask.all()
+    np.testing.assert_array_equal(geometry.state_mask(lat[50:90], lon[100:180]), mask[50:90, 100:180])
+
+    labels, geoids = geometry.county_labels(lat[50:90], lon[100:180])
+    np.testing.assert_array_equal(labels, geometry.county_labels(lat, lon)[0][50:90, 100:180])
+    assert len(geoids) == 58
+
+
+# A grid the artifacts don't cover is rasterized from the shapefile instead
+def test_other_grids_are_rasterized(caplog):
+    shifted_lat, shifted_lon = lat[::2] + 1 / 96, lon[::2] + 1 / 96
+    with caplog.at_level(logging.WARNING, logger="flaskr.geometry"):
+        mask = geometry.state_mask(shifted_lat, shifted_lon)
+    assert mask.shape == (len(shifted_lat), len(shifted_lon)) and mask.any()
+    assert "Rasterizing the state_mask shapefile" in caplog.text
+
+
+def test_startup_defers_heavy_imports():
+    assert startup.measure_startup()["modules"] == []
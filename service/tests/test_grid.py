@@ -0,0 +1,59 @@
+import io
+import numpy as np
+import xarray
+from conftest import shard_values, clip
+
+
+def window_days(shard_dir, first, last):
+    return clip(shard_values(shard_dir, "window", first, last).sum("time").astype(np.float64))
+
+
+def test_npy_matches_the_shards(client, shard_dir):
+    response = client.get('/grid?start_date=10&end_date=40&format=npy')
+    assert response.status_code == 200
+
+    expected = window_days(shard_dir, 10, 40)
+    values = np.load(io.BytesIO(response.data))
+    assert response.headers["X-Grid-Shape"] == f"{expected.shape[0]},{expected.shape[1]}"
+    np.testing.assert_array_equal(values, expected.values.astype(np.float32))
+
+
+def test_packed_products_are_unpacked(client, shard_dir):
+    response = client.get('/grid?start_date=100&end_date=130&product=temperature_avg&format=npy')
+    assert response.status_code == 200
+
+    expected = clip(shard_values(shard_dir, "temperature_avg", 100, 130).mean("time"))
+    np.testing.assert_allclose(np.load(io.BytesIO(response.data)), expected.values, rtol=1e-6)
+
+
+def test_netcdf_holds_the_grid_and_its_crs(client, shard_dir):
+    response = client.get('/grid?start_date=10&end_date=40')
+    assert response.status_code == 200
+
+    with xarray.open_dataset(io.BytesIO(response.data), engine="h5netcdf") as grid:
+        expected = window_days(shard_dir, 10, 40)
+        np.testing.assert_array_equal(grid["window"].values, expected.values.astype(np.float32))
+        np.testing.assert_allclose(grid.coords['lat'].values, expected.coords['lat'].values)
+        assert grid["window"].attrs["grid_mapping"] == "crs"
+        assert grid["crs"].attrs["epsg_code"] == "EPSG:4326"
+
+
+def test_quantized_grids_unpack_within_a_step(client, shard_dir):
+    response = client.get('/grid?start_date=10&end_date=40&format=uint16')
+    assert response.status_code == 200
+
+    scale, offset = float(response.headers["X-Scale-Factor"]), float(response.headers["X-Add-Offset"])
+    fill = int(response.headers["X-Fill-Value"])
+    shape = tuple(int(size) for size in response.headers["X-Grid-Shape"].split(","))
+    packed = np.frombuffer(response.data, dtype=response.headers["X-Grid-Dtype"]).reshape(shape)
+
+    expected = window_days(shard_dir, 10, 40).values
+    np.testing.assert_array_equal(packed == fill, np.isnan(expected))
+    np.testing.assert_allclose(packed[packed != fill] * scale + offset, expected[np.isfinite(expected)], atol=scale)
+
+
+def test_bad_requests(client):
+    for query in ['start_date=10', 'start_date=40&end_date=10', 'start_date=10&end_date=40&product=rain',
+                  'start_date=10&end_date=40&format=tiff', 'start_date=a&end_date=40',
+                  'start_date=10&end_date=4000', 'start_date=-4000&end_date=40']:
+        assert client.get(f'/grid?{query}').status_code == 400, query
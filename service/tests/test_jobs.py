@@ -0,0 +1,82 @@
+import os
+import json
+import threading
+import pytest
+from flaskr import jobs
+
+
+# Runs until released, reporting half its progress first, like a long query
+def held_work(release):
+    def work(output_dir, progress):
+        progress(0.5)
+        release.wait(30)
+        with open(output_dir + "result.txt", "w") as result:
+            result.write("done")
+    return work
+
+
+def forget(job_id):
+    with jobs.jobs_lock:
+        del jobs.jobs[job_id]
+
+
+def test_async_query_renders_into_its_job(client):
+    response = client.get('/query?start_date=0&end_date=30&async=1')
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    status = client.get(f'/jobs/{job_id}?wait=60').get_json()
+    assert status["status"] == "done" and status["progress"] == 1.0
+    assert set(status["resources"]) == {"burn_window.svg", "burn_legend.png", "temperature_avg.svg",
+                                        "temperature_avg_legend.png", "temperature_max.svg",
+                                        "temperature_max_legend.png", "humidity_min.svg", "humidity_min_legend.png"}
+    assert client.get(status["resources"]["burn_window.svg"]).status_code == 200
+    assert client.get(f'/jobs/{job_id}/status.json').status_code == 404
+
+
+# A worker that didn't run the job answers from the status file the running worker keeps
+def test_status_is_shared_through_the_jobs_directory(client):
+    release = threading.Event()
+    job_id = jobs.submit_job(held_work(release))
+    forget(job_id)
+
+    try:
+        status = client.get(f'/jobs/{job_id}?wait=2').get_json()
+        assert status["status"] == "running" and status["progress"] == 0.5
+    finally:
+        release.set()
+    assert client.get(f'/jobs/{job_id}?wait=30').get_json()["status"] == "done"
+
+    with open(jobs.job_output_dir(job_id) + "status.json") as status_file:
+        assert json.load(status_file)["finished"] is not None
+
+
+def test_failures_are_reported(client):
+    def work(output_dir, progress):
+        raise RuntimeError("no shards")
+
+    job_id = jobs.submit_job(work)
+    status = client.get(f'/jobs/{job_id}?wait=30').get_json()
+    assert (status["status"], status["error"]) == ("failed", "no shards")
+    assert "resources" not in status
+
+
+def test_full_queue_is_busy(client, monkeypatch):
+    monkeypatch.setattr(jobs, "max_pending", 0)
+    assert client.get('/query?start_date=0&end_date=30&async=1').status_code == 503
+
+
+def test_finished_jobs_expire(monkeypatch):
+    job_id = jobs.submit_job(lambda output_dir, progress: None)
+    assert jobs.get_job(job_id, 30)["status"] == "done"
+    forget(job_id)
+
+    monkeypatch.setattr(jobs, "job_ttl", -1)
+    jobs.expire_jobs()
+    assert not os.path.exists(jobs.job_output_dir(job_id))
+
+
+@pytest.mark.parametrize("path", ['/jobs/0123456789abcdef0123456789abcdef', '/jobs/..', '/jobs/../jobs',
+                                  '/jobs/0123456789abcdef0123456789abcdef/burn_window.svg'])
+def test_unknown_jobs(client, path):
+    assert client.get(path).status_code == 404
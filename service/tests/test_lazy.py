@@ -0,0 +1,81 @@
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pytest
+from flaskr import aggregate, lazy
+
+
+@pytest.fixture(autouse=True)
+def fresh_grids():
+    aggregate.aggregate_window_data.cache_clear()
+    yield
+    aggregate.aggregate_window_data.cache_clear()
+
+
+# Streaming in small chunks gives the same grids as reducing each slab at once
+@pytest.mark.parametrize("product", ["window", "temperature_avg", "temperature_max", "humidity_min"])
+def test_chunked_reductions_match_whole_slabs(monkeypatch, product):
+    ranges = [(0, 400), (200, 1825), (1000, 1000)]
+    monkeypatch.setattr(lazy, "chunk_limit", 1 << 40)
+    whole = [grid for grid, _ in aggregate.reduce_ranges(product + ".nc", ranges)]
+
+    chunks = []
+    reduce_days = lazy.reduce_days
+    monkeypatch.setattr(lazy, "reduce_days", lambda segment, first, last, *args: chunks.append(first) or
+                        reduce_days(segment, first, last, *args))
+    monkeypatch.setattr(lazy, "chunk_limit", 4 * 1024 * 1024)
+    streamed = [grid for grid, _ in aggregate.reduce_ranges(product + ".nc", ranges)]
+
+    assert len(chunks) > len(ranges)
+    for grid, expected in zip(streamed, whole):
+        np.testing.assert_array_equal(grid.values, expected.values)
+
+
+# Concurrent reductions never hold more slab bytes than memory_limit between them
+def test_reductions_stay_under_the_memory_limit(monkeypatch):
+    limit = 8 * 1024 * 1024
+    monkeypatch.setattr(lazy, "memory_limit", limit)
+    monkeypatch.setattr(lazy, "budget_free", limit)
+    monkeypatch.setattr(lazy, "chunk_limit", limit // lazy.lazy_threads)
+
+    held, peak, held_lock = [0], [0], threading.Lock()
+    reserve = lazy.reserve
+
+    @contextmanager
+    def counted_reserve(nbytes):
+        with reserve(nbytes):
+            with held_lock:
+                held[0] += min(nbytes, limit)
+                peak[0] = max(peak[0], held[0])
+            try:
+                yield
+            finally:
+                with held_lock:
+                    held[0] -= min(nbytes, limit)
+    monkeypatch.setattr(lazy, "reserve", counted_reserve)
+
+    threads = [threading.Thread(target=aggregate.reduce_ranges, args=(product + ".nc", [(0, 1825)]))
+               for product in ["window", "temperature_max", "humidity_min"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 0 < peak[0] <= limit
+    assert lazy.budget_free == limit
+
+
+def test_reserve_waits_for_the_budget(monkeypatch):
+    monkeypatch.setattr(lazy, "memory_limit", 100)
+    monkeypatch.setattr(lazy, "budget_free", 100)
+
+    released = threading.Event()
+    entered = []
+    with lazy.reserve(80):
+        waiter = threading.Thread(target=lambda: lazy.reserve(50).__enter__() or entered.append(released.is_set()))
+        waiter.start()
+        waiter.join(0.2)
+        assert entered == []
+        released.set()
+    waiter.join(5)
+    assert entered == [True]
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import random
+import subprocess
+import pytest
+import loadtest
+from conftest import service_dir, last_day
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("query:short:1,county:full:2.5") == [("query", "short", 1.0), ("county", "full", 2.5)]
+    for value in ["grid:short:1", "query:weekly:1", "query:short"]:
+        with pytest.raises(ValueError):
+            loadtest.parse_mix(value)
+
+
+def test_ranges_stay_in_the_record():
+    rng = random.Random(0)
+    assert loadtest.pick_range("full", 1979, 1984, False, rng) == (0, last_day)
+    assert loadtest.pick_range("long", 1979, 1984, False, rng) == (last_day - 5 * 365 + 1, last_day)
+    for _ in range(50):
+        start, end = loadtest.pick_range("medium", 1979, 1984, True, rng)
+        assert 0 <= start and end <= last_day and end - start == 364
+
+
+def tree_snapshot():
+    return {os.path.join(directory, name): os.stat(os.path.join(directory, name)).st_mtime
+            for directory, _, names in os.walk(os.path.join(service_dir, "flaskr")) for name in names
+            if "__pycache__" not in directory}
+
+
+# A short run over HTTP against the session's shards, which leaves the service directory as it was
+def test_load_test_run(shard_dir, tmp_path):
+    os.symlink(shard_dir, tmp_path / "shards")
+    os.symlink(os.path.join(service_dir, "flaskr", "geometry"), tmp_path / "geometry")
+    before = tree_snapshot()
+
+    subprocess.run([sys.executable, os.path.join(service_dir, "benchmarks", "loadtest.py"), "--data-dir", str(tmp_path),
+                    "--end-year", "1984", "--concurrency", "1,2", "--duration", "60", "--max-requests", "3",
+                    "--mix", "query:short:1,county:medium:1", "--server", "--output", str(tmp_path / "results.json")],
+                   cwd=service_dir, check=True, capture_output=True)
+
+    with open(tmp_path / "results.json") as results:
+        levels = json.load(results)["levels"]
+    assert [level["concurrency"] for level in levels] == [1, 2]
+    assert all(level["errors"] == 0 and level["latency"]["requests"] == 3 for level in levels)
+    assert tree_snapshot() == before
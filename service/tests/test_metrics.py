@@ -0,0 +1,54 @@
+import logging
+from prometheus_client import REGISTRY
+from flaskr import aggregate
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_grid_requests_are_timed_by_stage(client):
+    aggregate.aggregate_window_data.cache_clear()
+    before = {stage: sample("burn_window_stage_seconds_count", stage=stage) for stage in ["open", "read", "reduce", "clip", "encode"]}
+    requests = sample("burn_window_request_seconds_count", endpoint="/grid")
+    shard_bytes = sample("burn_window_bytes_read_total", source="shard")
+
+    assert client.get('/grid?start_date=0&end_date=9&product=temperature_max').status_code == 200
+
+    assert sample("burn_window_request_seconds_count", endpoint="/grid") == requests + 1
+    for stage, count in before.items():
+        assert sample("burn_window_stage_seconds_count", stage=stage) > count, stage
+    # Ten days of the int16 product over the whole grid
+    assert sample("burn_window_bytes_read_total", source="shard") == shard_bytes + 10 * 227 * 249 * 2
+
+
+def test_cache_lookups_are_counted(client):
+    aggregate.aggregate_window_data.cache_clear()
+    hits = sample("burn_window_cache_requests_total", cache="aggregate_window_data", result="hit")
+    misses = sample("burn_window_cache_requests_total", cache="aggregate_window_data", result="miss")
+
+    client.get('/grid?start_date=0&end_date=19')
+    client.get('/grid?start_date=0&end_date=19&format=npy')
+
+    assert sample("burn_window_cache_requests_total", cache="aggregate_window_data", result="miss") == misses + 1
+    assert sample("burn_window_cache_requests_total", cache="aggregate_window_data", result="hit") == hits + 1
+
+
+def test_metrics_endpoint(client):
+    client.get('/grid?start_date=0&end_date=19')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+
+    body = response.get_data(as_text=True)
+    assert 'burn_window_request_seconds_count{endpoint="/grid"}' in body
+    assert 'burn_window_lru_cache_requests_total{cache="tile",result="hit"}' in body
+
+
+# Every shard a range scan opens is logged at DEBUG
+def test_scans_are_logged(client, caplog):
+    aggregate.aggregate_window_data.cache_clear()
+    with caplog.at_level(logging.DEBUG, logger="flaskr"):
+        client.get('/grid?start_date=0&end_date=19')
+    assert [record.getMessage() for record in caplog.records if record.name == "flaskr.aggregate"] == \
+        ["Scanning 1 files for 1 ranges", "Opening file 1979-1984"]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from flaskr.aggregate import unpack
+
+
+def packings(builder):
+    return {name: (packing, dtype) for name, (_, _, dtype, _, packing) in builder.products.items() if packing is not None}
+
+
+# gridMET temperatures are on a 0.1 K step, so averages and maxima in °C pack without loss
+def test_temperatures_pack_exactly(builder):
+    rng = np.random.default_rng(0)
+    tmmn, tmmx = np.round(rng.uniform(250, 300, 1000), 1), np.round(rng.uniform(270, 320, 1000), 1)
+    for name, inputs in [("temperature_avg", (tmmn, tmmx)), ("temperature_max", (tmmx,))]:
+        (packing, dtype), derive = packings(builder)[name], builder.products[name][1]
+        values = derive(*inputs)
+        unpacked = unpack(builder.pack(values, packing, dtype), dict(zip(["scale_factor", "add_offset", "_FillValue"], packing)))
+        np.testing.assert_allclose(unpacked, values, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("name", ["temperature_avg", "temperature_max", "humidity_min"])
+def test_missing_and_extreme_values(builder, name):
+    (scale, offset, fill), dtype = packings(builder)[name]
+    limits = np.iinfo(dtype)
+    packed = builder.pack(np.array([np.nan, -1e9, 1e9]), (scale, offset, fill), dtype)
+    assert packed.dtype == dtype and packed[0] == fill
+    assert fill not in packed[1:] and limits.min <= packed.min() and packed.max() <= limits.max
+
+
+# A sum of packed days unpacks to the sum of the unpacked days
+def test_sums_unpack_with_the_day_count(builder):
+    packing, dtype = packings(builder)["temperature_avg"]
+    values = np.array([[12.35, -3.4], [20.0, 0.05], [7.5, 33.3]])
+    packed = builder.pack(values, packing, dtype)
+    attrs = dict(zip(["scale_factor", "add_offset", "_FillValue"], packing))
+    np.testing.assert_allclose(unpack(packed.sum(axis=0, dtype=np.int64), attrs, summed_days=3), values.sum(axis=0))
+    np.testing.assert_array_equal(unpack(np.array([packing[2], 10]), attrs), [np.nan, 0.5])
@@ -0,0 +1,64 @@
+import io
+import numpy as np
+import pytest
+from flaskr.histogram import histogram_counts
+from flaskr.percentiles import histogram_percentile, percentile_grid
+from conftest import shard_values, clip
+
+# Starts and ends mid-month, so whole months come from the histograms and the rest from the shards
+start_date, end_date = 45, 400
+
+
+@pytest.fixture(autouse=True)
+def fresh_percentiles():
+    percentile_grid.cache_clear()
+
+
+@pytest.fixture
+def histograms(derived, built_histograms, builder):
+    return builder.histograms
+
+
+def expected_counts(shard_dir, product, bins):
+    values = shard_values(shard_dir, product, start_date, end_date)
+    return values, histogram_counts(values.values, *bins)
+
+
+@pytest.mark.parametrize("product", ["temperature_avg", "humidity_min"])
+def test_distribution_counts_every_day(client, shard_dir, histograms, product):
+    response = client.get(f'/distribution?product={product}&lat=36.5&lon=-119.5&start_date={start_date}&end_date={end_date}')
+    assert response.status_code == 200
+    result = response.get_json()
+
+    values, counts = expected_counts(shard_dir, product, histograms[product])
+    cell = values.sel(lat=36.5, lon=-119.5, method="nearest")
+    i, j = list(values.lat.values).index(cell.lat), list(values.lon.values).index(cell.lon)
+    assert result["counts"] == counts[i, j].tolist()
+    assert sum(result["counts"]) == end_date - start_date + 1
+    assert result["bin_edges"][0] == histograms[product][0]
+
+
+@pytest.mark.parametrize("q", [10, 50, 90])
+def test_percentiles_interpolate_within_a_bin(client, shard_dir, histograms, q):
+    response = client.get(f'/percentile?product=temperature_max&q={q}&start_date={start_date}&end_date={end_date}&format=npy')
+    assert response.status_code == 200
+    grid = np.load(io.BytesIO(response.data))
+
+    low, width, bins = histograms["temperature_max"]
+    values, counts = expected_counts(shard_dir, "temperature_max", histograms["temperature_max"])
+    expected = clip(values.isel(time=0).copy(data=histogram_percentile(counts, q, low, width)))
+    np.testing.assert_allclose(grid, expected.values, rtol=1e-6)
+
+    exact = clip(values.quantile(q / 100, dim="time")).values
+    assert np.nanmax(np.abs(grid - exact)) <= width
+
+
+def test_histograms_are_needed(client):
+    assert client.get(f'/percentile?q=50&start_date={start_date}&end_date={end_date}').status_code == 400
+
+
+@pytest.mark.parametrize("query", ['q=50&start_date=-40&end_date=400', 'q=50&start_date=45&end_date=2000',
+                                   'q=50&start_date=400&end_date=45', 'q=101&start_date=45&end_date=400',
+                                   'q=50&start_date=45&end_date=400&product=window'])
+def test_bad_requests(client, histograms, query):
+    assert client.get(f'/percentile?{query}').status_code == 400
@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import pytest
+from conftest import shard_values
+
+query = '/point?lat=37.02&lon=-119.98&start_date=300&end_date=420&products=window,temperature_avg,humidity_min'
+
+
+def expected_series(shard_dir, product, lat, lon, first, last):
+    values = shard_values(shard_dir, product, first, last).sel(lat=lat, lon=lon, method="nearest")
+    return values.values.astype(np.float64).tolist(), float(values.lat), float(values.lon)
+
+
+def check_point(response, shard_dir):
+    assert response.status_code == 200
+    result = response.get_json()
+    for product in ["window", "temperature_avg", "humidity_min"]:
+        series, lat, lon = expected_series(shard_dir, product, 37.02, -119.98, 300, 420)
+        assert result["series"][product] == series
+        assert (result["lat"], result["lon"]) == (lat, lon)
+
+
+def test_series_from_the_shards(client, shard_dir):
+    check_point(client.get(query), shard_dir)
+
+
+# The pixel-major file gives the same float64 values as the shards
+def test_series_from_the_pixel_major_file(client, shard_dir, derived, built_pixels):
+    assert os.path.exists(os.path.join(derived, "humidity_min_pixels.nc"))
+    check_point(client.get(query), shard_dir)
+
+
+@pytest.mark.parametrize("args", ['lat=37&lon=-120&start_date=420&end_date=300', 'lat=37&lon=-120&start_date=300',
+                                  'lat=north&lon=-120&start_date=300&end_date=420', 'lat=20&lon=-120&start_date=300&end_date=420',
+                                  'lat=37&lon=-120&start_date=300&end_date=420&products=rain'])
+def test_bad_requests(client, args):
+    assert client.get(f'/point?{args}').status_code == 400
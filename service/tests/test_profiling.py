@@ -0,0 +1,48 @@
+import pstats
+import pytest
+import flaskr
+
+token = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def client():
+    return flaskr.create_app({"TESTING": True, "PROFILE_TOKEN": "secret"}).test_client()
+
+
+def test_admins_get_a_profile(client, tmp_path):
+    response = client.get('/county?start_date=0&end_date=30&profile=1', headers=token)
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    report = client.get(f'/profiles/{profile_id}?limit=10', headers=token).get_json()
+    assert (report["path"], report["args"]) == ("/county", {"start_date": "0", "end_date": "30", "profile": "1"})
+    assert "(county)" in report["stats"] and report["allocations"]
+
+    raw = client.get(f'/profiles/{profile_id}/raw', headers=token)
+    assert raw.status_code == 200
+    path = tmp_path / "county.prof"
+    path.write_bytes(raw.data)
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+def test_other_requests_are_not_profiled(client):
+    assert "X-Profile-Id" not in client.get('/county?start_date=0&end_date=30').headers
+    assert "X-Profile-Id" not in client.get('/county?start_date=0&end_date=30&profile=1').headers
+    assert "X-Profile-Id" not in client.get('/county?start_date=0&end_date=30&profile=1',
+                                            headers={"X-Admin-Token": "guess"}).headers
+
+
+def test_profiles_are_for_admins_only(client):
+    profile_id = client.get('/county?start_date=0&end_date=30', headers=dict(token, **{"X-Profile": "1"})).headers["X-Profile-Id"]
+    assert client.get(f'/profiles/{profile_id}').status_code == 403
+    assert client.get(f'/profiles/{profile_id}/raw', headers={"X-Admin-Token": "guess"}).status_code == 403
+    assert client.get('/profiles/0123456789abcdef0123456789abcdef', headers=token).status_code == 404
+    assert client.get('/profiles/..%2F..%2Fjobs', headers=token).status_code == 404
+
+
+# Without a configured token nobody is an admin
+def test_profiling_is_off_without_a_token():
+    client = flaskr.create_app({"TESTING": True}).test_client()
+    assert "X-Profile-Id" not in client.get('/county?start_date=0&end_date=30&profile=1', headers=token).headers
+    assert client.get('/profiles/0123456789abcdef0123456789abcdef', headers=token).status_code == 403
@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from flaskr import aggregate
+from flaskr.singleflight import coalesce, single_flight
+
+
+# work wrapped so every call is counted, and held until release is set
+def counted(work, release=None):
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if release is not None:
+            release.wait(10)
+        return work(*args, **kwargs)
+    return wrapper, calls
+
+
+def test_concurrent_callers_share_one_call():
+    release = threading.Event()
+    work, calls = counted(lambda: object(), release)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(single_flight, "key", work) for _ in range(8)]
+        threading.Event().wait(0.5)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    release = threading.Event()
+
+    def fail(value):
+        raise ValueError("no shards")
+    held, calls = counted(fail, release)
+
+    @coalesce(maxsize=4)
+    def work(value):
+        return held(value)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(work, 1) for _ in range(4)]
+        threading.Event().wait(0.5)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+    assert len(calls) == 1
+    with pytest.raises(ValueError):
+        work(1)
+    assert len(calls) == 2
+
+
+def test_arguments_are_bound_before_keying():
+    held, calls = counted(lambda start, end, bbox: (start, end, bbox))
+
+    @coalesce(maxsize=4)
+    def work(start, end, bbox=None):
+        return held(start, end, bbox)
+
+    assert work(1, 2) == work(1, end=2) == work(start=1, end=2, bbox=None) == (1, 2, None)
+    assert len(calls) == 1
+
+
+def test_least_recently_used_results_are_dropped():
+    held, calls = counted(lambda value: value)
+
+    @coalesce(maxsize=2)
+    def work(value):
+        return held(value)
+
+    work(1), work(2), work(1), work(3)
+    work(1)
+    assert len(calls) == 3
+    work(2)
+    assert len(calls) == 4
+
+
+# Identical /grid requests arriving together scan the shards once
+def test_identical_grid_requests_scan_once(client, monkeypatch):
+    release = threading.Event()
+    reduce_range, calls = counted(aggregate.reduce_range, release)
+    monkeypatch.setattr(aggregate, "reduce_range", reduce_range)
+    aggregate.aggregate_window_data.cache_clear()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(lambda: client.get('/grid?start_date=500&end_date=530&format=npy')) for _ in range(4)]
+        threading.Event().wait(0.5)
+        release.set()
+        responses = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(response.status_code == 200 and response.data == responses[0].data for response in responses)
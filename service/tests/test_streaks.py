@@ -0,0 +1,51 @@
+import io
+import numpy as np
+import pytest
+from flaskr.streaks import streak_grids
+from conftest import shard_values, clip, last_day
+
+
+@pytest.fixture(autouse=True)
+def fresh_streaks():
+    streak_grids.cache_clear()
+
+
+# Longest run and number of runs of at least min_length days per cell, walking the days in order
+def expected_streaks(shard_dir, first, last, min_length):
+    window = shard_values(shard_dir, "window", first, last)
+    current = np.zeros(window.shape[1:], dtype=np.int64)
+    longest, runs = np.zeros_like(current), np.zeros_like(current)
+    for day in window.values > 0:
+        runs += ~day & (current >= min_length)
+        current = np.where(day, current + 1, 0)
+        longest = np.maximum(longest, current)
+    runs += current >= min_length
+
+    grid = window.isel(time=0, drop=True)
+    return clip(grid.copy(data=longest.astype(np.float64))), clip(grid.copy(data=runs.astype(np.float64)))
+
+
+def get_grid(client, query):
+    response = client.get(f'/streaks?{query}&format=npy')
+    assert response.status_code == 200
+    return np.load(io.BytesIO(response.data))
+
+
+@pytest.mark.parametrize("first, last", [(0, 90), (300, 700), (1700, last_day)])
+def test_streaks_match_the_daily_window(client, shard_dir, derived, built_runs, first, last):
+    longest, runs = expected_streaks(shard_dir, first, last, 3)
+    assert np.nanmax(longest.values) >= 3
+    np.testing.assert_array_equal(get_grid(client, f'start_date={first}&end_date={last}'), longest.values)
+    np.testing.assert_array_equal(get_grid(client, f'start_date={first}&end_date={last}&stat=runs&min_length=3'),
+                                  runs.values)
+
+
+def test_runs_file_is_needed(client):
+    assert client.get('/streaks?start_date=0&end_date=90').status_code == 400
+
+
+@pytest.mark.parametrize("query", ['start_date=-10&end_date=90', f'start_date=1700&end_date={last_day + 1}',
+                                   'start_date=90&end_date=0', 'start_date=0&end_date=90&stat=mean',
+                                   'start_date=0&end_date=90&stat=runs&min_length=0'])
+def test_bad_requests(client, derived, built_runs, query):
+    assert client.get(f'/streaks?{query}').status_code == 400
@@ -0,0 +1,73 @@
+import io
+import os
+import math
+import numpy as np
+import pytest
+from PIL import Image
+from flaskr import tiles
+
+
+# XYZ tile holding lat/lon at zoom z
+def tile_at(lat, lon, z):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+@pytest.fixture(autouse=True)
+def fresh_tiles():
+    tiles.get_tile.cache_clear()
+    yield
+    tiles.get_tile.cache_clear()
+
+
+def cached_tiles():
+    return [os.path.join(directory, name) for directory, _, names in os.walk(tiles.tile_cache_dir) for name in names]
+
+
+def test_tile_over_the_state(client):
+    x, y = tile_at(37.0, -120.0, 6)
+    response = client.get(f'/tiles/window/6/{x}/{y}.png?start_date=0&end_date=30')
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.headers["Cache-Control"] == "public, max-age=86400"
+
+    image = np.asarray(Image.open(io.BytesIO(response.data)))
+    assert image.shape == (tiles.tile_size, tiles.tile_size, 4)
+    assert (image[..., 3] == 255).any() and (image[..., 3] == 0).any()
+    assert len(cached_tiles()) == 1
+
+
+def test_tiles_off_the_grid_are_empty_and_not_cached(client):
+    response = client.get('/tiles/window/6/0/0.png?start_date=0&end_date=30')
+    assert response.status_code == 200
+    assert response.data == tiles.empty_tile()
+    assert cached_tiles() == []
+
+
+# A tile missing from memory is read back from the disk cache instead of being rendered again
+def test_tiles_are_served_from_the_disk_cache(client, monkeypatch):
+    x, y = tile_at(37.0, -120.0, 7)
+    first = client.get(f'/tiles/temperature_max/7/{x}/{y}.png?start_date=0&end_date=30').data
+
+    tiles.get_tile.cache_clear()
+    monkeypatch.setattr(tiles, "render_tile", lambda *args: pytest.fail("rendered a cached tile"))
+    assert client.get(f'/tiles/temperature_max/7/{x}/{y}.png?start_date=0&end_date=30').data == first
+
+
+def test_cache_is_kept_under_its_size(client, monkeypatch):
+    monkeypatch.setattr(tiles, "tile_cache_max_bytes", 1)
+    for z in [6, 7, 8]:
+        x, y = tile_at(37.0, -120.0, z)
+        assert client.get(f'/tiles/window/{z}/{x}/{y}.png?start_date=0&end_date=30').status_code == 200
+    assert len(cached_tiles()) <= 1
+
+
+@pytest.mark.parametrize("path", ['/tiles/window/13/0/0.png?start_date=0&end_date=30',
+                                  '/tiles/window/2/4/0.png?start_date=0&end_date=30',
+                                  '/tiles/rain/2/0/0.png?start_date=0&end_date=30',
+                                  '/tiles/window/2/0/0.png?start_date=30&end_date=0',
+                                  '/tiles/window/2/0/0.png?start_date=0&end_date=9000'])
+def test_bad_requests(client, path):
+    assert client.get(path).status_code == 400
@@ -0,0 +1,97 @@
+import io
+import numpy as np
+import xarray
+import pytest
+from netCDF4 import Dataset
+import fixtures
+from flaskr import aggregate, thresholds
+from conftest import clip
+
+lat, lon = fixtures.gridmet_lat[fixtures.california_rows], fixtures.gridmet_lon[fixtures.california_cols]
+
+# The cubes hold the first cube_days days of the record, which is all the tests ask for
+cube_days = 62
+
+
+# Variable cubes laid out as the builder writes them, packed as gridMET packs them, from March on
+@pytest.fixture(scope="module")
+def cube_dir(builder, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("cubes")
+    rng = np.random.default_rng(0)
+    for name in thresholds.variables:
+        _, scale, offset, _, (low, high) = fixtures.gridmet_variables[name]
+        with Dataset(directory / f"{name}_1979_1984.nc", "w", format="NETCDF4") as cube:
+            cube.createDimension("time", cube_days)
+            cube.createDimension("lat", len(lat))
+            cube.createDimension("lon", len(lon))
+            builder.write_lat_lon(cube, lat, lon)
+            values = cube.createVariable(name, "u2", ("time", "lat", "lon"), fill_value=np.uint16(65535))
+            values.scale_factor, values.add_offset = builder.variable_cubes[name]
+            values[:] = fixtures.seasonal_field(rng, 60, cube_days, lat, lon, low, high)
+    return str(directory)
+
+
+@pytest.fixture(autouse=True)
+def cubes(cube_dir, monkeypatch):
+    monkeypatch.setattr(aggregate, "data_dir", cube_dir + "/")
+    thresholds.threshold_window.cache_clear()
+
+
+# Days each cell meets every bound, compared on the unpacked values
+def expected_days(cube_dir, bounds, first, last):
+    meets = True
+    for name in thresholds.variables:
+        with xarray.open_dataset(f"{cube_dir}/{name}_1979_1984.nc", mask_and_scale=False) as cube:
+            stored = cube[name][first:last + 1].values
+            scale, offset = cube[name].attrs["scale_factor"], cube[name].attrs["add_offset"]
+        values = np.round(stored * scale + offset, 6)
+        low, high = bounds[name]
+        meets = meets & (stored != 65535) & (values >= (-np.inf if low is None else low)) \
+            & (values <= (np.inf if high is None else high))
+    days = xarray.DataArray(meets.sum(axis=0).astype(np.float64), coords=[lat, lon], dims=['lat', 'lon'])
+    return clip(days)
+
+
+def get_window(client, query):
+    response = client.get(f'/window?{query}')
+    assert response.status_code == 200
+    with xarray.open_dataset(io.BytesIO(response.data), engine="h5netcdf") as grid:
+        return grid["window"].load()
+
+
+def test_default_thresholds(client, cube_dir):
+    grid = get_window(client, 'start_date=5&end_date=40')
+    expected = expected_days(cube_dir, thresholds.default_thresholds, 5, 40)
+    assert np.nanmax(expected.values) > 0
+    np.testing.assert_array_equal(grid.values, expected.values)
+
+
+def test_custom_thresholds(client, cube_dir):
+    grid = get_window(client, 'start_date=0&end_date=61&rmin_min=25&rmax_max=70.05&vs_max=none&tmmx_max=300.5')
+    bounds = dict(thresholds.default_thresholds, rmin=(25, None), rmax=(None, 70.05), vs=(2, None), tmmx=(None, 300.5))
+    expected = expected_days(cube_dir, bounds, 0, 61)
+    assert np.nanmax(expected.values) > np.nanmin(expected.values)
+    np.testing.assert_array_equal(grid.values, expected.values)
+
+
+def test_bounding_box(client):
+    whole = get_window(client, 'start_date=0&end_date=30&rmax_max=70')
+    boxed = get_window(client, 'start_date=0&end_date=30&rmax_max=70&bbox=-121,36,-119,38')
+    np.testing.assert_array_equal(boxed.values, whole.sel(lat=boxed.lat, lon=boxed.lon).values)
+
+
+@pytest.mark.parametrize("query", ['start_date=0&end_date=30&rmin_min=inf', 'start_date=0&end_date=30&vs_max=-Infinity',
+                                   'start_date=0&end_date=30&tmmn_min=nan', 'start_date=0&end_date=30&rmax_max=wet',
+                                   'start_date=30&end_date=0', 'start_date=0&end_date=4000', 'start_date=0',
+                                   'start_date=0&end_date=30&format=png'])
+def test_bad_requests(client, query):
+    assert client.get(f'/window?{query}').status_code == 400
+
+
+def test_packed_bounds():
+    attrs = {"scale_factor": 0.1, "add_offset": 220.0, "_FillValue": 65535}
+    assert thresholds.packed_bounds(237.15, None, attrs) == (172, 65534)
+    assert thresholds.packed_bounds(None, 305.1, attrs) == (0, 851)
+    # Bounds below everything the packing can hold leave nothing between them
+    low, high = thresholds.packed_bounds(100.0, 200.0, attrs)
+    assert high < low